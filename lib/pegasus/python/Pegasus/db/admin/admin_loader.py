@@ -36,7 +36,7 @@ log = logging.getLogger(__name__)
 # -------------------------------------------------------------------
 # DB Admin configuration
 # -------------------------------------------------------------------
-CURRENT_DB_VERSION = 8
+CURRENT_DB_VERSION = 10
 DB_MIN_VERSION = 4
 
 COMPATIBILITY = {
@@ -45,7 +45,8 @@ COMPATIBILITY = {
     '4.5.0': 4, '4.5.1': 4, '4.5.2': 4, '4.5.3': 4, '4.5.4': 5,
     '4.6.0': 6, '4.6.1': 6, '4.6.2': 6,
     '4.7.0': 8, '4.7.3': 8,
-    '4.8.0': 8
+    '4.8.0': 8,
+    '4.9.0': 10
 }
 
 
@@ -5,6 +5,7 @@ import sys
 
 from Pegasus.command import LoggingCommand, CompoundCommand
 from Pegasus.db import connection
+from Pegasus.db import summary
 from Pegasus.db.admin.admin_loader import *
 from Pegasus.db.admin.versions import *
 
@@ -200,6 +201,43 @@ class VersionCommand(LoggingCommand):
             exit(1)
 
 
+# ------------------------------------------------------
+class RebuildCommand(LoggingCommand):
+    description = "Rebuild the summary tables of a workflow database."
+    usage = "Usage: %prog rebuild [options] [DATABASE_URL]"
+
+    def __init__(self):
+        LoggingCommand.__init__(self)
+        _add_common_options(self)
+
+    def run(self):
+        _set_log_level(self.options.debug)
+
+        dburi = None
+        if len(self.args) > 0:
+            dburi = self.args[0]
+
+        try:
+            _validate_conf_type_options(dburi, self.options.properties, self.options.config_properties,
+                                        self.options.submit_dir,
+                                        self.options.db_type)
+            db = _get_connection(dburi, self.options.properties, self.options.config_properties,
+                                 self.options.submit_dir,
+                                 self.options.db_type, force=self.options.force)
+            try:
+                count = summary.rebuild_summaries(db)
+                db.commit()
+            except Exception, e:
+                db.rollback()
+                raise DBAdminError(e, db=db)
+            print "Summarized %d workflows." % count
+            db.close()
+
+        except (DBAdminError, connection.ConnectionError), e:
+            log.error(e)
+            exit(1)
+
+
 # ------------------------------------------------------
 def _print_version(data):
     if data:
@@ -292,14 +330,16 @@ class DBAdminCommand(CompoundCommand):
         ('downgrade', DowngradeCommand),
         ('update', UpdateCommand),
         ('check', CheckCommand),
-        ('version', VersionCommand)
+        ('version', VersionCommand),
+        ('rebuild', RebuildCommand)
     ]
     aliases = {
         "c": "create",
         "d": "downgrade",
         "u": "update",
         "k": "check",
-        "v": "version"
+        "v": "version",
+        "r": "rebuild"
     }
     epilog = \
         """The pegasus-db-admin tool should always be followed by a COMMAND listed
@@ -0,0 +1,71 @@
+import logging
+
+from Pegasus.db.admin.admin_loader import *
+from Pegasus.db.admin.versions.base_version import BaseVersion
+from Pegasus.db.schema import *
+from sqlalchemy.exc import *
+
+DB_VERSION = 10
+
+log = logging.getLogger(__name__)
+
+# Indexes used by the statistics and dashboard queries to walk from a
+# root workflow to its sub-workflows, and from a job instance to its
+# latest state, and by the ON DELETE actions of foreign keys.
+INDEXES = [
+    (st_workflow, 'wf_root_wf_id_COL'),
+    (st_workflow, 'wf_parent_wf_id_COL'),
+    (st_job_instance, 'job_instance_host_id_COL'),
+    (st_job_instance, 'job_instance_subwf_id_COL'),
+    (st_jobstate, 'jobstate_submit_seq_COL'),
+    (st_task, 'task_job_id_COL')
+]
+
+class Version(BaseVersion):
+
+    def __init__(self, connection):
+        super(Version, self).__init__(connection)
+
+    def update(self, force=False):
+        """
+        Create the indexes of existing stampede tables.
+        :param force:
+        :return:
+        """
+        log.info("Updating to version %s" % DB_VERSION)
+        for table, name in INDEXES:
+            # Master and JDBCRC databases have no stampede tables
+            if not check_table_exists(self.db, table):
+                continue
+            try:
+                log.info("Creating index %s..." % name)
+                _get_index(table, name).create(self.db.get_bind())
+            except (OperationalError, ProgrammingError):
+                # The index already exists
+                pass
+            except Exception, e:
+                self.db.rollback()
+                log.exception(e)
+                raise Exception(e)
+
+        self.db.commit()
+
+    def downgrade(self, force=False):
+        "Drop the indexes"
+        for table, name in INDEXES:
+            try:
+                _get_index(table, name).drop(self.db.get_bind())
+            except (OperationalError, ProgrammingError):
+                pass
+            except Exception, e:
+                self.db.rollback()
+                log.exception(e)
+                raise Exception(e)
+
+        self.db.commit()
+
+def _get_index(table, name):
+    for index in table.indexes:
+        if index.name == name:
+            return index
+    raise KeyError(name)
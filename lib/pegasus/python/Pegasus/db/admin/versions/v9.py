@@ -0,0 +1,67 @@
+import logging
+
+from Pegasus.db.admin.admin_loader import *
+from Pegasus.db.admin.versions.base_version import BaseVersion
+from Pegasus.db.schema import *
+from Pegasus.db import summary
+from sqlalchemy.exc import *
+
+DB_VERSION = 9
+
+log = logging.getLogger(__name__)
+
+class Version(BaseVersion):
+
+    def __init__(self, connection):
+        super(Version, self).__init__(connection)
+
+    def update(self, force=False):
+        """
+        Create the summary tables, and summarize the workflows that
+        are already in the database.
+        :param force:
+        :return:
+        """
+        log.info("Updating to version %s" % DB_VERSION)
+        for table in (st_workflow_summary, st_transformation_summary, st_host_summary):
+            try:
+                log.info("Creating %s..." % table.name)
+                table.create(self.db.get_bind(), checkfirst=True)
+            except (OperationalError, ProgrammingError):
+                pass
+            except Exception, e:
+                self.db.rollback()
+                log.exception(e)
+                raise Exception(e)
+
+        # Master and JDBCRC databases have no workflows to summarize
+        if not check_table_exists(self.db, st_workflowstate):
+            return
+
+        try:
+            log.info("Summarizing workflows...")
+            summary.rebuild_summaries(self.db)
+        except (OperationalError, ProgrammingError), e:
+            self.db.rollback()
+            log.warning("Unable to summarize workflows: %s" % e)
+            return
+        except Exception, e:
+            self.db.rollback()
+            log.exception(e)
+            raise Exception(e)
+
+        self.db.commit()
+
+    def downgrade(self, force=False):
+        "Drop the summary tables, they are rebuilt on update"
+        for table in ("host_summary", "transformation_summary", "workflow_summary"):
+            try:
+                self.db.execute("DROP TABLE %s" % table)
+            except (OperationalError, ProgrammingError):
+                pass
+            except Exception, e:
+                self.db.rollback()
+                log.exception(e)
+                raise Exception(e)
+
+        self.db.commit()
@@ -2,14 +2,32 @@ import time
 import logging
 
 from Pegasus.db import connection
+from Pegasus.db.loader_stats import LoaderStats
 from sqlalchemy import exc
 
 class BaseLoader(object):
     "Base loader class. Has a database session and a log handle."
 
-    def __init__(self, dburi, batch=True, props=None, db_type=None, backup=False, flush_every=1000):
+    MAX_FLUSH_INTERVAL = 30 # seconds between time based flushes
+    MIN_FLUSH_INTERVAL = 1 # lowest time based flush interval with adaptive flushing
+    MIN_FLUSH_EVERY = 100 # bounds of the flush count with adaptive flushing
+    MAX_FLUSH_EVERY = 10000
+    MAX_FLUSH_BYTES = 4 * 1024 * 1024 # estimated size of the queued events that triggers a flush
+    TARGET_FLUSH_TIME = 2.0 # seconds a count based flush should take with adaptive flushing
+    FLUSH_TIME_FRACTION = 0.1 # fraction of the time spent in time based flushes with adaptive flushing
+    STATS_INTERVAL = 60 # seconds between stats reports in perf mode
+
+    def __init__(self, dburi, batch=True, props=None, db_type=None, backup=False, flush_every=1000,
+                 adaptive_flush=False, stats_file=None):
         """Will be overridden by subclasses to take
         parameters specific to their function.
+
+        With adaptive_flush, flush_every is only the initial flush
+        count, and both the flush count and the flush interval are
+        tuned to the time flushes take, see tune_flush().
+
+        In perf mode, the loader stats are logged every STATS_INTERVAL
+        seconds, and also written as JSON to stats_file, if given.
         """
         self.log = logging.getLogger("%s.%s" % (self.__module__, self.__class__.__name__))
         self.dburi = dburi
@@ -19,7 +37,21 @@ class BaseLoader(object):
         self._batch = batch
         self._flush_every = flush_every
         self._flush_count = 0
+        self._flush_bytes = 0
         self._last_flush = time.time()
+        self._adaptive_flush = adaptive_flush
+        self._flush_interval = self.MAX_FLUSH_INTERVAL
+
+        # counters for batches that hit integrity errors
+        self._integrity_error_batches = 0
+        self._bisect_commits = 0
+        self._rejected_events = 0
+
+        # counters and histograms, reported in perf mode
+        self._perf = False
+        self.stats = LoaderStats()
+        self._stats_file = stats_file
+        self._last_stats = time.time()
 
     def process(self, data):
         """Override with logic; 'data' is a dictionary with timestamp,
@@ -31,26 +63,90 @@ class BaseLoader(object):
         "Try to flush the batch"
         self.check_flush()
 
-    def check_flush(self, increment=False):
+    def check_flush(self, increment=False, size=0):
         """
         Check to see if the batch needs to be flushed based on
-        either the number of queued inserts or based on time
-        since last flush.
+        either the number of queued inserts, their estimated size
+        in bytes or based on time since last flush.
         """
         if not self._batch:
             return
 
         if increment:
             self._flush_count += 1
+            self._flush_bytes += size
 
         if self._flush_count >= self._flush_every:
-            self.log.debug('Flush: flush count')
-            self.hard_flush()
+            self.timed_flush('flush count')
+            return
+
+        if self._flush_bytes >= self.MAX_FLUSH_BYTES:
+            self.timed_flush('flush bytes')
+            return
+
+        elapsed = time.time() - self._last_flush
+        if elapsed > self._flush_interval and (self._flush_count > 0 or elapsed > self.MAX_FLUSH_INTERVAL):
+            self.timed_flush('time based')
+
+    def timed_flush(self, reason):
+        "Flush the batch, and tune the flush thresholds to how long it took"
+        self.log.debug('Flush: %s', reason)
+        self.stats.count('flush.' + reason.replace(' ', '_'))
+        events = self._flush_count
+        start = time.time()
+        self.hard_flush()
+        self.tune_flush(events, time.time() - start)
+
+    def tune_flush(self, events, duration):
+        """
+        With adaptive flushing, set the flush count so that flushes
+        take about TARGET_FLUSH_TIME seconds, and the flush interval
+        so that time based flushes take about FLUSH_TIME_FRACTION of
+        the time. That is, we flush more events at once when the
+        database is slow or busy, and flush more often when it is
+        fast, so the database lags less behind the workflow.
+        """
+        if not self._adaptive_flush or events == 0:
+            return
+
+        if duration > 0:
+            flush_every = int(events * self.TARGET_FLUSH_TIME / duration)
+        else:
+            flush_every = self.MAX_FLUSH_EVERY
+        # Change the flush count gradually, one flush may be an outlier
+        flush_every = max(self._flush_every / 2, min(self._flush_every * 2, flush_every))
+        self._flush_every = max(self.MIN_FLUSH_EVERY, min(self.MAX_FLUSH_EVERY, flush_every))
+        self._flush_interval = max(self.MIN_FLUSH_INTERVAL,
+                                   min(self.MAX_FLUSH_INTERVAL, duration / self.FLUSH_TIME_FRACTION))
+        self.log.debug('Flushed %d events in %.3fs: flush_every=%d flush_interval=%.1fs',
+                       events, duration, self._flush_every, self._flush_interval)
+
+    def report_stats(self, force=False):
+        """
+        In perf mode, log a summary of the stats, and write them to the
+        stats file, if STATS_INTERVAL seconds passed since the last
+        report, or if force is True.
+        """
+        if not self._perf:
+            return
+        if not force and time.time() - self._last_stats < self.STATS_INTERVAL:
             return
 
-        if (time.time() - self._last_flush) > 30:
-            self.log.debug('Flush: time based')
-            self.hard_flush()
+        self._last_stats = time.time()
+        self.log.info('Loader stats: %s', self.stats.summary())
+        if self._stats_file is not None:
+            try:
+                self.stats.write(self._stats_file)
+            except (IOError, OSError), e:
+                self.log.warning('Cannot write loader stats to %s: %s', self._stats_file, e)
+
+    def event_size(self, data):
+        "Estimate the size in bytes of an event, from its string values"
+        size = 0
+        for v in data.itervalues():
+            if isinstance(v, basestring):
+                size += len(v)
+        return size
 
     def hard_flush(self, batch_flush=True, retry=0):
         "Subclasses override this with flushing logic"
@@ -61,6 +157,7 @@ class BaseLoader(object):
         if self._batch:
             self.log.debug('Resetting flush state')
             self._flush_count = 0
+            self._flush_bytes = 0
             self._last_flush = time.time()
 
     def finish(self):
@@ -96,6 +193,7 @@ class BaseLoader(object):
 
         This gets called by hard_flush if there is a problem
         with a batch commit to commit each object individually.
+        Returns False if the object could not be committed.
         """
         try:
             if merge:
@@ -106,4 +204,71 @@ class BaseLoader(object):
         except exc.IntegrityError, e:
             self.log.error('Insert failed for event %s : %s', event, e)
             self.session.rollback()
+            return False
+
+        return True
+
+    def write_events(self, events):
+        """
+        @type   events: list
+        @param  events: (event, merge) tuples, merge being true
+                if the row should be a merge rather than a plain insert.
+
+        Adds the events to the session, without committing them.
+        Subclasses can override this to write events differently.
+        """
+        for event, merge in events:
+            if merge:
+                self.session.merge(event)
+            else:
+                self.session.add(event)
+
+    def bisect_commit(self, events):
+        """
+        @type   events: list
+        @param  events: (event, merge) tuples whose batch commit
+                failed with an integrity error.
+
+        Commits the events in halves, splitting again every half
+        that fails, down to single events that are committed with
+        individual_commit. Isolating k bad events out of n takes
+        O(k log n) commits, instead of n.
+        """
+        self._integrity_error_batches += 1
+        self._bisect(events, known_bad=True)
+        self.log.info('Integrity error recovery: batches=%s commits=%s rejected_events=%s',
+                      self._integrity_error_batches, self._bisect_commits, self._rejected_events)
+
+    def _bisect(self, events, known_bad=False):
+        """
+        Commits events, bisecting them on integrity errors. If
+        known_bad is true, the events are known to fail together and
+        are split right away. Returns True if all events were
+        committed in one go.
+        """
+        if len(events) == 0:
+            return True
+
+        if len(events) == 1:
+            self._bisect_commits += 1
+            event, merge = events[0]
+            if self.individual_commit(event, merge=merge):
+                return True
+            self._rejected_events += 1
+            return False
+
+        if not known_bad:
+            self._bisect_commits += 1
+            try:
+                self.write_events(events)
+                self.session.commit()
+                return True
+            except exc.IntegrityError, e:
+                self.session.rollback()
+
+        middle = len(events) / 2
+        first_ok = self._bisect(events[:middle])
+        # If the first half went in, the bad events are in the second one
+        self._bisect(events[middle:], known_bad=first_ok)
+        return False
 
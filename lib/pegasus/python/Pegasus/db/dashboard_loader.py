@@ -20,14 +20,17 @@ class DashboardLoader(BaseLoader):
         expects the database to exist (ie: will not issue CREATE DB)
         but will populate an empty DB with tables/indexes/etc.
     """
-    def __init__(self, connString, perf=False, batch=False, props=None, db_type=None, backup=False):
+    def __init__(self, connString, perf=False, batch=False, props=None, db_type=None, backup=False, stats_file=None):
         """Init object
 
         @type   connString: string
         @param  connString: SQLAlchemy connection string - REQUIRED
+        @type   stats_file: string
+        @param  stats_file: File the loader stats are written to as
+                JSON in perf mode.
         """
         super(DashboardLoader, self).__init__(connString, batch=batch, props=props, db_type=db_type, backup=backup,
-                                              flush_every=1)
+                                              flush_every=1, stats_file=stats_file)
 
         # "Case" dict to map events to handler methods
         self.eventMap = {
@@ -67,6 +70,7 @@ class DashboardLoader(BaseLoader):
         if not self._batch:
             self.check_connection()
 
+        start = time.time()
         try:
             if self._perf:
                 t = time.time()
@@ -88,6 +92,11 @@ class DashboardLoader(BaseLoader):
             self.check_connection()
             self.process(linedata)
 
+        duration = time.time() - start
+        self.stats.count('events')
+        self.stats.observe('process', duration)
+        self.stats.observe('process.' + linedata['event'], duration)
+
         self.check_flush(increment=True)
 
     def linedataToObject(self, linedata, o):
@@ -149,8 +158,8 @@ class DashboardLoader(BaseLoader):
         Process queued inserts and flush/commit to the database.
         If the commit fails due to an integrity error, then method
         re-calls itself with setting batch_flush to False which
-        causes each insert/object to be committed individually
-        so all the "good" inserts can succeed.  This will increase
+        causes the batch to be committed in halves, bisecting the
+        halves that fail, so all the "good" inserts can succeed.  This will increase
         the processing time of the batch with the bad data in it.
         """
         if not self._batch:
@@ -160,29 +169,29 @@ class DashboardLoader(BaseLoader):
 
         self.check_connection()
 
-        if self._perf:
-            s = time.time()
+        s = time.time()
 
         end_event = []
 
         for event in self._batch_cache['batch_events']:
             if event.event == 'dashboard.xwf.end':
                 end_event.append(event)
-            if batch_flush:
-                self.session.add(event)
-            else:
-                self.individual_commit(event)
 
-        for event in self._batch_cache['update_events']:
-            if batch_flush:
-                self.session.merge(event)
-            else:
-                self.individual_commit(event, merge=True)
+        events = [(event, False) for event in self._batch_cache['batch_events']]
+        events.extend([(event, True) for event in self._batch_cache['update_events']])
 
         try:
-            self.session.commit()
+            if batch_flush:
+                t = time.time()
+                self.write_events(events)
+                self.stats.observe('write', time.time() - t)
+                t = time.time()
+                self.session.commit()
+                self.stats.observe('commit', time.time() - t)
+            else:
+                self.bisect_commit(events)
         except exc.IntegrityError, e:
-            self.log.error('Integrity error on batch flush: %s - batch will need to be committed per-event which will take longer', e)
+            self.log.error('Integrity error on batch flush: %s - batch will need to be committed in parts which will take longer', e)
             self.session.rollback()
             self.hard_flush(batch_flush=False)
         except exc.OperationalError, e:
@@ -204,8 +213,11 @@ class DashboardLoader(BaseLoader):
         self.session.commit()
         self.reset_flush_state()
 
+        self.stats.count('flushes')
+        self.stats.observe('flush', time.time() - s)
         if self._perf:
             self.log.info('Hard flush duration: %s', (time.time() - s))
+        self.report_stats()
 
     #############################################
     # Methods to handle the various insert events
@@ -351,4 +363,5 @@ class DashboardLoader(BaseLoader):
                           self._insert_time, self._insert_num, run_time,
                           run_time - self._insert_time,
                           self._insert_time / self._insert_num)
+        self.report_stats(force=True)
 
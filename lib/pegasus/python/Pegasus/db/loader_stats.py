@@ -0,0 +1,146 @@
+"""
+This file implements the LoaderStats class, used by the stampede
+loaders to count events, rows and cache lookups, and to keep
+histograms of how long processing, flushing and committing take.
+"""
+
+##
+#  Copyright 2007-2017 University Of Southern California
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#  http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing,
+#  software distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+##
+
+import os
+import time
+import json
+import bisect
+
+# Upper bounds, in seconds, of the histogram buckets: 0.1ms, 0.2ms,
+# 0.4ms, ... up to about 52s. Longer durations go in an extra bucket.
+BUCKET_BOUNDS = [0.0001 * 2 ** i for i in range(20)]
+
+class Histogram(object):
+    "Count, total, extremes and log2 buckets of a set of durations"
+
+    def __init__(self):
+        self.count = 0
+        self.total = 0.0
+        self.min = None
+        self.max = None
+        self.buckets = [0] * (len(BUCKET_BOUNDS) + 1)
+
+    def add(self, value):
+        self.count += 1
+        self.total += value
+        if self.min is None or value < self.min:
+            self.min = value
+        if self.max is None or value > self.max:
+            self.max = value
+        self.buckets[bisect.bisect_left(BUCKET_BOUNDS, value)] += 1
+
+    def as_dict(self):
+        buckets = []
+        for i, count in enumerate(self.buckets):
+            if count > 0:
+                if i < len(BUCKET_BOUNDS):
+                    buckets.append([BUCKET_BOUNDS[i], count])
+                else:
+                    buckets.append([None, count])
+        return {
+            'count' : self.count,
+            'total' : self.total,
+            'mean' : self.count and self.total / self.count,
+            'min' : self.min,
+            'max' : self.max,
+            'buckets' : buckets
+        }
+
+class LoaderStats(object):
+    """
+    Counters, duration histograms and cache hit rates of a loader.
+    Counter and histogram names are dotted, like 'rows.jobstate' or
+    'process.stampede.job_inst.main.end', so related values sort
+    together.
+    """
+
+    def __init__(self):
+        self.start = time.time()
+        self.counters = {}
+        self.histograms = {}
+        self.caches = {}            # cache name --> [hits, misses]
+
+    def count(self, name, n=1):
+        self.counters[name] = self.counters.get(name, 0) + n
+
+    def observe(self, name, duration):
+        if not self.histograms.has_key(name):
+            self.histograms[name] = Histogram()
+        self.histograms[name].add(duration)
+
+    def cache(self, name, hit):
+        if not self.caches.has_key(name):
+            self.caches[name] = [0, 0]
+        if hit:
+            self.caches[name][0] += 1
+        else:
+            self.caches[name][1] += 1
+
+    def total(self, name):
+        "Total time spent in name, in seconds"
+        if not self.histograms.has_key(name):
+            return 0.0
+        return self.histograms[name].total
+
+    def as_dict(self):
+        caches = {}
+        for name, (hits, misses) in self.caches.items():
+            caches[name] = {
+                'hits' : hits,
+                'misses' : misses,
+                'hit_rate' : float(hits) / (hits + misses)
+            }
+        histograms = {}
+        for name, histogram in self.histograms.items():
+            histograms[name] = histogram.as_dict()
+        return {
+            'elapsed' : time.time() - self.start,
+            'counters' : self.counters,
+            'histograms' : histograms,
+            'caches' : caches
+        }
+
+    def summary(self):
+        "One line summary for the log"
+        events = self.counters.get('events', 0)
+        elapsed = max(time.time() - self.start, 0.001)
+        rows = 0
+        for name, n in self.counters.items():
+            if name.startswith('rows.'):
+                rows += n
+        line = 'events=%d (%.1f/s) process_time=%.3fs flushes=%d flush_time=%.3fs commit_time=%.3fs rows=%d' % (
+                events, events / elapsed, self.total('process'), self.counters.get('flushes', 0),
+                self.total('flush'), self.total('commit'), rows)
+        for name in sorted(self.caches.keys()):
+            hits, misses = self.caches[name]
+            line += ' %s_hit_rate=%.3f' % (name, float(hits) / (hits + misses))
+        return line
+
+    def write(self, filename):
+        "Write the stats as JSON to filename, replacing it atomically"
+        tmp_filename = filename + '.tmp'
+        f = open(tmp_filename, 'w')
+        try:
+            json.dump(self.as_dict(), f, indent=2, sort_keys=True)
+        finally:
+            f.close()
+        os.rename(tmp_filename, filename)
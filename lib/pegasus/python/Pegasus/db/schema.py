@@ -53,6 +53,9 @@ def get_missing_tables(db):
         st_task_edge,
         st_task_meta,
         st_invocation,
+        st_workflow_summary,
+        st_transformation_summary,
+        st_host_summary,
         # MASTER
         pg_workflow,
         pg_workflowstate,
@@ -182,6 +185,15 @@ class TaskMeta(SABase):
 class Invocation(SABase):
     pass
 
+class WorkflowSummary(SABase):
+    pass
+
+class TransformationSummary(SABase):
+    pass
+
+class HostSummary(SABase):
+    pass
+
 # ---------------------------------------------
 # DASHBOARD
 class DashboardWorkflow(SABase):
@@ -246,6 +258,8 @@ st_workflow = Table('workflow', metadata,
 
 Index('wf_id_KEY', st_workflow.c.wf_id, unique=True)
 Index('wf_uuid_UNIQUE', st_workflow.c.wf_uuid, unique=True)
+Index('wf_root_wf_id_COL', st_workflow.c.root_wf_id, st_workflow.c.wf_id)
+Index('wf_parent_wf_id_COL', st_workflow.c.parent_wf_id)
 
 orm.mapper(Workflow, st_workflow, properties = {
     'child_wf':relation(Workflow, cascade='all, delete-orphan', passive_deletes=True),
@@ -256,6 +270,9 @@ orm.mapper(Workflow, st_workflow, properties = {
     'child_invocation':relation(Invocation, backref='st_workflow', cascade='all, delete-orphan', passive_deletes=True),
     'child_task_e':relation(TaskEdge, backref='st_workflow', cascade='all, delete-orphan', passive_deletes=True),
     'child_job_e':relation(JobEdge, backref='st_workflow', cascade='all, delete-orphan', passive_deletes=True),
+    'child_summary':relation(WorkflowSummary, backref='st_workflow', cascade='all, delete-orphan', passive_deletes=True),
+    'child_xform_summary':relation(TransformationSummary, backref='st_workflow', cascade='all, delete-orphan', passive_deletes=True),
+    'child_host_summary':relation(HostSummary, backref='st_workflow', cascade='all, delete-orphan', passive_deletes=True),
 })
 
 
@@ -401,6 +418,8 @@ Index('UNIQUE_JOB_INSTANCE',
     st_job_instance.c.job_id,
     st_job_instance.c.job_submit_seq,
     unique=True)
+Index('job_instance_host_id_COL', st_job_instance.c.host_id)
+Index('job_instance_subwf_id_COL', st_job_instance.c.subwf_id)
 
 orm.mapper(JobInstance, st_job_instance, properties = {
     #PM-712 don't want merges to happen to invocation table .
@@ -436,6 +455,7 @@ Index('UNIQUE_JOBSTATE',
     st_jobstate.c.timestamp,
     st_jobstate.c.jobstate_submit_seq,
     unique=True)
+Index('jobstate_submit_seq_COL', st_jobstate.c.job_instance_id, st_jobstate.c.jobstate_submit_seq)
 
 orm.mapper(Jobstate, st_jobstate)
 
@@ -454,6 +474,7 @@ st_task = Table('task', metadata,
 Index('task_id_KEY', st_task.c.task_id, unique=True)
 Index('task_abs_task_id_COL', st_task.c.abs_task_id)
 Index('task_wf_id_COL', st_task.c.wf_id)
+Index('task_job_id_COL', st_task.c.job_id)
 Index('UNIQUE_TASK', st_task.c.wf_id, st_task.c.abs_task_id, unique=True)
 
 orm.mapper(Task, st_task, properties = {
@@ -523,6 +544,72 @@ st_workflow_files = Table('workflow_files', metadata,
 orm.mapper(WorkflowFiles, st_workflow_files)
 
 
+# Summary tables
+# ==> Totals of a workflow that pegasus-statistics and the dashboard
+#       would otherwise compute from the jobstate and invocation rows.
+#       They are written by Pegasus.db.summary when the workflow ends,
+#       and deleted when it starts again. See summary.py for how each
+#       column is computed.
+
+# job and task totals per job type (tasks are counted by task type)
+st_workflow_summary = Table('workflow_summary', metadata,
+    Column('wf_id', KeyInteger, ForeignKey('workflow.wf_id', ondelete='CASCADE'), primary_key=True, nullable=False),
+    Column('type_desc', VARCHAR(255), primary_key=True, nullable=False),
+    Column('jobs', INT, nullable=False, default=0),
+    Column('job_retries', INT, nullable=False, default=0),
+    Column('succeeded_jobs', INT, nullable=False, default=0),
+    Column('failed_jobs', INT, nullable=False, default=0),
+    Column('running_jobs', INT, nullable=False, default=0),
+    Column('tasks', INT, nullable=False, default=0),
+    Column('succeeded_tasks', INT, nullable=False, default=0),
+    Column('failed_tasks', INT, nullable=False, default=0),
+    Column('task_retries', INT, nullable=False, default=0),
+    Column('cum_wall_time', NUMERIC(16,3), nullable=True),
+    Column('cum_goodput', NUMERIC(16,3), nullable=True),
+    Column('cum_badput', NUMERIC(16,3), nullable=True),
+    Column('submit_wall_time', NUMERIC(16,3), nullable=True),
+    Column('submit_goodput', NUMERIC(16,3), nullable=True),
+    Column('submit_badput', NUMERIC(16,3), nullable=True),
+    Column('expanded_submit_wall_time', NUMERIC(16,3), nullable=True),
+    Column('expanded_submit_goodput', NUMERIC(16,3), nullable=True),
+    Column('expanded_submit_badput', NUMERIC(16,3), nullable=True),
+    **table_keywords
+)
+
+orm.mapper(WorkflowSummary, st_workflow_summary)
+
+
+st_transformation_summary = Table('transformation_summary', metadata,
+    Column('summary_id', KeyInteger, primary_key=True, nullable=False),
+    Column('wf_id', KeyInteger, ForeignKey('workflow.wf_id', ondelete='CASCADE'), nullable=False),
+    Column('transformation', TEXT, nullable=False),
+    Column('invocations', INT, nullable=False),
+    Column('succeeded', INT, nullable=False),
+    Column('failed', INT, nullable=False),
+    Column('min_duration', NUMERIC(16,3), nullable=True),
+    Column('max_duration', NUMERIC(16,3), nullable=True),
+    Column('total_duration', NUMERIC(16,3), nullable=True),
+    **table_keywords
+)
+
+Index('xform_summary_wf_id_COL', st_transformation_summary.c.wf_id)
+
+orm.mapper(TransformationSummary, st_transformation_summary)
+
+
+st_host_summary = Table('host_summary', metadata,
+    Column('wf_id', KeyInteger, ForeignKey('workflow.wf_id', ondelete='CASCADE'), primary_key=True, nullable=False),
+    Column('host_id', KeyInteger, ForeignKey('host.host_id', ondelete='CASCADE'), primary_key=True, nullable=False),
+    Column('job_instances', INT, nullable=False),
+    Column('local_duration', NUMERIC(16,3), nullable=True),
+    Column('invocations', INT, nullable=False),
+    Column('remote_duration', NUMERIC(16,3), nullable=True),
+    **table_keywords
+)
+
+orm.mapper(HostSummary, st_host_summary)
+
+
 # ---------------------------------------------
 # DASHBOARD
 # ---------------------------------------------
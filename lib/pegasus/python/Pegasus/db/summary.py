@@ -0,0 +1,316 @@
+"""
+This file maintains the workflow, transformation and host summary
+tables of a stampede database. A workflow is summarized when it ends:
+its totals are computed once from the job, jobstate and invocation
+rows, and stored so that StampedeStatistics does not have to compute
+them again on every request. The summary of a workflow is deleted
+when it starts again, so summaries are only ever read for workflows
+that are not running.
+
+Usage::
+
+ from Pegasus.db import summary
+
+ summary.summarize_workflow(session, wf_id)
+ summary.delete_workflow_summary(session, wf_id)
+ summary.rebuild_summaries(session)
+
+These functions do not commit, callers do.
+"""
+
+##
+#  Copyright 2007-2017 University Of Southern California
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#  http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing,
+#  software distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+##
+
+import logging
+
+from Pegasus.db.schema import *
+
+log = logging.getLogger(__name__)
+
+# Job types of sub-workflow jobs
+SUBWF_TYPES = ('dax', 'dag')
+
+# Job type of the zero row that marks a summarized workflow without jobs
+NO_JOBS_TYPE = ''
+
+def _last_instances(session, wf_id):
+    """
+    Returns a subquery with the job_id and the job_submit_seq of the
+    last instance of each job of the workflow.
+    """
+    q = session.query(JobInstance.job_id.label('job_id'),
+                      func.max(JobInstance.job_submit_seq).label('jss'))
+    q = q.filter(JobInstance.job_id == Job.job_id)
+    q = q.filter(Job.wf_id == wf_id)
+    q = q.group_by(JobInstance.job_id)
+    return q.subquery()
+
+def _zero_totals():
+    "Returns the workflow_summary columns of a job type without jobs"
+    return {
+        'jobs' : 0,
+        'job_retries' : 0,
+        'succeeded_jobs' : 0,
+        'failed_jobs' : 0,
+        'running_jobs' : 0,
+        'tasks' : 0,
+        'succeeded_tasks' : 0,
+        'failed_tasks' : 0,
+        'task_retries' : 0,
+        'cum_wall_time' : None,
+        'cum_goodput' : None,
+        'cum_badput' : None,
+        'submit_wall_time' : None,
+        'submit_goodput' : None,
+        'submit_badput' : None,
+        'expanded_submit_wall_time' : None,
+        'expanded_submit_goodput' : None,
+        'expanded_submit_badput' : None
+    }
+
+def _job_type_totals(session, wf_id):
+    """
+    Returns a dict of job type --> dict of the workflow_summary columns
+    for the jobs and tasks of that type. Each column gives the same
+    total as the StampedeStatistics query it replaces, when summed
+    over the job types selected by the job filter.
+    """
+    totals = {}
+
+    def row(type_desc):
+        if not totals.has_key(type_desc):
+            totals[type_desc] = _zero_totals()
+        return totals[type_desc]
+
+    # get_total_jobs_status()
+    q = session.query(Job.type_desc, func.count(Job.job_id))
+    q = q.filter(Job.wf_id == wf_id).group_by(Job.type_desc)
+    for type_desc, jobs in q:
+        row(type_desc)['jobs'] = jobs
+
+    # get_total_jobs_retries(), and the submit side wall time of
+    # get_submit_side_job_wall_time(), with and without the
+    # instances of sub-workflow jobs that ran a sub-workflow
+    local_time = JobInstance.local_duration * JobInstance.multiplier_factor
+    expanded = or_(not_(Job.type_desc.in_(SUBWF_TYPES)), JobInstance.subwf_id == None)
+    q = session.query(Job.type_desc,
+                      func.count(JobInstance.job_instance_id),
+                      func.count(distinct(JobInstance.job_id)),
+                      func.sum(local_time),
+                      func.sum(case([(JobInstance.exitcode == 0, local_time)], else_=0)),
+                      func.sum(case([(JobInstance.exitcode > 0, local_time)], else_=0)),
+                      func.sum(case([(expanded, local_time)])),
+                      func.sum(case([(expanded, case([(JobInstance.exitcode == 0, local_time)], else_=0))])),
+                      func.sum(case([(expanded, case([(JobInstance.exitcode > 0, local_time)], else_=0))])))
+    q = q.filter(JobInstance.job_id == Job.job_id)
+    q = q.filter(Job.wf_id == wf_id).group_by(Job.type_desc)
+    for r in q:
+        o = row(r[0])
+        o['job_retries'] = r[1] - r[2]
+        (o['submit_wall_time'], o['submit_goodput'], o['submit_badput'],
+         o['expanded_submit_wall_time'], o['expanded_submit_goodput'], o['expanded_submit_badput']) = r[3:]
+
+    # get_total_succeeded_jobs_status(), get_total_failed_jobs_status()
+    # and get_total_running_jobs_status(): the last instance of each job
+    last = _last_instances(session, wf_id)
+    q = session.query(Job.type_desc,
+                      func.sum(case([(JobInstance.exitcode == 0, 1)], else_=0)),
+                      func.sum(case([(JobInstance.exitcode != 0, 1)], else_=0)),
+                      func.sum(case([(JobInstance.exitcode == None, 1)], else_=0)))
+    q = q.filter(JobInstance.job_id == last.c.job_id)
+    q = q.filter(JobInstance.job_submit_seq == last.c.jss)
+    q = q.filter(Job.job_id == JobInstance.job_id)
+    q = q.group_by(Job.type_desc)
+    for type_desc, succeeded, failed, running in q:
+        o = row(type_desc)
+        o['succeeded_jobs'], o['failed_jobs'], o['running_jobs'] = succeeded, failed, running
+
+    # get_total_succeeded_tasks_status() and get_total_failed_tasks_status()
+    q = session.query(Job.type_desc,
+                      func.count(distinct(case([(Invocation.exitcode == 0, Invocation.abs_task_id)]))),
+                      func.count(distinct(case([(Invocation.exitcode != 0, Invocation.abs_task_id)]))))
+    q = q.filter(JobInstance.job_id == last.c.job_id)
+    q = q.filter(JobInstance.job_submit_seq == last.c.jss)
+    q = q.filter(Job.job_id == JobInstance.job_id)
+    q = q.filter(Invocation.job_instance_id == JobInstance.job_instance_id)
+    q = q.filter(Invocation.abs_task_id != None)
+    q = q.group_by(Job.type_desc)
+    for type_desc, succeeded, failed in q:
+        o = row(type_desc)
+        o['succeeded_tasks'], o['failed_tasks'] = succeeded, failed
+
+    # get_total_tasks_retries()
+    q = session.query(Job.type_desc,
+                      func.count(Invocation.invocation_id),
+                      func.count(distinct(Invocation.abs_task_id)))
+    q = q.filter(Invocation.wf_id == wf_id)
+    q = q.filter(Job.wf_id == wf_id)
+    q = q.filter(JobInstance.job_instance_id == Invocation.job_instance_id)
+    q = q.filter(Job.job_id == JobInstance.job_id)
+    q = q.filter(Invocation.abs_task_id != None)
+    q = q.group_by(Job.type_desc)
+    for type_desc, invocations, tasks in q:
+        row(type_desc)['task_retries'] = invocations - tasks
+
+    # get_workflow_cum_job_wall_time()
+    remote_time = Invocation.remote_duration * JobInstance.multiplier_factor
+    q = session.query(Job.type_desc,
+                      func.sum(remote_time),
+                      func.sum(case([(Invocation.exitcode == 0, remote_time)], else_=0)),
+                      func.sum(case([(Invocation.exitcode > 0, remote_time)], else_=0)))
+    q = q.filter(Invocation.wf_id == wf_id)
+    q = q.filter(Invocation.task_submit_seq >= 0)
+    q = q.filter(Invocation.transformation != 'condor::dagman')
+    q = q.filter(Invocation.job_instance_id == JobInstance.job_instance_id)
+    q = q.filter(Job.job_id == JobInstance.job_id)
+    q = q.group_by(Job.type_desc)
+    for r in q:
+        o = row(r[0])
+        o['cum_wall_time'], o['cum_goodput'], o['cum_badput'] = r[1:]
+
+    # get_total_tasks_status(), by task type
+    q = session.query(Task.type_desc, func.count(Task.task_id))
+    q = q.filter(Task.wf_id == wf_id)
+    q = q.filter(Task.job_id == Job.job_id)
+    q = q.group_by(Task.type_desc)
+    for type_desc, tasks in q:
+        row(type_desc)['tasks'] = tasks
+
+    return totals
+
+def _transformation_totals(session, wf_id):
+    "Returns the transformation_summary rows of the workflow"
+    duration = Invocation.remote_duration * JobInstance.multiplier_factor
+    q = session.query(Invocation.transformation,
+                      func.count(Invocation.invocation_id),
+                      func.count(case([(Invocation.exitcode == 0, Invocation.exitcode)])),
+                      func.count(case([(Invocation.exitcode != 0, Invocation.exitcode)])),
+                      func.min(duration),
+                      func.max(duration),
+                      func.sum(duration))
+    q = q.filter(Invocation.job_instance_id == JobInstance.job_instance_id)
+    q = q.filter(Invocation.wf_id == wf_id)
+    q = q.group_by(Invocation.transformation)
+
+    rows = []
+    for r in q:
+        rows.append({
+            'wf_id' : wf_id,
+            'transformation' : r[0],
+            'invocations' : r[1],
+            'succeeded' : r[2],
+            'failed' : r[3],
+            'min_duration' : r[4],
+            'max_duration' : r[5],
+            'total_duration' : r[6]
+        })
+    return rows
+
+def _host_totals(session, wf_id):
+    "Returns the host_summary rows of the workflow"
+    totals = {}
+
+    q = session.query(JobInstance.host_id,
+                      func.count(JobInstance.job_instance_id),
+                      func.sum(JobInstance.local_duration))
+    q = q.filter(JobInstance.job_id == Job.job_id)
+    q = q.filter(Job.wf_id == wf_id)
+    q = q.filter(JobInstance.host_id != None)
+    q = q.group_by(JobInstance.host_id)
+    for host_id, job_instances, local_duration in q:
+        totals[host_id] = {
+            'wf_id' : wf_id,
+            'host_id' : host_id,
+            'job_instances' : job_instances,
+            'local_duration' : local_duration,
+            'invocations' : 0,
+            'remote_duration' : None
+        }
+
+    q = session.query(JobInstance.host_id,
+                      func.count(Invocation.invocation_id),
+                      func.sum(Invocation.remote_duration))
+    q = q.filter(Invocation.job_instance_id == JobInstance.job_instance_id)
+    q = q.filter(Invocation.wf_id == wf_id)
+    q = q.filter(JobInstance.host_id != None)
+    q = q.group_by(JobInstance.host_id)
+    for host_id, invocations, remote_duration in q:
+        if totals.has_key(host_id):
+            totals[host_id]['invocations'] = invocations
+            totals[host_id]['remote_duration'] = remote_duration
+
+    return totals.values()
+
+def delete_workflow_summary(session, wf_id):
+    """
+    Deletes the summary rows of a workflow, so StampedeStatistics
+    computes its totals from the job and invocation rows again.
+    """
+    for table in (st_workflow_summary, st_transformation_summary, st_host_summary):
+        session.execute(table.delete().where(table.c.wf_id == wf_id))
+
+def summarize_workflow(session, wf_id):
+    """
+    Replaces the summary rows of a workflow with totals computed from
+    its current job, jobstate and invocation rows. A workflow without
+    jobs gets a zero row, so it is still known to be summarized.
+    """
+    log.debug('Summarizing workflow %s', wf_id)
+
+    delete_workflow_summary(session, wf_id)
+
+    totals = _job_type_totals(session, wf_id)
+    if len(totals) == 0:
+        totals[NO_JOBS_TYPE] = _zero_totals()
+    rows = []
+    for type_desc, row in totals.items():
+        row['wf_id'] = wf_id
+        row['type_desc'] = type_desc
+        rows.append(row)
+    session.execute(st_workflow_summary.insert(), rows)
+
+    rows = _transformation_totals(session, wf_id)
+    if len(rows) > 0:
+        session.execute(st_transformation_summary.insert(), rows)
+
+    rows = _host_totals(session, wf_id)
+    if len(rows) > 0:
+        session.execute(st_host_summary.insert(), rows)
+
+def rebuild_summaries(session):
+    """
+    Summarizes all the workflows of the database that are not
+    running, and deletes the summaries of those that are. Returns the
+    number of workflows summarized.
+    """
+    # The last state of each workflow: a workflow restarted in the
+    # same second it ended is running
+    q = session.query(Workflowstate.wf_id, Workflowstate.state)
+    q = q.order_by(Workflowstate.timestamp, Workflowstate.restart_count,
+                   case([(Workflowstate.state == 'WORKFLOW_STARTED', 1)], else_=0))
+    states = {}
+    for wf_id, state in q:
+        states[wf_id] = state
+
+    count = 0
+    for wf_id, in session.query(Workflow.wf_id).order_by(Workflow.wf_id):
+        if states.get(wf_id) == 'WORKFLOW_TERMINATED':
+            summarize_workflow(session, wf_id)
+            count += 1
+        else:
+            delete_workflow_summary(session, wf_id)
+
+    return count
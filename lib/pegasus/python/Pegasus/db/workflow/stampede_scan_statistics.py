@@ -0,0 +1,1044 @@
+"""
+Library to generate the pegasus-statistics numbers of a workflow with
+a single read of the Stampede job_instance, jobstate and invocation
+tables.
+
+Usage::
+ stats = StampedeScanStatistics(connString='sqlite:///montage.db')
+ stats.initialize('unique_wf_uuid')
+ stats.set_job_filter('nonsub')
+ print stats.get_total_jobs_status()
+ sub_wf_stats = stats.workflow('sub_wf_uuid')
+ print sub_wf_stats.get_transformation_statistics()
+ stats.close()
+
+StampedeStatistics runs one or more queries over the job, job
+instance, jobstate and invocation tables for every method call, so
+pegasus-statistics reads these tables dozens of times, and once more
+for every sub-workflow. This class reads them once, when initialize()
+is called, for the root workflow and all its sub-workflows:
+
+ * job_instance, jobstate and invocation rows are streamed, ordered by
+   id, with server side cursors where the database supports them;
+ * the rows are aggregated in Python by workflow and job type (and by
+   transformation, host and second for the breakdown and time
+   statistics), so memory grows with the number of jobs, tasks and
+   job instances, not with the number of jobstates and invocations;
+ * the workflow, job and task tables, which are much smaller, are read
+   once as well;
+ * with processes > 1, the workflows of the tree are split into ranges
+   of wf_id with about the same number of jobs, whose tables are read
+   by a pool of worker processes, each with its own connection to the
+   database, and their aggregates are merged.
+
+The methods take the same filters (set_job_filter, set_time_filter,
+set_host_filter and set_transformation_filter), and return the same
+values and rows, as the StampedeStatistics methods with the same name,
+computed from the aggregates. workflow() returns the statistics of a
+single workflow of the tree, as StampedeStatistics(connString,
+expand_workflow=False) would, without reading the database again.
+
+Methods::
+ workflow
+ get_descendant_workflow_ids
+ get_total_jobs_status
+ get_total_succeeded_failed_jobs_status
+ get_total_succeeded_jobs_status
+ get_total_failed_jobs_status
+ get_total_running_jobs_status
+ get_total_jobs_retries
+ get_total_tasks_status
+ get_total_succeeded_tasks_status
+ get_total_failed_tasks_status
+ get_total_tasks_retries
+ get_workflow_states
+ get_workflow_cum_job_wall_time
+ get_submit_side_job_wall_time
+ get_workflow_details
+ get_workflow_retries
+ get_job_statistics
+ get_transformation_statistics
+ get_host_statistics
+ get_invocation_by_time
+ get_jobs_run_by_time
+ get_invocation_by_time_per_host
+ get_jobs_run_by_time_per_host
+"""
+
+##
+#  Copyright 2007-2017 University Of Southern California
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#  http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing,
+#  software distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+##
+
+import copy
+import signal
+import logging
+import multiprocessing
+from collections import namedtuple
+
+from Pegasus.db import connection
+from Pegasus.db.admin.admin_loader import DBAdminError
+from Pegasus.db.schema import *
+from Pegasus.db.errors import StampedeDBNotFoundError
+
+SUBWF_TYPES = ('dax', 'dag')
+
+DATE_DIVISORS = {
+    'month': 2629743,
+    'week': 604800,
+    'day': 86400,
+    'hour': 3600
+}
+
+# Rows returned by the methods, with the columns of the
+# StampedeStatistics queries
+WorkflowIdRow = namedtuple('WorkflowIdRow', ['wf_id', 'wf_uuid'])
+SucceededFailedRow = namedtuple('SucceededFailedRow', ['succeeded', 'failed'])
+WallTimeRow = namedtuple('WallTimeRow', ['wall_time', 'goodput', 'badput'])
+TransformationRow = namedtuple('TransformationRow',
+    ['transformation', 'count', 'min', 'success', 'failure', 'max', 'avg', 'sum'])
+HostRow = namedtuple('HostRow', ['host_name', 'job_instances', 'local_duration', 'invocations', 'remote_duration'])
+TimeRow = namedtuple('TimeRow', ['date_format', 'count', 'total_runtime'])
+HostTimeRow = namedtuple('HostTimeRow', ['date_format', 'host_name', 'count', 'total_runtime'])
+JobStatisticsRow = namedtuple('JobStatisticsRow',
+    ['job_id', 'job_instance_id', 'job_submit_seq', 'job_name', 'site', 'condor_q_time', 'resource_delay',
+     'runtime', 'kickstart', 'post_time', 'seqexec', 'exit_code', 'host_name', 'multiplier_factor',
+     'kickstart_multi', 'remote_cpu_time'])
+
+# Jobstates used by get_job_statistics()
+JOB_STATISTICS_STATES = ('GRID_SUBMIT', 'GLOBUS_SUBMIT', 'EXECUTE', 'SUBMIT', 'POST_SCRIPT_TERMINATED',
+                         'POST_SCRIPT_STARTED', 'JOB_TERMINATED')
+
+def _add(total, value):
+    """
+    Adds value to total the way SQL sum() does: NULL values are
+    ignored, and the sum of no values is NULL.
+    """
+    if value is None:
+        return total
+    if total is None:
+        return value
+    return total + value
+
+def _min(a, b):
+    if a is None:
+        return b
+    if b is None:
+        return a
+    return min(a, b)
+
+def _max(a, b):
+    if a is None:
+        return b
+    if b is None:
+        return a
+    return max(a, b)
+
+def _sub(a, b):
+    if a is None or b is None:
+        return None
+    return a - b
+
+class _Counter(dict):
+    "Dictionary of SQL sums, which adds rows of values to its keys"
+
+    def add(self, key, *values):
+        total = self.get(key)
+        if total is None:
+            self[key] = list(values)
+        else:
+            for i, value in enumerate(values):
+                total[i] = _add(total[i], value)
+
+    def merge(self, other):
+        for key, values in other.iteritems():
+            self.add(key, *values)
+
+class _ScanData(object):
+    """
+    Aggregates of all the workflows of a tree, shared by the
+    StampedeScanStatistics objects of these workflows.
+    """
+    def __init__(self):
+        self.workflows = {}             # wf_id --> workflow details row
+        self.states = []                # workflowstate rows
+        self.hosts = {}                 # host_id --> hostname
+
+        # By (wf_id, job type_desc)
+        self.jobs = _Counter()          # [jobs]
+        self.job_instances = _Counter() # [job instances, jobs with instances]
+        self.last_instances = _Counter()# [last instances, succeeded, failed, running]
+        self.tasks = _Counter()         # [tasks], by task type_desc
+        self.task_invocations = _Counter()  # [invocations with a task]
+        self.task_ids = {}              # set of abs_task_id of the invocations
+        self.succeeded_tasks = {}       # set of abs_task_id succeeded in last instances
+        self.failed_tasks = {}          # set of abs_task_id failed in last instances
+        self.succeeded_pmc_tasks = {}   # set of abs_task_id succeeded in any instance
+
+        # By wf_id
+        self.cum_wall_time = _Counter()             # [wall time, goodput, badput]
+        self.submit_wall_time = _Counter()          # [wall time, goodput, badput]
+        self.expanded_submit_wall_time = _Counter() # [wall time, goodput, badput]
+
+        # By (wf_id, transformation)
+        self.transformations = {}       # [count, min, success, failure, max, sum]
+
+        # By (wf_id, host_id)
+        self.host_instances = _Counter()    # [job instances, local duration]
+        self.host_invocations = _Counter()  # [invocations, remote duration]
+
+        # By (job type_desc, host_id, second), and (transformation,
+        # host_id, second), over all the workflows of the tree, as the
+        # time statistics are only computed for the root workflow
+        self.jobs_by_time = _Counter()          # [count, local duration]
+        self.invocations_by_time = _Counter()   # [count, remote duration]
+
+        # wf_id --> job statistics rows ordered by job_submit_seq
+        self.job_statistics = {}
+
+    def merge(self, other):
+        """
+        Adds the aggregates of other, read from other workflows of the
+        tree, to these aggregates.
+        """
+        for name in ('jobs', 'job_instances', 'last_instances', 'tasks', 'task_invocations',
+                     'cum_wall_time', 'submit_wall_time', 'expanded_submit_wall_time',
+                     'host_instances', 'host_invocations', 'jobs_by_time', 'invocations_by_time'):
+            getattr(self, name).merge(getattr(other, name))
+
+        for name in ('task_ids', 'succeeded_tasks', 'failed_tasks', 'succeeded_pmc_tasks'):
+            sets = getattr(self, name)
+            for key, task_ids in getattr(other, name).iteritems():
+                sets.setdefault(key, set()).update(task_ids)
+
+        for key, t in other.transformations.iteritems():
+            total = self.transformations.get(key)
+            if total is None:
+                self.transformations[key] = t
+            else:
+                total[0] += t[0]
+                total[1] = _min(total[1], t[1])
+                total[2] += t[2]
+                total[3] += t[3]
+                total[4] = _max(total[4], t[4])
+                total[5] = _add(total[5], t[5])
+
+        for wf_id, rows in other.job_statistics.iteritems():
+            self.job_statistics.setdefault(wf_id, []).extend(rows)
+
+def _init_worker():
+    """
+    Workers leave signal handling to the parent process.
+    """
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+
+def _scan_range(args):
+    """
+    This function runs in a worker process, and returns the
+    aggregates of the workflows of the tree of root_wf_id whose wf_id
+    is in wf_range.
+    """
+    connString, root_wf_id, wf_range, job_statistics, hosts = args
+    stats = StampedeScanStatistics(connString, job_statistics=job_statistics)
+    try:
+        data = _ScanData()
+        data.hosts = hosts
+        stats._scan_tables(data, root_wf_id, wf_range)
+        data.hosts = {}
+    finally:
+        stats.close()
+
+    return data
+
+class StampedeScanStatistics(object):
+    # Rows fetched from the cursor at a time while reading the tables
+    fetch_size = 10000
+
+    def __init__(self, connString=None, expand_workflow=True, job_statistics=True, processes=1):
+        """
+        @param job_statistics : keep the rows of get_job_statistics(),
+                                one per job instance, while reading the
+                                tables
+        @param processes      : number of worker processes reading the
+                                tables of ranges of sub-workflows, each
+                                with its own connection (1 reads them in
+                                this process)
+        """
+        self.log = logging.getLogger("%s.%s" % (self.__module__, self.__class__.__name__))
+        try:
+            self.session = connection.connect(connString)
+        except (connection.ConnectionError, DBAdminError), e:
+            self.log.exception(e)
+            raise StampedeDBNotFoundError
+
+        self._connString = connString
+        self._expand = expand_workflow
+        self._keep_job_statistics = job_statistics
+        self._processes = processes
+
+        self._root_wf_id = None
+        self._root_wf_uuid = None
+        self._is_root_wf = None
+        self._job_filter_mode = None
+        self._time_filter_mode = None
+        self._host_filter = None
+        self._xform_filter = {'include':None, 'exclude':None}
+
+        self._wfs = []
+        self._data = None
+        self._owner = True
+
+    def initialize(self, root_wf_uuid = None, root_wf_id = None):
+        if root_wf_uuid == None and root_wf_id == None:
+            self.log.error('Either root_wf_uuid or root_wf_id is required')
+            raise ValueError('Either root_wf_uuid or root_wf_id is required')
+
+        q = self.session.query(Workflow.root_wf_id, Workflow.wf_id, Workflow.wf_uuid)
+
+        if root_wf_uuid:
+            q = q.filter(Workflow.wf_uuid == root_wf_uuid)
+        else:
+            q = q.filter(Workflow.wf_id == root_wf_id)
+
+        try:
+            result = q.one()
+        except orm.exc.MultipleResultsFound, e:
+            self.log.error('Multiple results found for wf_uuid: %s', root_wf_uuid)
+            raise
+        except orm.exc.NoResultFound, e:
+            self.log.error('No results found for wf_uuid: %s', root_wf_uuid)
+            raise
+
+        self._data = self._scan(result.root_wf_id)
+        self._set_workflow(result.wf_id, self._expand)
+        self.log.debug('Descendant workflow ids %s', self._wfs)
+        return True
+
+    def _set_workflow(self, wf_id, expand):
+        details = self._data.workflows[wf_id]
+        self._root_wf_id = wf_id
+        self._root_wf_uuid = details.wf_uuid
+        self._is_root_wf = details.root_wf_id == wf_id
+        self._expand = expand
+
+        self._wfs = [wf_id]
+        if expand:
+            children = {}
+            for row in sorted(self._data.workflows.values(), key=lambda w: w.wf_id):
+                children.setdefault(row.parent_wf_id, []).append(row.wf_id)
+            i = 0
+            while i < len(self._wfs):
+                self._wfs.extend(children.get(self._wfs[i], []))
+                i += 1
+
+        # Initialize filters with default value
+        self.set_job_filter()
+        self.set_time_filter()
+        self.set_host_filter()
+        self.set_transformation_filter()
+
+    def workflow(self, wf_uuid):
+        """
+        Returns the statistics of the workflow wf_uuid of the tree,
+        without its sub-workflows, from the tables already read.
+        """
+        for row in self._data.workflows.values():
+            if row.wf_uuid == wf_uuid:
+                stats = copy.copy(self)
+                stats._xform_filter = {'include':None, 'exclude':None}
+                stats._owner = False
+                stats._set_workflow(row.wf_id, False)
+                return stats
+
+        self.log.error('No results found for wf_uuid: %s', wf_uuid)
+        raise ValueError('No results found for wf_uuid: %s' % wf_uuid)
+
+    def close(self):
+        self.log.debug('close')
+        if self._owner:
+            self.session.close()
+
+    def set_job_filter(self, filter='all'):
+        modes = ['all', 'nonsub', 'subwf', 'dax', 'dag', 'compute', 'stage-in-tx',
+                'stage-out-tx', 'registration', 'inter-site-tx', 'create-dir',
+                'staged-compute', 'cleanup', 'chmod']
+        if filter in modes:
+            self._job_filter_mode = filter
+            self.log.debug('Setting filter to: %s', filter)
+        else:
+            self._job_filter_mode = 'all'
+            self.log.error('Unknown job filter %s - setting to all', filter)
+
+    def set_time_filter(self, filter='month'):
+        if DATE_DIVISORS.has_key(filter):
+            self._time_filter_mode = filter
+            self.log.debug('Setting filter to: %s', filter)
+        else:
+            self._time_filter_mode = 'month'
+            self.log.error('Unknown time filter %s - setting to month', filter)
+
+    def set_host_filter(self, host=None):
+        """
+        The host argument can either be a string/single hostname or
+        it can be a list/array of hostnames.
+        """
+        self._host_filter = host
+
+    def set_transformation_filter(self, include=None, exclude=None):
+        """
+        Either of these args can either be a single string/xform type or
+        it can be a list/array of xform types.
+
+        Both arguments can not be set at the same time.  If they are,
+        the program will log an error and not do any filtering.
+        """
+        self._xform_filter['include'] = include
+        self._xform_filter['exclude'] = exclude
+
+    #
+    # Reading the tables
+    #
+
+    def _stream(self, q):
+        """
+        Returns an iterator over the rows of q, fetched with a server
+        side cursor if the database driver supports it.
+        """
+        conn = self.session.connection().execution_options(stream_results=True)
+        result = conn.execute(q.statement)
+        while True:
+            rows = result.fetchmany(self.fetch_size)
+            if not rows:
+                break
+            for row in rows:
+                yield row
+
+    def _scan(self, root_wf_id):
+        """
+        Reads the tables of all the workflows of the tree of root_wf_id
+        and returns their aggregates.
+        """
+        data = _ScanData()
+        s = self.session
+
+        q = s.query(Workflow.wf_id, Workflow.wf_uuid,
+            Workflow.parent_wf_id, Workflow.root_wf_id, Workflow.dag_file_name,
+            Workflow.submit_hostname, Workflow.submit_dir, Workflow.planner_arguments,
+            Workflow.user, Workflow.grid_dn, Workflow.planner_version,
+            Workflow.dax_label, Workflow.dax_version)
+        q = q.filter(Workflow.root_wf_id == root_wf_id)
+        for row in q.all():
+            data.workflows[row.wf_id] = row
+
+        q = s.query(Workflowstate.wf_id, Workflowstate.state, Workflowstate.timestamp,
+            Workflowstate.restart_count, Workflowstate.status)
+        q = q.filter(Workflowstate.wf_id == Workflow.wf_id)
+        q = q.filter(Workflow.root_wf_id == root_wf_id)
+        data.states = q.order_by(Workflowstate.restart_count).all()
+
+        q = s.query(Host.host_id, Host.hostname)
+        q = q.filter(Host.wf_id == Workflow.wf_id)
+        q = q.filter(Workflow.root_wf_id == root_wf_id)
+        data.hosts = dict(q.all())
+
+        if self._processes > 1 and len(data.workflows) > 1:
+            self._scan_parallel(data, root_wf_id)
+        else:
+            self._scan_tables(data, root_wf_id)
+
+        if self._keep_job_statistics:
+            for wf_id in data.job_statistics:
+                data.job_statistics[wf_id] = [JobStatisticsRow(*row) for row in
+                                              sorted(data.job_statistics[wf_id], key=lambda r: r[2])]
+        return data
+
+    def _scan_parallel(self, data, root_wf_id):
+        """
+        Reads the tables of ranges of workflows of the tree in a pool
+        of worker processes, and merges their aggregates into data.
+        """
+        ranges = self._wf_ranges(data, root_wf_id, self._processes * 4)
+        self.log.debug('Reading %d workflow ranges with %d processes', len(ranges), self._processes)
+
+        args = [(self._connString, root_wf_id, wf_range, self._keep_job_statistics, data.hosts)
+                for wf_range in ranges]
+        pool = multiprocessing.Pool(self._processes, _init_worker)
+        try:
+            for partial in pool.imap_unordered(_scan_range, args):
+                data.merge(partial)
+            pool.close()
+        except:
+            pool.terminate()
+            raise
+        finally:
+            pool.join()
+
+    def _wf_ranges(self, data, root_wf_id, count):
+        """
+        Splits the workflows of the tree into at most count ranges of
+        wf_id, with about the same number of jobs.
+        """
+        q = self.session.query(Job.wf_id, func.count(Job.job_id))
+        q = q.filter(Job.wf_id == Workflow.wf_id)
+        q = q.filter(Workflow.root_wf_id == root_wf_id)
+        q = q.group_by(Job.wf_id)
+        jobs = dict(q.all())
+
+        wf_ids = sorted(data.workflows)
+        size = (sum(jobs.values()) + len(wf_ids)) / float(count)
+        ranges = []
+        start = None
+        total = 0
+        for wf_id in wf_ids:
+            if start is None:
+                start = wf_id
+            total += jobs.get(wf_id, 0) + 1
+            if total >= size:
+                ranges.append((start, wf_id))
+                start = None
+                total = 0
+        if start is not None:
+            ranges.append((start, wf_ids[-1]))
+        return ranges
+
+    def _filter_tree(self, q, root_wf_id, wf_range=None):
+        """
+        Restricts q to the workflows of the tree of root_wf_id, and to
+        the wf_id range wf_range if it is set.
+        """
+        q = q.filter(Workflow.root_wf_id == root_wf_id)
+        if wf_range is not None:
+            q = q.filter(Workflow.wf_id.between(*wf_range))
+        return q
+
+    def _scan_tables(self, data, root_wf_id, wf_range=None):
+        """
+        Reads the job, task, job_instance, jobstate and invocation tables
+        of the workflows of the tree of root_wf_id, in wf_range if it is
+        set, and adds their aggregates to data.
+        """
+        s = self.session
+
+        # job_id --> (wf_id, type_desc, exec_job_id)
+        jobs = {}
+        q = s.query(Job.job_id, Job.wf_id, Job.type_desc, Job.exec_job_id)
+        q = q.filter(Job.wf_id == Workflow.wf_id)
+        q = self._filter_tree(q, root_wf_id, wf_range)
+        for job_id, wf_id, type_desc, exec_job_id in self._stream(q):
+            jobs[job_id] = (wf_id, type_desc, exec_job_id)
+            data.jobs.add((wf_id, type_desc), 1)
+
+        # Tasks are counted by their own type, if they have a job
+        q = s.query(Task.wf_id, Task.type_desc, func.count(Task.task_id))
+        q = q.filter(Task.job_id == Job.job_id)
+        q = q.filter(Task.wf_id == Workflow.wf_id)
+        q = self._filter_tree(q, root_wf_id, wf_range)
+        q = q.group_by(Task.wf_id, Task.type_desc)
+        for wf_id, type_desc, count in q.all():
+            data.tasks.add((wf_id, type_desc), count)
+
+        instances, last_instances = self._scan_job_instances(data, jobs, root_wf_id, wf_range)
+        self._scan_jobstates(data, instances, root_wf_id, wf_range)
+        self._scan_invocations(data, instances, last_instances, root_wf_id, wf_range)
+
+    def _scan_job_instances(self, data, jobs, root_wf_id, wf_range):
+        """
+        Aggregates the job instances, and returns a dictionary of the
+        values the jobstate and invocation aggregates need, by
+        job_instance_id, and the set of ids of the last instance of
+        every job.
+        """
+        q = self.session.query(JobInstance.job_instance_id, JobInstance.job_id, JobInstance.job_submit_seq,
+            JobInstance.host_id, JobInstance.site, JobInstance.subwf_id, JobInstance.exitcode,
+            JobInstance.multiplier_factor,
+            cast(JobInstance.local_duration, Float).label('local_duration'),
+            cast(JobInstance.cluster_duration, Float).label('cluster_duration'))
+        q = q.filter(JobInstance.job_id == Job.job_id)
+        q = q.filter(Job.wf_id == Workflow.wf_id)
+        q = self._filter_tree(q, root_wf_id, wf_range)
+        q = q.order_by(JobInstance.job_instance_id)
+
+        instances = {}
+        last = {}                   # job_id --> (job_submit_seq, job_instance_id, exitcode)
+        for (job_instance_id, job_id, job_submit_seq, host_id, site, subwf_id, exitcode, mult,
+             local_duration, cluster_duration) in self._stream(q):
+            wf_id, type_desc, exec_job_id = jobs[job_id]
+            key = (wf_id, type_desc)
+            duration = local_duration
+            if duration is not None:
+                duration = duration * mult
+
+            instances[job_instance_id] = (wf_id, type_desc, mult, host_id, local_duration, job_id)
+            data.job_instances.add(key, 1, 0)
+
+            if not last.has_key(job_id) or last[job_id][0] < job_submit_seq:
+                last[job_id] = (job_submit_seq, job_instance_id, exitcode)
+
+            wall_time = (duration,
+                         duration if exitcode == 0 else 0.0,
+                         duration if exitcode > 0 else 0.0)
+            data.submit_wall_time.add(wf_id, *wall_time)
+            if type_desc not in SUBWF_TYPES or subwf_id is None:
+                data.expanded_submit_wall_time.add(wf_id, *wall_time)
+
+            if host_id is not None:
+                data.host_instances.add((wf_id, host_id), 1, local_duration)
+
+            if self._keep_job_statistics:
+                # Filled in by the jobstate and invocation scans
+                data.job_statistics.setdefault(wf_id, []).append([job_id, job_instance_id,
+                    job_submit_seq, exec_job_id, site, None, None, local_duration, None, None,
+                    cluster_duration, None, data.hosts.get(host_id), mult, None, None])
+
+        last_instances = set()
+        for job_id, (job_submit_seq, job_instance_id, exitcode) in last.iteritems():
+            wf_id, type_desc, exec_job_id = jobs[job_id]
+            data.job_instances.add((wf_id, type_desc), 0, 1)
+            data.last_instances.add((wf_id, type_desc), 1, int(exitcode == 0),
+                                    int(exitcode is not None and exitcode != 0), int(exitcode is None))
+            last_instances.add(job_instance_id)
+
+        return instances, last_instances
+
+    def _scan_jobstates(self, data, instances, root_wf_id, wf_range):
+        """
+        Aggregates the EXECUTE jobstates by time, and collects the state
+        timestamps of the job statistics.
+        """
+        q = self.session.query(Jobstate.job_instance_id, Jobstate.state,
+            cast(Jobstate.timestamp, Float).label('timestamp'))
+        q = q.filter(Jobstate.job_instance_id == JobInstance.job_instance_id)
+        q = q.filter(JobInstance.job_id == Job.job_id)
+        q = q.filter(Job.wf_id == Workflow.wf_id)
+        q = self._filter_tree(q, root_wf_id, wf_range)
+        if not self._keep_job_statistics:
+            q = q.filter(Jobstate.state == 'EXECUTE')
+        else:
+            q = q.filter(Jobstate.state.in_(JOB_STATISTICS_STATES))
+        q = q.order_by(Jobstate.job_instance_id)
+
+        # job_instance_id --> [first submit or execute, submit, execute,
+        # grid submit, post script terminated, job terminated]
+        timestamps = {}
+        for job_instance_id, state, ts in self._stream(q):
+            wf_id, type_desc, mult, host_id, local_duration, job_id = instances[job_instance_id]
+
+            if state == 'EXECUTE' and local_duration is not None:
+                data.jobs_by_time.add((type_desc, host_id, int(ts)), 1, local_duration)
+
+            if not self._keep_job_statistics:
+                continue
+
+            t = timestamps.get(job_instance_id)
+            if t is None:
+                t = timestamps[job_instance_id] = [None] * 6
+            if state in ('GRID_SUBMIT', 'GLOBUS_SUBMIT', 'EXECUTE'):
+                t[0] = _min(t[0], ts)
+            if state == 'SUBMIT':
+                t[1] = _min(t[1], ts)
+            if state == 'EXECUTE':
+                t[2] = _min(t[2], ts)
+            if state in ('GRID_SUBMIT', 'GLOBUS_SUBMIT'):
+                t[3] = _min(t[3], ts)
+            if state == 'POST_SCRIPT_TERMINATED':
+                t[4] = _min(t[4], ts)
+            if state in ('POST_SCRIPT_STARTED', 'JOB_TERMINATED'):
+                t[5] = _max(t[5], ts)
+
+        if self._keep_job_statistics:
+            for rows in data.job_statistics.values():
+                for row in rows:
+                    t = timestamps.get(row[1])
+                    if t is not None:
+                        row[5] = _sub(t[0], t[1])
+                        row[6] = _sub(t[2], t[3])
+                        row[9] = _sub(t[4], t[5])
+
+    def _scan_invocations(self, data, instances, last_instances, root_wf_id, wf_range):
+        """
+        Aggregates the invocations: wall times, tasks, transformations,
+        hosts and time statistics.
+        """
+        q = self.session.query(Invocation.job_instance_id, Invocation.wf_id, Invocation.task_submit_seq,
+            Invocation.exitcode, Invocation.transformation, Invocation.abs_task_id,
+            cast(Invocation.start_time, Float).label('start_time'),
+            cast(Invocation.remote_duration, Float).label('remote_duration'),
+            cast(Invocation.remote_cpu_time, Float).label('remote_cpu_time'))
+        # Invocations are read with the job of their job instance, which
+        # is in the same range of workflows
+        q = q.filter(Invocation.job_instance_id == JobInstance.job_instance_id)
+        q = q.filter(JobInstance.job_id == Job.job_id)
+        q = q.filter(Job.wf_id == Workflow.wf_id)
+        q = self._filter_tree(q, root_wf_id, wf_range)
+        q = q.order_by(Invocation.invocation_id)
+
+        keep_job_statistics = self._keep_job_statistics
+        cum_wall_time = data.cum_wall_time
+        transformations = data.transformations
+
+        # (wf_id, job type_desc) --> [invocations with a task, task ids,
+        # succeeded task ids, succeeded task ids of last instances,
+        # failed task ids of last instances]
+        task_sets = {}
+        # (wf_id, transformation, host_id, second) --> [count, remote duration]
+        buckets = {}
+        # job_instance_id --> [kickstart, exit code, kickstart multi, remote cpu time]
+        sums = {}
+
+        for (job_instance_id, wf_id, task_submit_seq, exitcode, transformation, abs_task_id,
+             start_time, remote_duration, remote_cpu_time) in self._stream(q):
+            job_wf_id, type_desc, mult, host_id, local_duration, job_id = instances[job_instance_id]
+            duration = remote_duration * mult
+
+            if task_submit_seq >= 0 and transformation != 'condor::dagman':
+                w = cum_wall_time.get(wf_id)
+                if w is None:
+                    w = cum_wall_time[wf_id] = [0.0, 0.0, 0.0]
+                w[0] += duration
+                if exitcode == 0:
+                    w[1] += duration
+                elif exitcode > 0:
+                    w[2] += duration
+
+            t = transformations.get((wf_id, transformation))
+            if t is None:
+                transformations[(wf_id, transformation)] = [1, duration, int(exitcode == 0),
+                    int(exitcode is not None and exitcode != 0), duration, duration]
+            else:
+                t[0] += 1
+                if duration < t[1]:
+                    t[1] = duration
+                if exitcode == 0:
+                    t[2] += 1
+                elif exitcode is not None:
+                    t[3] += 1
+                if duration > t[4]:
+                    t[4] = duration
+                t[5] += duration
+
+            key = (wf_id, transformation, host_id, int(start_time))
+            b = buckets.get(key)
+            if b is None:
+                buckets[key] = [1, remote_duration]
+            else:
+                b[0] += 1
+                b[1] += remote_duration
+
+            if abs_task_id is not None:
+                key = (job_wf_id, type_desc)
+                tasks = task_sets.get(key)
+                if tasks is None:
+                    tasks = task_sets[key] = [0, set(), set(), set(), set()]
+                if wf_id == job_wf_id:
+                    tasks[0] += 1
+                    tasks[1].add(abs_task_id)
+                if exitcode == 0:
+                    tasks[2].add(abs_task_id)
+                if job_instance_id in last_instances:
+                    if exitcode == 0:
+                        tasks[3].add(abs_task_id)
+                    elif exitcode is not None:
+                        tasks[4].add(abs_task_id)
+
+            #PM-704 the task submit sequence needs to be >= -1 to include prescript status
+            if keep_job_statistics and wf_id == job_wf_id and task_submit_seq >= -1:
+                s = sums.get(job_instance_id)
+                if s is None:
+                    s = sums[job_instance_id] = [None] * 4
+                s[1] = _max(s[1], exitcode)
+                if task_submit_seq >= 0:
+                    s[0] = _add(s[0], remote_duration)
+                    s[2] = _add(s[2], duration)
+                    s[3] = _add(s[3], remote_cpu_time)
+
+        for key, (invocations, task_ids, succeeded_pmc, succeeded, failed) in task_sets.iteritems():
+            data.task_invocations.add(key, invocations)
+            data.task_ids[key] = task_ids
+            data.succeeded_pmc_tasks[key] = succeeded_pmc
+            data.succeeded_tasks[key] = succeeded
+            data.failed_tasks[key] = failed
+
+        for (wf_id, transformation, host_id, second), values in buckets.iteritems():
+            data.invocations_by_time.add((transformation, host_id, second), *values)
+            if host_id is not None:
+                data.host_invocations.add((wf_id, host_id), *values)
+
+        if keep_job_statistics:
+            for rows in data.job_statistics.values():
+                for row in rows:
+                    s = sums.get(row[1])
+                    if s is not None:
+                        row[8], row[11], row[14], row[15] = s
+
+    #
+    # Filters
+    #
+
+    def _job_filter(self, type_desc):
+        mode = self._job_filter_mode
+        if mode == 'all':
+            return True
+        elif mode == 'nonsub':
+            return type_desc not in SUBWF_TYPES
+        elif mode == 'subwf':
+            return type_desc in SUBWF_TYPES
+        return type_desc == mode
+
+    def _host_filter_match(self, host_id):
+        hostname = self._data.hosts.get(host_id)
+        if type(self._host_filter) == type('str'):
+            return hostname == self._host_filter
+        elif type(self._host_filter) == type([]):
+            return hostname in self._host_filter
+        return True
+
+    def _xform_filter_match(self, transformation):
+        include = self._xform_filter['include']
+        exclude = self._xform_filter['exclude']
+        if include != None and exclude != None:
+            self.log.error('Can\'t set both transform include and exclude - reset s.set_transformation_filter()')
+            return True
+        elif include != None:
+            if type(include) == type('str'):
+                return transformation == include
+            elif type(include) == type([]):
+                return transformation in include
+        elif exclude != None:
+            if type(exclude) == type('str'):
+                return transformation != exclude
+            elif type(exclude) == type([]):
+                return transformation not in exclude
+        return True
+
+    def _scope(self):
+        "Workflows of the job and task totals"
+        if self._expand and self._is_root_wf:
+            return self._tree()
+        elif self._expand:
+            return set(self._wfs)
+        return set([self._wfs[0]])
+
+    def _tree(self):
+        "Workflows whose root is this workflow"
+        return set([wf_id for wf_id, row in self._data.workflows.items() if row.root_wf_id == self._root_wf_id])
+
+    def _total(self, counter, column=0, wfs=None):
+        """
+        Returns the sum of a column of a counter by (wf_id, type_desc)
+        over the job types selected by the job filter, and None if
+        there are no rows.
+        """
+        if wfs is None:
+            wfs = self._scope()
+        total = None
+        for (wf_id, type_desc), values in counter.iteritems():
+            if wf_id in wfs and self._job_filter(type_desc):
+                total = _add(total, values[column])
+        return total
+
+    def _distinct(self, sets, wfs=None):
+        """
+        Returns the number of distinct task ids of sets by (wf_id,
+        type_desc), per workflow, over the job types selected by the
+        job filter.
+        """
+        if wfs is None:
+            wfs = self._scope()
+        tasks = {}
+        for (wf_id, type_desc), task_ids in sets.iteritems():
+            if wf_id in wfs and self._job_filter(type_desc):
+                tasks.setdefault(wf_id, set()).update(task_ids)
+        return sum([len(task_ids) for task_ids in tasks.values()])
+
+    #
+    # Pulls information about sub workflows
+    #
+
+    def get_descendant_workflow_ids(self):
+        rows = [WorkflowIdRow(row.wf_id, row.wf_uuid) for row in self._data.workflows.values()
+                if row.root_wf_id == self._root_wf_id and row.wf_id != self._root_wf_id]
+        return sorted(rows)
+
+    #
+    # Status of initially planned wf components.
+    #
+
+    def get_total_jobs_status(self):
+        return self._total(self._data.jobs) or 0
+
+    def get_total_succeeded_failed_jobs_status(self):
+        if self._total(self._data.last_instances) is None:
+            return SucceededFailedRow(None, None)
+        return SucceededFailedRow(self._total(self._data.last_instances, 1),
+                                  self._total(self._data.last_instances, 2))
+
+    def get_total_succeeded_jobs_status(self):
+        return self._total(self._data.last_instances, 1) or 0
+
+    def get_total_failed_jobs_status(self):
+        return self._total(self._data.last_instances, 2) or 0
+
+    def get_total_running_jobs_status(self):
+        return self._total(self._data.last_instances, 3) or 0
+
+    def get_total_jobs_retries(self):
+        return (self._total(self._data.job_instances) or 0) - (self._total(self._data.job_instances, 1) or 0)
+
+    def get_total_tasks_status(self):
+        return self._total(self._data.tasks) or 0
+
+    def get_total_succeeded_tasks_status(self, pmc=False):
+        if pmc:
+            return self._distinct(self._data.succeeded_pmc_tasks)
+        return self._distinct(self._data.succeeded_tasks)
+
+    def get_total_failed_tasks_status(self):
+        return self._distinct(self._data.failed_tasks)
+
+    def get_total_tasks_retries(self):
+        return (self._total(self._data.task_invocations) or 0) - self._distinct(self._data.task_ids)
+
+    #
+    # Run statistics
+    #
+
+    def get_workflow_states(self):
+        return [row for row in self._data.states if row.wf_id == self._root_wf_id]
+
+    def _wall_time(self, counter, wfs):
+        total = [None, None, None]
+        for wf_id in wfs:
+            if counter.has_key(wf_id):
+                total = [_add(a, b) for a, b in zip(total, counter[wf_id])]
+        return WallTimeRow(*total)
+
+    def get_workflow_cum_job_wall_time(self):
+        if self._expand:
+            return self._wall_time(self._data.cum_wall_time, self._tree())
+        return self._wall_time(self._data.cum_wall_time, self._wfs)
+
+    def get_submit_side_job_wall_time(self):
+        if self._expand:
+            return self._wall_time(self._data.expanded_submit_wall_time, self._tree())
+        return self._wall_time(self._data.submit_wall_time, self._wfs)
+
+    def get_workflow_details(self):
+        return [self._data.workflows[wf_id] for wf_id in self._wfs]
+
+    def get_workflow_retries(self):
+        if self._expand and self._is_root_wf:
+            wfs = self._tree()
+        else:
+            wfs = set(self._wfs)
+        retries = {}
+        for row in self._data.states:
+            if row.wf_id in wfs:
+                retries[row.wf_id] = max(retries.get(row.wf_id, row.restart_count), row.restart_count)
+        if not retries:
+            return None
+        return sum(retries.values())
+
+    #
+    # Job Statistics
+    #
+
+    def get_job_statistics(self):
+        if self._expand:
+            return []
+        if not self._keep_job_statistics:
+            raise ValueError('Job statistics were not kept, use job_statistics=True')
+        return self._data.job_statistics.get(self._wfs[0], [])
+
+    def get_transformation_statistics(self):
+        wfs = set(self._wfs)
+        totals = {}
+        for (wf_id, transformation), t in self._data.transformations.iteritems():
+            if wf_id not in wfs:
+                continue
+            total = totals.get(transformation)
+            if total is None:
+                totals[transformation] = list(t)
+            else:
+                total[0] += t[0]
+                total[1] = _min(total[1], t[1])
+                total[2] += t[2]
+                total[3] += t[3]
+                total[4] = _max(total[4], t[4])
+                total[5] = _add(total[5], t[5])
+
+        rows = []
+        for transformation in sorted(totals):
+            count, min_duration, success, failure, max_duration, total = totals[transformation]
+            rows.append(TransformationRow(transformation, count, min_duration, success, failure,
+                                          max_duration, total / count, total))
+        return rows
+
+    def get_host_statistics(self):
+        wfs = set(self._wfs)
+        hosts = {}
+        for (wf_id, host_id), (job_instances, local_duration) in self._data.host_instances.iteritems():
+            if wf_id not in wfs or not self._host_filter_match(host_id):
+                continue
+            invocations, remote_duration = self._data.host_invocations.get((wf_id, host_id), (0, None))
+            host = hosts.setdefault(self._data.hosts[host_id], [0, None, 0, None])
+            host[0] += job_instances
+            host[1] = _add(host[1], local_duration)
+            host[2] += invocations
+            host[3] = _add(host[3], remote_duration)
+
+        return [HostRow(hostname, *hosts[hostname]) for hostname in sorted(hosts)]
+
+    #
+    # Runtime queries
+    #
+
+    def _by_time(self, counter, match, per_host):
+        """
+        Sums the [count, runtime] values of counter by date, and by
+        host name if per_host is set, for the keys accepted by match.
+        As in StampedeStatistics, the statistics are over the workflows
+        whose root is this workflow, so there are none for
+        sub-workflows.
+        """
+        if not self._is_root_wf:
+            return []
+
+        divisor = DATE_DIVISORS[self._time_filter_mode]
+        totals = _Counter()
+        for (name, host_id, second), values in counter.iteritems():
+            if not match(name):
+                continue
+            if per_host:
+                if host_id is None or not self._host_filter_match(host_id):
+                    continue
+                totals.add((second // divisor, self._data.hosts[host_id]), *values)
+            else:
+                totals.add((second // divisor,), *values)
+
+        if per_host:
+            return [HostTimeRow(date, host_name, count, runtime)
+                    for (date, host_name), (count, runtime) in sorted(totals.items())]
+        return [TimeRow(date, count, runtime) for (date,), (count, runtime) in sorted(totals.items())]
+
+    def get_invocation_by_time(self):
+        return self._by_time(self._data.invocations_by_time, self._xform_filter_match, False)
+
+    def get_jobs_run_by_time(self):
+        return self._by_time(self._data.jobs_by_time, self._job_filter, False)
+
+    def get_invocation_by_time_per_host(self, host=None):
+        return self._by_time(self._data.invocations_by_time, self._xform_filter_match, True)
+
+    def get_jobs_run_by_time_per_host(self):
+        return self._by_time(self._data.jobs_by_time, self._job_filter, True)
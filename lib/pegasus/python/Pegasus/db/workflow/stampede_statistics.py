@@ -144,6 +144,7 @@ Methods::
  get_resource_delay
  get_post_time
  get_transformation_statistics
+ get_host_statistics
  get_invocation_by_time
  get_jobs_run_by_time
  get_invocation_by_time_per_host
@@ -151,6 +152,14 @@ Methods::
 
 Methods listed in order of query list on wiki.
 
+Summary tables:
+
+The totals of workflows that are not running are read from the
+workflow_summary, transformation_summary and host_summary tables,
+which pegasus-monitord fills when a workflow ends (see
+Pegasus.db.summary). Totals are computed from the job and invocation
+tables instead when any of the workflows has no summary.
+
 https://confluence.pegasus.isi.edu/display/pegasus/Pegasus+Statistics+Python+Version+Modified
 """
 __author__ = "Monte Goode"
@@ -180,6 +189,7 @@ class StampedeStatistics(object):
         self._xform_filter = {'include':None, 'exclude':None}
 
         self._wfs = []
+        self._summarized = None
 
     def initialize(self, root_wf_uuid = None, root_wf_id = None):
         if root_wf_uuid == None and root_wf_id == None:
@@ -372,11 +382,50 @@ class StampedeStatistics(object):
         sub_q = sub_q.group_by(JobInstanceSubMax.job_id).subquery()
         return sub_q
 
+    def _filter_wfs(self, q, wf_id):
+        """
+        Restricts q to the rows whose wf_id column is one of the
+        workflows of the statistics. The workflows of an expanded root
+        workflow are selected with a join on root_wf_id, instead of an
+        IN list of all their ids.
+        """
+        if self._expand and self._is_root_wf:
+            WorkflowScope = orm.aliased(Workflow, name='WorkflowScope')
+            q = q.filter(wf_id == WorkflowScope.wf_id)
+            return q.filter(WorkflowScope.root_wf_id == self._root_wf_id)
+        return q.filter(wf_id.in_(self._wfs))
+
+    def _is_summarized(self):
+        """
+        Returns True if all the workflows have a summary, that is, if
+        none of them is running.
+        """
+        if self._summarized is None:
+            q = self.session.query(func.count(distinct(WorkflowSummary.wf_id)))
+            q = self._filter_wfs(q, WorkflowSummary.wf_id)
+            self._summarized = q.scalar() == len(set(self._wfs))
+            self.log.debug('Workflow summaries found: %s', self._summarized)
+        return self._summarized
+
+    def _summary_total(self, column):
+        """
+        Returns the sum of a workflow_summary column over the job
+        types selected by the job filter.
+        """
+        q = self.session.query(func.sum(column))
+        q = self._filter_wfs(q, WorkflowSummary.wf_id)
+        if self._get_job_filter(WorkflowSummary) is not None:
+            q = q.filter(self._get_job_filter(WorkflowSummary))
+        return int(q.scalar() or 0)
+
     def get_total_jobs_status(self):
         """
         https://confluence.pegasus.isi.edu/display/pegasus/Workflow+Summary#WorkflowSummary-Totaljobs
         https://confluence.pegasus.isi.edu/display/pegasus/Workflow+Statistics+file#WorkflowStatisticsfile-Totaljobs
         """
+        if self._is_summarized():
+            return self._summary_total(WorkflowSummary.jobs)
+
         q = self.session.query(Job.job_id)
         if self._expand and self._is_root_wf:
             q = q.filter(Workflow.root_wf_id == self._root_wf_id)
@@ -450,6 +499,9 @@ class StampedeStatistics(object):
         https://confluence.pegasus.isi.edu/display/pegasus/Workflow+Summary#WorkflowSummary-Totalsucceededjobs
         https://confluence.pegasus.isi.edu/display/pegasus/Workflow+Statistics+file#WorkflowStatisticsfile-Totalsucceededjobs
         """
+        if self._is_summarized():
+            return self._summary_total(WorkflowSummary.succeeded_jobs)
+
         JobInstanceSub = orm.aliased(JobInstance, name='JobInstanceSub')
         sq_1 = self.session.query(func.max(JobInstanceSub.job_submit_seq).label('jss'), JobInstanceSub.job_id.label('jobid'))
         if self._expand and self._is_root_wf:
@@ -497,6 +549,9 @@ class StampedeStatistics(object):
         return q
 
     def get_total_running_jobs_status(self):
+        if self._is_summarized():
+            return self._summary_total(WorkflowSummary.running_jobs)
+
         JobInstanceSub = orm.aliased(JobInstance, name='JobInstanceSub')
         sq_1 = self.session.query(func.max(JobInstanceSub.job_submit_seq).label('jss'), JobInstanceSub.job_id.label('jobid'))
         if self._expand and self._is_root_wf:
@@ -518,6 +573,8 @@ class StampedeStatistics(object):
         return q.count()
 
     def get_total_failed_jobs_status(self):
+        if self._is_summarized():
+            return self._summary_total(WorkflowSummary.failed_jobs)
 
         q = self._get_total_failed_jobs_status()
         return q.count()
@@ -537,6 +594,9 @@ class StampedeStatistics(object):
         https://confluence.pegasus.isi.edu/display/pegasus/Workflow+Summary#WorkflowSummary-TotalJobRetries
         https://confluence.pegasus.isi.edu/display/pegasus/Workflow+Statistics+file#WorkflowStatisticsfile-TotalJobRetries
         """
+        if self._is_summarized():
+            return self._summary_total(WorkflowSummary.job_retries)
+
         d_or_d = self._dax_or_dag_cond()
 
         sq_1 = self.session.query(func.count(Job.job_id))
@@ -577,6 +637,9 @@ class StampedeStatistics(object):
         https://confluence.pegasus.isi.edu/display/pegasus/Workflow+Summary#WorkflowSummary-Totaltask
         https://confluence.pegasus.isi.edu/display/pegasus/Workflow+Statistics+file#WorkflowStatisticsfile-Totaltasks
         """
+        if self._is_summarized():
+            return self._summary_total(WorkflowSummary.tasks)
+
         q = self.session.query(Task.task_id)
         if self._expand and self._is_root_wf:
             q = q.filter(Workflow.root_wf_id == self._root_wf_id)
@@ -689,9 +752,13 @@ class StampedeStatistics(object):
         return q.one()[0] or 0
 
     def get_total_succeeded_tasks_status(self,pmc=False):
+        if not pmc and self._is_summarized():
+            return self._summary_total(WorkflowSummary.succeeded_tasks)
         return self._task_statistics_query_sum(True,pmc)
 
     def get_total_failed_tasks_status(self):
+        if self._is_summarized():
+            return self._summary_total(WorkflowSummary.failed_tasks)
         return self._task_statistics_query_sum(False,False)
 
     def get_task_success_report(self,pmc=False):
@@ -705,6 +772,9 @@ class StampedeStatistics(object):
         https://confluence.pegasus.isi.edu/display/pegasus/Workflow+Summary#WorkflowSummary-Totaltaskretries
         https://confluence.pegasus.isi.edu/display/pegasus/Workflow+Statistics+file#WorkflowStatisticsfile-Totaltaskretries
         """
+        if self._is_summarized():
+            return self._summary_total(WorkflowSummary.task_retries)
+
         sq_1 = self.session.query(Workflow.wf_id.label('wid'), Invocation.abs_task_id.label('tid'))
         if self._expand and self._is_root_wf:
             sq_1 = sq_1.filter(Workflow.root_wf_id == self._root_wf_id)
@@ -756,6 +826,13 @@ class StampedeStatistics(object):
         https://confluence.pegasus.isi.edu/display/pegasus/Workflow+Summary#WorkflowSummary-Workflowcumulativejobwalltime
         https://confluence.pegasus.isi.edu/display/pegasus/Workflow+Statistics+file#WorkflowStatisticsfile-Workflowcumulativejobwalltime
         """
+        if (self._is_root_wf or not self._expand) and self._is_summarized():
+            q = self.session.query(cast(func.sum(WorkflowSummary.cum_wall_time), Float),
+                                   cast(func.sum(WorkflowSummary.cum_goodput), Float),
+                                   cast(func.sum(WorkflowSummary.cum_badput), Float))
+            q = self._filter_wfs(q, WorkflowSummary.wf_id)
+            return q.first()
+
         q = self.session.query(cast(func.sum(Invocation.remote_duration * JobInstance.multiplier_factor), Float),
                                cast(func.sum(case([(
                                    Invocation.exitcode == 0, Invocation.remote_duration * JobInstance.multiplier_factor
@@ -792,6 +869,19 @@ class StampedeStatistics(object):
         https://confluence.pegasus.isi.edu/display/pegasus/Workflow+Summary#WorkflowSummary-Cumulativejobwalltimeasseenfromsubmitside
         https://confluence.pegasus.isi.edu/display/pegasus/Workflow+Statistics+file#WorkflowStatisticsfile-Cumulativejobwalltimeasseenfromsubmitside
         """
+        if (self._is_root_wf or not self._expand) and self._is_summarized():
+            if self._expand:
+                columns = (WorkflowSummary.expanded_submit_wall_time, WorkflowSummary.expanded_submit_goodput,
+                           WorkflowSummary.expanded_submit_badput)
+            else:
+                columns = (WorkflowSummary.submit_wall_time, WorkflowSummary.submit_goodput,
+                           WorkflowSummary.submit_badput)
+            q = self.session.query(cast(func.sum(columns[0]), Float).label('wall_time'),
+                                   cast(func.sum(columns[1]), Float),
+                                   cast(func.sum(columns[2]), Float))
+            q = self._filter_wfs(q, WorkflowSummary.wf_id)
+            return q.first()
+
         q = self.session.query(cast(func.sum(JobInstance.local_duration * JobInstance.multiplier_factor), Float).label('wall_time'),
                                cast(func.sum(case([(
                                    JobInstance.exitcode == 0, JobInstance.local_duration * JobInstance.multiplier_factor
@@ -825,7 +915,7 @@ class StampedeStatistics(object):
             Workflow.submit_hostname, Workflow.submit_dir, Workflow.planner_arguments,
             Workflow.user, Workflow.grid_dn, Workflow.planner_version,
             Workflow.dax_label, Workflow.dax_version)
-        q = q.filter(Workflow.wf_id.in_(self._wfs))
+        q = self._filter_wfs(q, Workflow.wf_id)
         return q.all()
 
     def get_workflow_retries(self):
@@ -850,92 +940,74 @@ class StampedeStatistics(object):
     # https://confluence.pegasus.isi.edu/display/pegasus/Job+Statistics+file
     #
 
+    def _state_timestamp(self, states, function=func.min):
+        """
+        Conditional aggregate of the timestamps of the jobstates in
+        states, for a query grouped by job instance.
+        """
+        return function(case([(Jobstate.state.in_(states), Jobstate.timestamp)]))
+
     def get_job_statistics(self):
         """
         https://confluence.pegasus.isi.edu/display/pegasus/Job+Statistics+file#JobStatisticsfile-All
+
+        The jobstate timestamps and invocation sums of all job
+        instances are aggregated in two grouped queries and joined,
+        instead of running eleven correlated subqueries for every job
+        instance.
         """
         if self._expand:
             return []
-        sq_1 = self.session.query(func.min(Jobstate.timestamp))
-        sq_1 = sq_1.filter(Jobstate.job_instance_id == JobInstance.job_instance_id).correlate(JobInstance)
-        sq_1 = sq_1.filter(or_(Jobstate.state == 'GRID_SUBMIT', Jobstate.state == 'GLOBUS_SUBMIT',
-                                Jobstate.state == 'EXECUTE'))
-        sq_1 = sq_1.subquery()
-
-        sq_2 = self.session.query(Jobstate.timestamp)
-        sq_2 = sq_2.filter(Jobstate.job_instance_id == JobInstance.job_instance_id).correlate(JobInstance)
-        sq_2 = sq_2.filter(Jobstate.state == 'SUBMIT')
-        sq_2 = sq_2.subquery()
-
-        sq_3 = self.session.query(func.min(Jobstate.timestamp))
-        sq_3 = sq_3.filter(Jobstate.job_instance_id == JobInstance.job_instance_id).correlate(JobInstance)
-        sq_3 = sq_3.filter(Jobstate.state == 'EXECUTE')
-        sq_3 = sq_3.subquery()
-
-        sq_4 = self.session.query(func.min(Jobstate.timestamp))
-        sq_4 = sq_4.filter(Jobstate.job_instance_id == JobInstance.job_instance_id).correlate(JobInstance)
-        sq_4 = sq_4.filter(or_(Jobstate.state == 'GRID_SUBMIT', Jobstate.state == 'GLOBUS_SUBMIT'))
-        sq_4 = sq_4.subquery()
 
-        sq_5 = self.session.query(func.sum(Invocation.remote_duration))
-        sq_5 = sq_5.filter(Invocation.job_instance_id == JobInstance.job_instance_id).correlate(JobInstance)
-        sq_5 = sq_5.filter(Invocation.wf_id == Job.wf_id).correlate(Job)
-        sq_5 = sq_5.filter(Invocation.task_submit_seq >= 0)
-        sq_5 = sq_5.group_by().subquery()
-
-        sq_6 = self.session.query(Jobstate.timestamp)
-        sq_6 = sq_6.filter(Jobstate.job_instance_id == JobInstance.job_instance_id).correlate(JobInstance)
-        sq_6 = sq_6.filter(Jobstate.state == 'POST_SCRIPT_TERMINATED')
-        sq_6 = sq_6.subquery()
-
-        sq_7 = self.session.query(func.max(Jobstate.timestamp))
-        sq_7 = sq_7.filter(Jobstate.job_instance_id == JobInstance.job_instance_id).correlate(JobInstance)
-        sq_7 = sq_7.filter(or_(Jobstate.state == 'POST_SCRIPT_STARTED', Jobstate.state == 'JOB_TERMINATED'))
-        sq_7 = sq_7.subquery()
-
-        sq_8 = self.session.query(func.max(Invocation.exitcode))
-        sq_8 = sq_8.filter(Invocation.job_instance_id == JobInstance.job_instance_id).correlate(JobInstance)
-        sq_8 = sq_8.filter(Invocation.wf_id == Job.wf_id).correlate(Job)
+        # One row per job instance with the timestamps of the states
+        # we need
+        js = self.session.query(Jobstate.job_instance_id,
+            self._state_timestamp(['GRID_SUBMIT', 'GLOBUS_SUBMIT', 'EXECUTE']).label('first_submit_or_execute'),
+            self._state_timestamp(['SUBMIT']).label('submit'),
+            self._state_timestamp(['EXECUTE']).label('execute'),
+            self._state_timestamp(['GRID_SUBMIT', 'GLOBUS_SUBMIT']).label('grid_submit'),
+            self._state_timestamp(['POST_SCRIPT_TERMINATED']).label('post_script_terminated'),
+            self._state_timestamp(['POST_SCRIPT_STARTED', 'JOB_TERMINATED'], func.max).label('job_terminated'))
+        js = js.filter(Jobstate.job_instance_id == JobInstance.job_instance_id)
+        js = js.filter(JobInstance.job_id == Job.job_id)
+        js = js.filter(Job.wf_id.in_(self._wfs))
+        js = js.filter(Jobstate.state.in_(['GRID_SUBMIT', 'GLOBUS_SUBMIT', 'EXECUTE', 'SUBMIT',
+                                           'POST_SCRIPT_TERMINATED', 'POST_SCRIPT_STARTED', 'JOB_TERMINATED']))
+        js = js.group_by(Jobstate.job_instance_id).subquery()
+
+        # One row per job instance with the sums of its tasks
         #PM-704 the task submit sequence needs to be >= -1 to include prescript status
-        sq_8 = sq_8.filter(Invocation.task_submit_seq >= -1)
-        sq_8 = sq_8.group_by().subquery()
-
-        JobInstanceSub = orm.aliased(JobInstance)
-
-        sq_9 = self.session.query(Host.hostname)
-        sq_9 = sq_9.filter(JobInstanceSub.job_instance_id == JobInstance.job_instance_id).correlate(JobInstance)
-        sq_9 = sq_9.filter(Host.host_id == JobInstanceSub.host_id)
-        sq_9 = sq_9.subquery()
-
-        JI = orm.aliased(JobInstance)
-        sq_10 = self.session.query(func.sum(Invocation.remote_duration * JI.multiplier_factor))
-        sq_10 = sq_10.filter(Invocation.job_instance_id == JobInstance.job_instance_id).correlate(JobInstance)
-        sq_10 = sq_10.filter(Invocation.job_instance_id == JI.job_instance_id)
-        sq_10 = sq_10.filter(Invocation.wf_id == Job.wf_id).correlate(Job)
-        sq_10 = sq_10.filter(Invocation.task_submit_seq >= 0)
-        sq_10 = sq_10.group_by().subquery()
-
-        sq_11 = self.session.query(func.sum(Invocation.remote_cpu_time))
-        sq_11 = sq_11.filter(Invocation.job_instance_id == JobInstance.job_instance_id).correlate(JobInstance)
-        sq_11 = sq_11.filter(Invocation.wf_id == Job.wf_id).correlate(Job)
-        sq_11 = sq_11.filter(Invocation.task_submit_seq >= 0)
-        sq_11 = sq_11.group_by().subquery()
-
+        task = Invocation.task_submit_seq >= 0
+        inv = self.session.query(Invocation.job_instance_id,
+            func.sum(case([(task, Invocation.remote_duration)])).label('kickstart'),
+            func.max(Invocation.exitcode).label('exit_code'),
+            func.sum(case([(task, Invocation.remote_duration * JobInstance.multiplier_factor)])).label('kickstart_multi'),
+            func.sum(case([(task, Invocation.remote_cpu_time)])).label('remote_cpu_time'))
+        inv = inv.filter(Invocation.job_instance_id == JobInstance.job_instance_id)
+        inv = inv.filter(JobInstance.job_id == Job.job_id)
+        inv = inv.filter(Invocation.wf_id == Job.wf_id)
+        inv = inv.filter(Job.wf_id.in_(self._wfs))
+        inv = inv.filter(Invocation.task_submit_seq >= -1)
+        inv = inv.group_by(Invocation.job_instance_id).subquery()
 
         q = self.session.query(Job.job_id, JobInstance.job_instance_id, JobInstance.job_submit_seq,
             Job.exec_job_id.label('job_name'), JobInstance.site,
-            cast(sq_1.as_scalar() - sq_2.as_scalar(), Float).label('condor_q_time'),
-            cast(sq_3.as_scalar() - sq_4.as_scalar(), Float).label('resource_delay'),
+            cast(js.c.first_submit_or_execute - js.c.submit, Float).label('condor_q_time'),
+            cast(js.c.execute - js.c.grid_submit, Float).label('resource_delay'),
             cast(JobInstance.local_duration, Float).label('runtime'),
-            cast(sq_5.as_scalar(), Float).label('kickstart'),
-            cast(sq_6.as_scalar() - sq_7.as_scalar(), Float).label('post_time'),
+            cast(inv.c.kickstart, Float).label('kickstart'),
+            cast(js.c.post_script_terminated - js.c.job_terminated, Float).label('post_time'),
             cast(JobInstance.cluster_duration, Float).label('seqexec'),
-            sq_8.as_scalar().label('exit_code'),
-            sq_9.as_scalar().label('host_name'),
+            inv.c.exit_code,
+            Host.hostname.label('host_name'),
             JobInstance.multiplier_factor,
-            cast(sq_10.as_scalar(), Float).label('kickstart_multi'),
-            sq_11.as_scalar().label('remote_cpu_time'))
-        q = q.filter(JobInstance.job_id == Job.job_id)
+            cast(inv.c.kickstart_multi, Float).label('kickstart_multi'),
+            inv.c.remote_cpu_time)
+        q = q.select_from(JobInstance)
+        q = q.join(Job, JobInstance.job_id == Job.job_id)
+        q = q.outerjoin(js, js.c.job_instance_id == JobInstance.job_instance_id)
+        q = q.outerjoin(inv, inv.c.job_instance_id == JobInstance.job_instance_id)
+        q = q.outerjoin(Host, Host.host_id == JobInstance.host_id)
         q = q.filter(Job.wf_id.in_(self._wfs))
         q = q.order_by(JobInstance.job_submit_seq)
 
@@ -1336,6 +1408,20 @@ class StampedeStatistics(object):
         invoc.job_instance_id = ji.job_instance_id and
         invoc.wf_id IN (1,2,3) GROUP BY transformation
         """
+        if self._is_summarized():
+            S = TransformationSummary
+            q = self.session.query(S.transformation,
+                    func.sum(S.invocations).label('count'),
+                    cast(func.min(S.min_duration), Float).label('min'),
+                    func.sum(S.succeeded).label('success'),
+                    func.sum(S.failed).label('failure'),
+                    cast(func.max(S.max_duration), Float).label('max'),
+                    cast(cast(func.sum(S.total_duration), Float) / func.sum(S.invocations), Float).label('avg'),
+                    cast(func.sum(S.total_duration), Float).label('sum'))
+            q = self._filter_wfs(q, S.wf_id)
+            q = q.group_by(S.transformation)
+            return q.all()
+
         q = self.session.query(Invocation.transformation,
                 func.count(Invocation.invocation_id).label('count'),
                 cast(func.min(Invocation.remote_duration * JobInstance.multiplier_factor), Float).label('min'),
@@ -1345,11 +1431,55 @@ class StampedeStatistics(object):
                 cast(func.avg(Invocation.remote_duration * JobInstance.multiplier_factor), Float).label('avg'),
                 cast(func.sum(Invocation.remote_duration * JobInstance.multiplier_factor), Float).label('sum'))
         q = q.filter(Invocation.job_instance_id == JobInstance.job_instance_id)
-        q = q.filter(Invocation.wf_id.in_(self._wfs))
+        q = self._filter_wfs(q, Invocation.wf_id)
         q = q.group_by(Invocation.transformation)
 
         return q.all()
 
+    def get_host_statistics(self):
+        """
+        Returns, for each host, the number of job instances that ran
+        on it and their total local duration, and the number of
+        invocations and their total remote duration.
+        """
+        if self._is_summarized():
+            q = self.session.query(Host.hostname.label('host_name'),
+                    func.sum(HostSummary.job_instances).label('job_instances'),
+                    cast(func.sum(HostSummary.local_duration), Float).label('local_duration'),
+                    func.sum(HostSummary.invocations).label('invocations'),
+                    cast(func.sum(HostSummary.remote_duration), Float).label('remote_duration'))
+            q = q.filter(HostSummary.host_id == Host.host_id)
+            q = self._filter_wfs(q, HostSummary.wf_id)
+        else:
+            sq_1 = self.session.query(JobInstance.host_id.label('host_id'),
+                    func.count(JobInstance.job_instance_id).label('job_instances'),
+                    func.sum(JobInstance.local_duration).label('local_duration'))
+            sq_1 = sq_1.filter(JobInstance.job_id == Job.job_id)
+            sq_1 = self._filter_wfs(sq_1, Job.wf_id)
+            sq_1 = sq_1.group_by(JobInstance.host_id).subquery()
+
+            sq_2 = self.session.query(JobInstance.host_id.label('host_id'),
+                    func.count(Invocation.invocation_id).label('invocations'),
+                    func.sum(Invocation.remote_duration).label('remote_duration'))
+            sq_2 = sq_2.filter(Invocation.job_instance_id == JobInstance.job_instance_id)
+            sq_2 = self._filter_wfs(sq_2, Invocation.wf_id)
+            sq_2 = sq_2.group_by(JobInstance.host_id).subquery()
+
+            q = self.session.query(Host.hostname.label('host_name'),
+                    func.sum(sq_1.c.job_instances).label('job_instances'),
+                    cast(func.sum(sq_1.c.local_duration), Float).label('local_duration'),
+                    func.sum(func.coalesce(sq_2.c.invocations, 0)).label('invocations'),
+                    cast(func.sum(sq_2.c.remote_duration), Float).label('remote_duration'))
+            q = q.select_from(sq_1)
+            q = q.join(Host, Host.host_id == sq_1.c.host_id)
+            q = q.outerjoin(sq_2, sq_2.c.host_id == sq_1.c.host_id)
+
+        if self._get_host_filter() is not None:
+            q = q.filter(self._get_host_filter())
+        q = q.group_by(Host.hostname).order_by(Host.hostname)
+
+        return q.all()
+
     #
     # Runtime queries
     # https://confluence.pegasus.isi.edu/display/pegasus/Additional+queries
@@ -3,10 +3,162 @@ __author__ = "Karan Vahi"
 
 from Pegasus.db.schema import *
 from Pegasus.db.base_loader import BaseLoader
+from Pegasus.db import summary
 from Pegasus.netlogger import util
 from sqlalchemy import exc
+from collections import OrderedDict
 import time
 
+# Position of each table in dependency order, so bulk inserts
+# respect foreign keys the same way the session unit of work does
+_table_order = dict([(table, i) for i, table in enumerate(metadata.sorted_tables)])
+
+# Mapper class --> mapped table
+_mapped_tables = {}
+
+def _mapped_table(o):
+    "Returns the table the class of o is mapped to"
+    cls = o.__class__
+    if not _mapped_tables.has_key(cls):
+        _mapped_tables[cls] = orm.class_mapper(cls).local_table
+    return _mapped_tables[cls]
+
+def _insert_values(o, table):
+    """
+    Returns a dict with the column values of o to insert into table.
+    Columns that are not set, or set to None, get what the session
+    would have inserted for them: NULL, or their scalar default. So
+    rows of the same table usually have the same columns, and can be
+    inserted with a single executemany.
+    """
+    values = {}
+    state = o.__dict__
+    for column in table.columns:
+        value = state.get(column.key)
+        if value is None:
+            if column.server_default is not None:
+                continue
+            if column.default is not None:
+                if not column.default.is_scalar:
+                    continue
+                value = column.default.arg
+            elif column.primary_key and column.autoincrement:
+                continue
+        values[column.key] = value
+    return values
+
+# BP event attributes, undotted, that are stored in attributes with
+# another name
+ATTR_REMAP = {
+    # workflow
+    'xwf_id': 'wf_uuid',
+    'parent_xwf_id': 'parent_wf_id',
+    # task.info
+    'task_id': 'abs_task_id',
+    # task.edge
+    'child_task_id': 'child_abs_task_id',
+    'parent_task_id': 'parent_abs_task_id',
+    # job.info
+    'job_id': 'exec_job_id',
+    # job.edge
+    'child_job_id': 'child_exec_job_id',
+    'parent_job_id': 'parent_exec_job_id',
+    # xwf.start/end (none)
+    # job_inst.submit.start/job_inst.submit.start/etc
+    'job_inst_id': 'job_submit_seq',
+    'js_id': 'jobstate_submit_seq',
+    'cluster_dur': 'cluster_duration',
+    'local_dur': 'local_duration',
+    # inv.end
+    'inv_id': 'task_submit_seq',
+    'dur': 'remote_duration',
+}
+
+def _escape_argv(v):
+    "Sanitize argv input"
+    return v.replace("\\", "\\\\").replace("'", "\\'")
+
+# Attribute --> function converting its (string) value
+ATTR_TYPES = {
+    'argv': _escape_argv,
+    # make all timestamp values floats
+    'ts': float,
+    'start_time': float,
+    'cluster_start_time': float,
+    'duration': float,
+    'restart_count': int,
+}
+
+def _compile_key(k):
+    """
+    Returns a tuple with the attribute the BP event key k is stored
+    in, and the function converting its values, or None. The
+    attribute is None for keys that are not stored.
+    """
+    if k == 'level':
+        return (None, None)
+
+    # undot
+    attr = k.replace('.', '_')
+    # remap attr names
+    attr = ATTR_REMAP.get(attr, attr)
+
+    return (attr, ATTR_TYPES.get(attr))
+
+# Event keyword --> attribute, see event_record()
+_record_attrs = {}
+
+class EventRecord(object):
+    """
+    A stampede event whose values are keyed by the attributes of the
+    mapper classes, not by BP keys, so linedataToObject() copies them
+    to row objects as they are. Handlers that need a few values by
+    their BP keys, like linedata['xwf.id'], can still read them.
+    """
+    __slots__ = ('event', 'attrs')
+
+    def __init__(self, event, attrs):
+        self.event = event
+        self.attrs = attrs
+
+    def __getitem__(self, key):
+        if key == 'event':
+            return self.event
+        return self.attrs[_compile_key(key)[0]]
+
+    def itervalues(self):
+        return self.attrs.itervalues()
+
+    def __repr__(self):
+        return 'EventRecord(%r, %r)' % (self.event, self.attrs)
+
+def event_record(event, kw):
+    """
+    Returns an EventRecord for event, with the values of the keyword
+    arguments kw, named like in the BP output (xwf__id for xwf.id).
+    The attribute of each keyword is only worked out the first time
+    it is seen.
+    """
+    attrs = {}
+    for k, v in kw.iteritems():
+        attr = _record_attrs.get(k)
+        if attr is None:
+            # '' for keywords that are not stored
+            attr = _record_attrs[k] = _compile_key(k.replace('__', '.'))[0] or ''
+        if attr:
+            attrs[attr] = v
+    return EventRecord(event, attrs)
+
+class WorkflowCache(object):
+    "Lookup caches for the rows of a single workflow"
+
+    def __init__(self):
+        self.job_id = {}            # exec_job_id --> job_id
+        self.job_instance_id = {}   # (job_id, job_submit_seq) --> job_instance_id
+        self.task_id = {}           # abs_task_id --> task_id
+        self.lfn_id = {}            # lfn --> lfn_id
+        self.host = {}              # (job_id, job_submit_seq) --> True once its host is mapped
+
 class WorkflowLoader(BaseLoader):
     """Load into the Stampede SQL schema through SQLAlchemy.
 
@@ -23,15 +175,24 @@ class WorkflowLoader(BaseLoader):
     """
 
     MAX_RETRIES = 10 # maximum number of retries in case of operational errors that arise because of database locked/connection dropped
+    MAX_CACHED_WORKFLOWS = 100 # maximum number of workflows whose lookup caches are kept, least recently used ones are dropped
+    MAX_LFN_QUERY_SIZE = 500 # maximum number of lfns looked up in a single IN query
 
-    def __init__(self, connString, perf=False, batch=False, props=None, db_type=None, backup=False):
+    def __init__(self, connString, perf=False, batch=False, props=None, db_type=None, backup=False, bulk=True,
+                 stats_file=None):
         """Init object
 
         @type   connString: string
         @param  connString: SQLAlchemy connection string - REQUIRED
+        @type   bulk: boolean
+        @param  bulk: Write batched events with one executemany per
+                table instead of through the session.
+        @type   stats_file: string
+        @param  stats_file: File the loader stats are written to as
+                JSON in perf mode.
         """
         super(WorkflowLoader, self).__init__(connString, batch=batch, props=props, db_type=db_type, backup=backup,
-                                             flush_every=1000)
+                                             flush_every=1000, adaptive_flush=True, stats_file=stats_file)
 
         # "Case" dict to map events to handler methods
         self.eventMap = {
@@ -80,11 +241,8 @@ class WorkflowLoader(BaseLoader):
         # Dicts for caching FK lookups
         self.wf_id_cache = {}
         self.root_wf_id_cache = {}
-        self.task_id_cache = {} #for task metadata population
-        self.lfn_id_cache  = {} #for file metadata population
-        self.job_id_cache = {}
-        self.job_instance_id_cache = {}
-        self.host_cache = {}
+        self.wf_caches = OrderedDict() # wf_id --> WorkflowCache, least recently used first
+        self.warmed_wf_ids = set() # wf_ids whose caches were warmed up, or need not be
         self.hosts_written_cache = None
 
         # undocumented performance option
@@ -94,17 +252,22 @@ class WorkflowLoader(BaseLoader):
             self._start_time = time.time()
 
         # caches for batched events
+        self._bulk = bulk
         self._batch_cache = {
             'batch_events' : [],
             'update_events' : [],
-            'host_map_events' : []
+            'host_map_events' : [],
+            'lfn_events' : []
         }
         self._task_map_flush = {}
         self._task_edge_flush = {}
 
+        # event name --> BP key --> (attribute, conversion), see linedataToObject()
+        self._converters = {}
+
     def process(self, linedata):
         """
-        @type   linedata: dict
+        @type   linedata: dict or EventRecord
         @param  linedata: One line of BP data dict-ified.
 
         Get the BP dict from the controlling process and dispatch
@@ -112,6 +275,7 @@ class WorkflowLoader(BaseLoader):
         """
         self.log.trace("Process: %s", linedata)
 
+        start = time.time()
         for retry in range( 1, self.MAX_RETRIES + 1):
             if not self._batch:
                 self.check_connection()
@@ -150,7 +314,12 @@ class WorkflowLoader(BaseLoader):
             self.log.error( 'Maximum number of retries reached for stampede_loader.process() method %s' %retry)
             raise RuntimeError( 'Maximum number of retries reached for stampede_loader.process() method %s' %retry)
 
-        self.check_flush(increment=True)
+        duration = time.time() - start
+        self.stats.count('events')
+        self.stats.observe('process', duration)
+        self.stats.observe('process.' + linedata['event'], duration)
+
+        self.check_flush(increment=True, size=self.event_size(linedata))
 
     def linedataToObject(self, linedata, o):
         """
@@ -161,67 +330,43 @@ class WorkflowLoader(BaseLoader):
 
         Takes the dict of BP linedata, assigns contents to the class o
         as attributes, and does any global type massaging like
-        transforming dict strings to numeric types.
-        """
-        for k,v in linedata.items():
-            if k == 'level':
+        transforming dict strings to numeric types. How each key is
+        handled is worked out the first time it is seen in an event
+        of a given type, see _compile_key(). EventRecord values are
+        already keyed by attribute, and only need to be converted.
+        """
+        if isinstance(linedata, EventRecord):
+            o.event = linedata.event
+            for attr, v in linedata.attrs.iteritems():
+                convert = ATTR_TYPES.get(attr)
+                if convert is not None and v is not None:
+                    v = convert(v)
+                try:
+                    setattr(o, attr, v)
+                except:
+                    self.log.error('Unable to process attribute %s with values: %s', attr, v)
+            return o
+
+        converter = self._converters.get(linedata.get('event'))
+        if converter is None:
+            converter = self._converters[linedata.get('event')] = {}
+
+        for k, v in linedata.iteritems():
+            spec = converter.get(k)
+            if spec is None:
+                spec = converter[k] = _compile_key(k)
+            attr, convert = spec
+            if attr is None:
                 continue
 
-            # undot
-            attr = k.replace('.', '_')
-
-            attr_remap = {
-                # workflow
-                'xwf_id': 'wf_uuid',
-                'parent_xwf_id': 'parent_wf_id',
-                # task.info
-                'task_id': 'abs_task_id',
-                # task.edge
-                'child_task_id': 'child_abs_task_id',
-                'parent_task_id': 'parent_abs_task_id',
-                # job.info
-                'job_id': 'exec_job_id',
-                # job.edge
-                'child_job_id': 'child_exec_job_id',
-                'parent_job_id': 'parent_exec_job_id',
-                # xwf.start/end (none)
-                # job_inst.submit.start/job_inst.submit.start/etc
-                'job_inst_id': 'job_submit_seq',
-                'js_id': 'jobstate_submit_seq',
-                'cluster_dur': 'cluster_duration',
-                'local_dur': 'local_duration',
-                # inv.end
-                'inv_id': 'task_submit_seq',
-                'dur': 'remote_duration',
-            }
-
-            # remap attr names
-            if attr_remap.has_key(attr):
-                attr = attr_remap[attr]
-
-            # sanitize argv input
-            if attr == 'argv':
-                if v != None:
-                    v = v.replace("\\", "\\\\" )
-                    v = v.replace("'", "\\'")
+            if convert is not None and v is not None:
+                v = convert(v)
 
             try:
                 setattr(o, attr, v)
             except:
                 self.log.error('Unable to process attribute %s with values: %s', k, v)
 
-        # global type re-assignments
-        if hasattr(o, 'ts'):
-            # make all timestamp values floats
-            o.ts = float(o.ts)
-        if hasattr(o, 'start_time') and o.start_time != None:
-            o.start_time = float(o.start_time)
-        if hasattr(o, 'cluster_start_time') and o.cluster_start_time != None:
-            o.cluster_start_time = float(o.cluster_start_time)
-        if hasattr(o, 'duration') and o.duration != None:
-            o.duration = float(o.duration)
-        if hasattr(o, 'restart_count') and o.restart_count != None:
-            o.restart_count = int(o.restart_count)
         return o
 
     #############################################
@@ -237,9 +382,10 @@ class WorkflowLoader(BaseLoader):
         Process queued inserts and flush/commit to the database.
         If the commit fails due to an integrity error, then method
         re-calls itself with setting batch_flush to False which
-        causes each insert/object to be committed individually
-        so all the "good" inserts can succeed.  This will increase
-        the processing time of the batch with the bad data in it.
+        causes the batch to be committed in halves, bisecting the
+        halves that fail until the bad inserts are isolated, so all
+        the "good" inserts can succeed.  This will increase the
+        processing time of the batch with the bad data in it.
         """
         if not self._batch:
             return
@@ -254,10 +400,12 @@ class WorkflowLoader(BaseLoader):
         retry = retry + 1
         self.check_connection()
 
-        if self._perf:
-            s = time.time()
+        s = time.time()
 
         end_event = []
+        state_events = []
+
+        self.resolve_lfn_ids(self._batch_cache['lfn_events'])
 
         self.log.debug('Batch event sizes: batch_event_size=%s update_event_size=%s',
                 len(self._batch_cache['batch_events']),
@@ -266,32 +414,44 @@ class WorkflowLoader(BaseLoader):
         for event in self._batch_cache['batch_events']:
             if event.event == 'stampede.xwf.end':
                 end_event.append(event)
-            if batch_flush:
-                self.session.add(event)
-            else:
-                self.individual_commit(event)
+            if event.event in ('stampede.xwf.start', 'stampede.xwf.end'):
+                state_events.append(event)
 
-        for event in self._batch_cache['update_events']:
-            if batch_flush:
-                self.session.merge(event)
-            else:
-                self.individual_commit(event, merge=True)
+        if retry == 1:
+            # Count rows once, not again when retrying
+            for event in self._batch_cache['batch_events']:
+                self.stats.count('rows.' + _mapped_table(event).name)
+            for event in self._batch_cache['update_events']:
+                self.stats.count('updates.' + _mapped_table(event).name)
+
+        events = [(event, False) for event in self._batch_cache['batch_events']]
+        events.extend([(event, True) for event in self._batch_cache['update_events']])
 
         try:
-            self.session.commit()
+            if batch_flush:
+                t = time.time()
+                self.write_events(events)
+                self.stats.observe('write', time.time() - t)
+                t = time.time()
+                self.session.commit()
+                self.stats.observe('commit', time.time() - t)
+            else:
+                self.bisect_commit(events)
         except exc.IntegrityError, e:
             self.log.exception(e)
-            self.log.error('Integrity error on batch flush: batch will need to be committed per-event which will take longer')
+            self.log.error('Integrity error on batch flush: batch will need to be committed in parts which will take longer')
             self.session.rollback()
+            # The retry does the rest of the flush
             self.hard_flush(batch_flush=False, retry=retry)
+            return
         except exc.OperationalError, e:
             self.log.exception(e)
             self.log.error('Connection problem during commit in hard_flush(): reattempting batch. Retry %s' %retry)
             self.session.rollback()
             self.hard_flush(retry=retry)
+            return
 
-        for host in self._batch_cache['host_map_events']:
-            self.map_host_to_job_instance(host)
+        self.map_hosts_to_job_instances(self._batch_cache['host_map_events'])
 
         for ee in end_event:
             self.purgeCaches(ee)
@@ -313,11 +473,101 @@ class WorkflowLoader(BaseLoader):
             self.log.error('Connection problem on host_map_events during commit in hard_flush()')
             self.session.rollback()
 
+        self.update_summaries(state_events)
+
         self.reset_flush_state()
         self.log.debug('Hard flush end')
 
+        self.stats.count('flushes')
+        self.stats.observe('flush', time.time() - s)
         if self._perf:
             self.log.debug('Hard flush duration: %s', (time.time() - s))
+        self.report_stats()
+
+    def write_events(self, events):
+        """
+        @type   events: list
+        @param  events: (event, merge) tuples.
+
+        Writes the events with bulk_insert and bulk_update in bulk
+        mode, or adds them to the session otherwise.
+        """
+        if not self._bulk:
+            super(WorkflowLoader, self).write_events(events)
+            return
+
+        self.bulk_insert([event for event, merge in events if not merge])
+        self.bulk_update([event for event, merge in events if merge])
+
+    def bulk_insert(self, events):
+        """
+        @type   events: list
+        @param  events: Mapper objects to insert.
+
+        Inserts the events with SQLAlchemy Core, issuing one
+        executemany per table, in foreign key order. Rows of a table
+        are inserted in the order of the events, so autoincrement ids
+        are assigned as with the session. The objects themselves are
+        not added to the session, and their ids are not set.
+        """
+        tables = {}
+        for event in events:
+            table = _mapped_table(event)
+            if not tables.has_key(table):
+                tables[table] = []
+            tables[table].append(_insert_values(event, table))
+
+        for table in sorted(tables.keys(), key=_table_order.get):
+            # executemany needs the same columns in every row, split
+            # the rows where that is not the case
+            rows = tables[table]
+            start = 0
+            for i in range(1, len(rows) + 1):
+                if i == len(rows) or len(rows[i]) != len(rows[start]) or rows[i].keys() != rows[start].keys():
+                    self.log.trace('Bulk insert: table=%s rows=%s', table.name, i - start)
+                    self.session.execute(table.insert(), rows[start:i])
+                    start = i
+
+    def bulk_update(self, events):
+        """
+        @type   events: list
+        @param  events: Mapper objects with their primary key set.
+
+        Updates the rows of the events with SQLAlchemy Core, issuing
+        one executemany per table and set of columns, instead of a
+        session merge that selects each row first. Objects without a
+        full primary key are merged as before.
+        """
+        groups = {}
+        for event in events:
+            table = _mapped_table(event)
+            state = event.__dict__
+            values = {}
+            for column in table.columns:
+                if state.has_key(column.key) and not column.primary_key:
+                    values[column.key] = state[column.key]
+            key = (_table_order[table], table, tuple(sorted(values.keys())))
+
+            for column in table.primary_key.columns:
+                if state.get(column.key) is None:
+                    key = None
+                    break
+                values['pk_' + column.key] = state[column.key]
+
+            if key is None or len(key[2]) == 0:
+                self.session.merge(event)
+                continue
+            if not groups.has_key(key):
+                groups[key] = []
+            groups[key].append(values)
+
+        for key in sorted(groups.keys()):
+            table = key[1]
+            where = and_(*[column == bindparam('pk_' + column.key) for column in table.primary_key.columns])
+            self.log.trace('Bulk update: table=%s rows=%s', table.name, len(groups[key]))
+            result = self.session.execute(table.update().where(where), groups[key])
+            if result.rowcount >= 0 and result.rowcount != len(groups[key]):
+                self.log.warning('Bulk update of %s matched %s of %s rows', table.name, result.rowcount, len(groups[key]))
 
     #############################################
     # Methods to handle the various insert events
@@ -352,6 +602,9 @@ class WorkflowLoader(BaseLoader):
         if wf.root_wf_id == None:
             self.log.warn('Count not determine root_wf_id for event %s', wf)
 
+        # A workflow we just inserted has nothing in the database yet
+        self.warmed_wf_ids.add(wf.wf_id)
+
     def workflowstate(self, linedata):
         """
         @type   linedata: dict
@@ -375,6 +628,7 @@ class WorkflowLoader(BaseLoader):
             self._batch_cache['batch_events'].append(wfs)
         else:
             wfs.commit_to_db(self.session)
+            self.update_summaries([wfs])
             if wfs.event == 'stampede.xwf.end':
                 self.purgeCaches(wfs)
 
@@ -676,13 +930,14 @@ class WorkflowLoader(BaseLoader):
         lfn = rc_pfn.lfn_id
         rc_pfn.lfn = lfn
         rc_pfn.wf_id = self.wf_uuid_to_id( rc_pfn.wf_uuid )
-        rc_pfn.lfn_id = self.get_lfn_id( rc_pfn.wf_id, lfn )
-
-        self.log.trace('rc_pfn: %s', rc_pfn)
 
         if self._batch:
+            self.queue_lfn_event(rc_pfn)
+            self.log.trace('rc_pfn: %s', rc_pfn)
             self._batch_cache['batch_events'].append(rc_pfn)
         else:
+            rc_pfn.lfn_id = self.get_lfn_id( rc_pfn.wf_id, lfn )
+            self.log.trace('rc_pfn: %s', rc_pfn)
             rc_pfn.commit_to_db(self.session)
 
     def wf_task_file_map(self , linedata ):
@@ -699,13 +954,14 @@ class WorkflowLoader(BaseLoader):
         wf_files.lfn = lfn
         wf_files.wf_id   = self.wf_uuid_to_id( wf_files.wf_uuid )
         wf_files.task_id = self.get_task_id( wf_files.wf_id, wf_files.abs_task_id )
-        wf_files.lfn_id  = self.get_lfn_id( wf_files.wf_id, lfn )
-
-        self.log.trace('wf_files: %s', wf_files)
 
         if self._batch:
+            self.queue_lfn_event(wf_files)
+            self.log.trace('wf_files: %s', wf_files)
             self._batch_cache['batch_events'].append(wf_files)
         else:
+            wf_files.lfn_id  = self.get_lfn_id( wf_files.wf_id, lfn )
+            self.log.trace('wf_files: %s', wf_files)
             wf_files.commit_to_db(self.session)
 
     def subwf_map(self, linedata):
@@ -816,7 +1072,9 @@ class WorkflowLoader(BaseLoader):
         not in cache, retrieve from st_workflow table in DB and cache.
         Cuts down on DB queries during insert processing.
         """
-        if not self.wf_id_cache.has_key(wf_uuid):
+        hit = self.wf_id_cache.has_key(wf_uuid)
+        self.stats.cache('wf_id', hit)
+        if not hit:
             query = self.session.query(Workflow).filter(Workflow.wf_uuid == wf_uuid)
             try:
                 self.wf_id_cache[wf_uuid] = query.one().wf_id
@@ -829,6 +1087,65 @@ class WorkflowLoader(BaseLoader):
 
         return self.wf_id_cache[wf_uuid]
 
+    def wf_cache(self, wf_id):
+        """
+        @type   wf_id: int
+        @param  wf_id: A workflow id from the workflow table.
+
+        Returns the WorkflowCache of a workflow, creating it on first
+        use. Caches of workflows that were not inserted by this loader
+        are warmed up from the database once, as after a restart. Only the
+        MAX_CACHED_WORKFLOWS most recently used workflows keep their
+        caches, so memory stays bounded in hierarchical workflows.
+        """
+        cache = self.wf_caches.pop(wf_id, None)
+        if cache is None:
+            if len(self.wf_caches) >= self.MAX_CACHED_WORKFLOWS:
+                evicted_wf_id, evicted = self.wf_caches.popitem(last=False)
+                self.log.debug('Dropping lookup caches for wf_id %s', evicted_wf_id)
+            cache = WorkflowCache()
+            if not wf_id in self.warmed_wf_ids:
+                self.warm_caches(wf_id, cache)
+                # After an eviction, the cache is filled again on misses
+                self.warmed_wf_ids.add(wf_id)
+        # Most recently used workflows go last
+        self.wf_caches[wf_id] = cache
+        return cache
+
+    def warm_caches(self, wf_id, cache):
+        """
+        @type   wf_id: int
+        @param  wf_id: A workflow id from the workflow table.
+        @type   cache: WorkflowCache
+        @param  cache: The caches of the workflow.
+
+        Loads the job, job instance, task and file id mappings already
+        in the database for a workflow into its caches, with one query
+        per table. After a monitord restart, this replaces a query per
+        job, job instance, task and file on cache misses.
+        """
+        if wf_id is None:
+            return
+
+        for job_id, exec_job_id in self.session.query(Job.job_id, Job.exec_job_id).filter(Job.wf_id == wf_id):
+            cache.job_id[exec_job_id] = job_id
+
+        if len(cache.job_id) > 0:
+            query = self.session.query(JobInstance.job_instance_id, JobInstance.job_id, JobInstance.job_submit_seq)
+            query = query.filter(JobInstance.job_id == Job.job_id).filter(Job.wf_id == wf_id)
+            for job_instance_id, job_id, job_submit_seq in query:
+                cache.job_instance_id[(job_id, job_submit_seq)] = job_instance_id
+
+        for task_id, abs_task_id in self.session.query(Task.task_id, Task.abs_task_id).filter(Task.wf_id == wf_id):
+            cache.task_id[abs_task_id] = task_id
+
+        query = self.session.query(RCLFN.lfn_id, RCLFN.lfn).filter(WorkflowFiles.lfn_id == RCLFN.lfn_id)
+        query = query.filter(WorkflowFiles.wf_id == wf_id).distinct()
+        for lfn_id, lfn in query:
+            cache.lfn_id[lfn] = lfn_id
+
+        self.log.debug('Warmed caches for wf_id %s: jobs=%s', wf_id, len(cache.job_id))
+
     def wf_uuid_to_root_id(self, wf_uuid):
         """
         @type   wf_uuid: string
@@ -861,10 +1178,13 @@ class WorkflowLoader(BaseLoader):
 
         Gets and caches task_id for task_meta inserts
         """
-        if not self.task_id_cache.has_key((wf_id, task_dax_id)):
+        task_id_cache = self.wf_cache(wf_id).task_id
+        hit = task_id_cache.has_key(task_dax_id)
+        self.stats.cache('task_id', hit)
+        if not hit:
             query = self.session.query(Task.task_id).filter(Task.wf_id == wf_id).filter(Task.abs_task_id == task_dax_id)
             try:
-                self.task_id_cache[((wf_id, task_dax_id))] = query.one().task_id
+                task_id_cache[task_dax_id] = query.one().task_id
             except orm.exc.MultipleResultsFound, e:
                 self.log.error('Multiple results found for wf_uuid/task_dax_id: %s/%s', wf_id, task_dax_id)
                 return None
@@ -872,7 +1192,7 @@ class WorkflowLoader(BaseLoader):
                 self.log.error('No results found for wf_uuid/task_dax_id: %s/%s', wf_id, task_dax_id)
                 return None
 
-        return self.task_id_cache[(wf_id, task_dax_id)]
+        return task_id_cache[task_dax_id]
 
     def get_lfn_id(self, wf_id, lfn):
         """
@@ -883,7 +1203,10 @@ class WorkflowLoader(BaseLoader):
 
         Gets and caches lfn_id for rc_meta, rc_lfn, rc_pfn and wf_files inserts
         """
-        if not self.lfn_id_cache.has_key((wf_id, lfn)):
+        lfn_id_cache = self.wf_cache(wf_id).lfn_id
+        hit = lfn_id_cache.has_key(lfn)
+        self.stats.cache('lfn_id', hit)
+        if not hit:
             id =  self.__get_lfn_id_from_database__(wf_id, lfn )
 
             if id is None:
@@ -900,9 +1223,85 @@ class WorkflowLoader(BaseLoader):
                     self.log.error('No results found for wf_uuid/lfn: %s/%s', wf_id, lfn)
                     return None
 
-            self.lfn_id_cache[(wf_id, lfn)] = id
+            lfn_id_cache[lfn] = id
+
+        return lfn_id_cache[lfn]
+
+    def queue_lfn_event(self, o):
+        """
+        @type   o: class instance
+        @param  o: Batched event object with wf_id and lfn attributes
+
+        Sets the lfn_id of the event from the cache. If the lfn is not
+        cached, the event is queued, and its lfn_id is set by
+        resolve_lfn_ids() when the batch is flushed.
+        """
+        o.lfn_id = self.wf_cache(o.wf_id).lfn_id.get(o.lfn)
+        self.stats.cache('lfn_id', o.lfn_id is not None)
+        if o.lfn_id is None:
+            self._batch_cache['lfn_events'].append(o)
+
+    def resolve_lfn_ids(self, events):
+        """
+        @type   events: list
+        @param  events: Event objects queued by queue_lfn_event()
+
+        Sets the lfn_id of the queued events. The lfns already in the
+        rc_lfn table are looked up with IN queries, and the missing
+        ones are inserted with a single executemany, instead of a
+        query, an insert and a second query per lfn.
+        """
+        lfns = OrderedDict()
+        for o in events:
+            if o.lfn_id is None:
+                lfns[o.lfn] = None
+        if len(lfns) == 0:
+            return
+
+        lfn_ids = self.__get_lfn_ids_from_database__(lfns.keys())
+        missing = [lfn for lfn in lfns if not lfn_ids.has_key(lfn)]
+
+        if len(missing) > 0:
+            self.stats.count('rows.rc_lfn', len(missing))
+            # explicit insert to populate the RCLFN table
+            try:
+                self.session.execute(rc_lfn.insert(), [{'lfn': lfn} for lfn in missing])
+                self.session.commit()
+            except exc.IntegrityError, e:
+                # Someone else inserted some of them, do it one by one
+                self.log.warning('Integrity error on rc_lfn bulk insert: %s', e)
+                self.session.rollback()
+                for lfn in missing:
+                    if self.__get_lfn_id_from_database__(None, lfn) is None:
+                        file = RCLFN()
+                        file.lfn = lfn
+                        file.commit_to_db(self.session)
+            lfn_ids.update(self.__get_lfn_ids_from_database__(missing))
+
+        for o in events:
+            if o.lfn_id is not None:
+                continue
+            if not lfn_ids.has_key(o.lfn):
+                self.log.error('No results found for wf_uuid/lfn: %s/%s', o.wf_id, o.lfn)
+                continue
+            o.lfn_id = lfn_ids[o.lfn]
+            self.wf_cache(o.wf_id).lfn_id[o.lfn] = o.lfn_id
+
+    def __get_lfn_ids_from_database__(self, lfns):
+        """
+        @type   lfns: list
+        @param  lfns: Logical filenames
+
+        Retrieves the LFNs explicitly by querying the database, and
+        returns a dictionary lfn --> lfn_id of the ones found.
+        """
+        lfn_ids = {}
+        for i in range(0, len(lfns), self.MAX_LFN_QUERY_SIZE):
+            query = self.session.query(RCLFN.lfn_id, RCLFN.lfn).filter(RCLFN.lfn.in_(lfns[i:i + self.MAX_LFN_QUERY_SIZE]))
+            for lfn_id, lfn in query:
+                lfn_ids[lfn] = lfn_id
 
-        return self.lfn_id_cache[(wf_id, lfn)]
+        return lfn_ids
 
     def __get_lfn_id_from_database__(self, wf_id, lfn):
         """
@@ -937,10 +1336,13 @@ class WorkflowLoader(BaseLoader):
         Gets and caches job_id for job_instance inserts and static
         table updating.
         """
-        if not self.job_id_cache.has_key((wf_id, exec_id)):
+        job_id_cache = self.wf_cache(wf_id).job_id
+        hit = job_id_cache.has_key(exec_id)
+        self.stats.cache('job_id', hit)
+        if not hit:
             query = self.session.query(Job.job_id).filter(Job.wf_id == wf_id).filter(Job.exec_job_id == exec_id)
             try:
-                self.job_id_cache[((wf_id, exec_id))] = query.one().job_id
+                job_id_cache[exec_id] = query.one().job_id
             except orm.exc.MultipleResultsFound, e:
                 self.log.error('Multiple results found for wf_uuid/exec_job_id: %s/%s', wf_id, exec_id)
                 return None
@@ -948,7 +1350,7 @@ class WorkflowLoader(BaseLoader):
                 self.log.error('No results found for wf_uuid/exec_job_id: %s/%s', wf_id, exec_id)
                 return None
 
-        return self.job_id_cache[((wf_id, exec_id))]
+        return job_id_cache[exec_id]
 
 
     def get_job_instance_id(self, o, quiet=False):
@@ -962,10 +1364,13 @@ class WorkflowLoader(BaseLoader):
         wf_id = self.wf_uuid_to_id(o.wf_uuid)
         cached_job_id = self.get_job_id(wf_id, o.exec_job_id)
         uniqueIdIdx = (cached_job_id, o.job_submit_seq)
-        if not self.job_instance_id_cache.has_key(uniqueIdIdx):
+        job_instance_id_cache = self.wf_cache(wf_id).job_instance_id
+        hit = job_instance_id_cache.has_key(uniqueIdIdx)
+        self.stats.cache('job_instance_id', hit)
+        if not hit:
             query = self.session.query(JobInstance).filter(JobInstance.job_id == cached_job_id).filter(JobInstance.job_submit_seq == o.job_submit_seq)
             try:
-                self.job_instance_id_cache[uniqueIdIdx] = query.one().job_instance_id
+                job_instance_id_cache[uniqueIdIdx] = query.one().job_instance_id
             except orm.exc.MultipleResultsFound, e:
                 if not quiet:
                     self.log.error('Multple job_instance_id results for tuple %s : %s', uniqueIdIdx, e)
@@ -975,7 +1380,7 @@ class WorkflowLoader(BaseLoader):
                     self.log.error('No job_instance_id results for tuple %s : %s', uniqueIdIdx, e)
                 return None
 
-        return self.job_instance_id_cache[uniqueIdIdx]
+        return job_instance_id_cache[uniqueIdIdx]
 
     def map_host_to_job_instance(self, host):
         """
@@ -986,21 +1391,99 @@ class WorkflowLoader(BaseLoader):
         checks the cache to see if a job had already had its host_id,
         and if not, do the proper update and note it in the cache.
         """
-        self.log.trace('map_host_to_job_instance: %s', host)
+        self.map_hosts_to_job_instances([host])
 
-        wf_id = self.wf_uuid_to_id(host.wf_uuid)
-        cached_job_id = self.get_job_id(wf_id, host.exec_job_id)
+    def map_hosts_to_job_instances(self, hosts):
+        """
+        @type   hosts: list
+        @param  hosts: Host objects with info from host events in the log
 
-        if not self.host_cache.has_key((cached_job_id, host.job_submit_seq)):
-            if not host.host_id:
-                try:
-                    host.host_id = self.session.query(Host.host_id).filter(Host.wf_id == host.wf_id).filter(Host.site == host.site).filter(Host.hostname == host.hostname).filter(Host.ip == host.ip).one().host_id
-                except orm.exc.MultipleResultsFound, e:
-                    self.log.error('Multiple host_id results for host: %s', host)
-            job_instance = self.session.query(JobInstance).filter(JobInstance.job_id == cached_job_id).filter(JobInstance.job_submit_seq == host.job_submit_seq).one()
-            job_instance.host_id = host.host_id
-            job_instance.merge_to_db(self.session, batch=self._batch)
-            self.host_cache[(cached_job_id, host.job_submit_seq)] = True
+        Sets the host_id of the job instances of the host events that
+        are not in the cache yet. The host_ids are looked up with one
+        query per (root) workflow, and all job instances are updated
+        with a single executemany, instead of two selects and a merge
+        per host event.
+        """
+        pending = []
+        host_ids = {}
+        queried_wf_ids = set()          # wf_ids whose hosts were all read into host_ids
+        for host in hosts:
+            self.log.trace('map_host_to_job_instance: %s', host)
+
+            wf_id = self.wf_uuid_to_id(host.wf_uuid)
+            cached_job_id = self.get_job_id(wf_id, host.exec_job_id)
+            key = (cached_job_id, host.job_submit_seq)
+            hit = self.wf_cache(wf_id).host.has_key(key)
+            self.stats.cache('host', hit)
+            if hit:
+                continue
+
+            if host.host_id:
+                host_ids[(host.wf_id, host.site, host.hostname, host.ip)] = host.host_id
+            elif not host.wf_id in queried_wf_ids:
+                # Get all hosts of the workflow at once
+                queried_wf_ids.add(host.wf_id)
+                query = self.session.query(Host.host_id, Host.site, Host.hostname, Host.ip).filter(Host.wf_id == host.wf_id)
+                for host_id, site, hostname, ip in query:
+                    host_ids[(host.wf_id, site, hostname, ip)] = host_id
+            pending.append((wf_id, key, host))
+
+        rows = []
+        for wf_id, key, host in pending:
+            host_id = host_ids.get((host.wf_id, host.site, host.hostname, host.ip))
+            if host_id is None:
+                # Not cached, so a later host event can still map it
+                self.log.error('No host_id results for host: %s', host)
+                continue
+            self.wf_cache(wf_id).host[key] = True
+            rows.append({'b_job_id': key[0],
+                         'b_job_submit_seq': host.job_submit_seq,
+                         'b_host_id': host_id})
+
+        if len(rows) == 0:
+            return
+
+        update = st_job_instance.update().where(and_(st_job_instance.c.job_id == bindparam('b_job_id'),
+                                                     st_job_instance.c.job_submit_seq == bindparam('b_job_submit_seq')))
+        update = update.values(host_id=bindparam('b_host_id'))
+        self.session.execute(update, rows)
+        self.stats.count('updates.job_instance', len(rows))
+        if not self._batch:
+            self.session.commit()
+
+    def update_summaries(self, states):
+        """
+        @type   states: list
+        @param  states: Workflowstate objects, in the order they were loaded.
+
+        Summarizes the workflows that ended, and deletes the summary
+        of those that started again, so statistics of a running
+        workflow are computed from its jobs. Summaries are only
+        derived data: if they cannot be updated, the error is logged
+        and loading goes on. 'pegasus-db-admin rebuild' fixes them.
+        """
+        last = OrderedDict()
+        for wfs in states:
+            if wfs.wf_id is not None:
+                last[wfs.wf_id] = wfs.event
+
+        if len(last) == 0:
+            return
+
+        s = time.time()
+        try:
+            for wf_id, event in last.items():
+                if event == 'stampede.xwf.end':
+                    summary.summarize_workflow(self.session, wf_id)
+                    self.stats.count('summaries')
+                else:
+                    summary.delete_workflow_summary(self.session, wf_id)
+            self.session.commit()
+        except exc.SQLAlchemyError, e:
+            self.log.exception(e)
+            self.log.error('Unable to update the summary of workflows %s', last.keys())
+            self.session.rollback()
+        self.stats.observe('summary', time.time() - s)
 
     def purgeCaches(self, wfs):
         """
@@ -1012,33 +1495,14 @@ class WorkflowLoader(BaseLoader):
         """
         self.log.debug('Purging caches for: %s', wfs.wf_uuid)
 
-        for k,v in self.wf_id_cache.items():
-            if k == wfs.wf_uuid:
-                del self.wf_id_cache[k]
-
-        for k,v in self.root_wf_id_cache.items():
-            if k == wfs.wf_uuid:
-                del self.root_wf_id_cache[k]
-
-        for k,v in self.job_instance_id_cache.items():
-            if k[0] == wfs.wf_id:
-                del self.job_instance_id_cache[k]
-
-        for k,v in self.host_cache.items():
-            if k[0] == wfs.wf_uuid:
-                del self.host_cache[k]
-
-        for k,v in self.task_id_cache.items():
-            if k[0] == wfs.wf_id:
-                del self.task_id_cache[k]
+        if self.wf_id_cache.has_key(wfs.wf_uuid):
+            del self.wf_id_cache[wfs.wf_uuid]
 
-        for k,v in self.lfn_id_cache.items():
-            if k[0] == wfs.wf_id:
-                del self.lfn_id_cache[k]
+        if self.root_wf_id_cache.has_key(wfs.wf_uuid):
+            del self.root_wf_id_cache[wfs.wf_uuid]
 
-        for k,v in self.job_id_cache.items():
-            if k[0] == wfs.wf_id:
-                del self.job_id_cache[k]
+        if self.wf_caches.has_key(wfs.wf_id):
+            del self.wf_caches[wfs.wf_id]
 
         if self._task_map_flush.has_key(wfs.wf_uuid):
             del self._task_map_flush[wfs.wf_uuid]
@@ -1053,6 +1517,9 @@ class WorkflowLoader(BaseLoader):
             self.log.info('Executing final flush')
             self.hard_flush()
         self.disconnect()
+        if self._integrity_error_batches > 0:
+            self.log.info('Loader integrity error recovery: batches=%s commits=%s rejected_events=%s',
+                          self._integrity_error_batches, self._bisect_commits, self._rejected_events)
         if self._perf:
             run_time = time.time() - self._start_time
             self.log.info("Loader performance: insert_time=%s, insert_num=%s, "
@@ -1060,4 +1527,5 @@ class WorkflowLoader(BaseLoader):
                           self._insert_time, self._insert_num, run_time,
                           run_time - self._insert_time,
                           self._insert_time / self._insert_num)
+        self.report_stats(force=True)
 
@@ -0,0 +1,116 @@
+"""
+This file implements the classification of dagman.out log lines for
+pegasus-monitord.
+"""
+
+##
+#  Copyright 2007-2017 University Of Southern California
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#  http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing,
+#  software distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+##
+
+# Import Python modules
+import re
+
+# Compile our regular expressions
+re_parse_dag_name = re.compile(r"Parsing (.+) ...$")
+re_parse_event = re.compile(r"Event:\s+ULOG_(\S+) for (?:HT|)Condor (?:Job|Node) (\S+)\s+\((-?[0-9]+\.[0-9]+)(\.[0-9]+)?\).*")
+re_parse_script_running = re.compile(r"\d{2}\sRunning (PRE|POST) script of (?:Job|Node) (.+)\.{3}")
+re_parse_script_done = re.compile(r"\d{2}\s(PRE|POST) Script of (?:Job|[nN]ode) (\S+)")
+re_parse_script_successful = re.compile(r"completed successfully\.$")
+re_parse_script_failed = re.compile(r"failed with status\s+(-?\d+)\.?$")
+re_parse_job_submit = re.compile(r"Submitting (?:HT|)Condor Node (.+) job")
+re_parse_job_submit_error = re.compile(r"ERROR: submit attempt failed")
+re_parse_job_failed = re.compile(r"\d{2}\sNode (\S+) job proc \(([0-9\.]+)\) failed with (status|signal)\s+(-?\d+)\.$")
+re_parse_job_successful = re.compile(r"\d{2}\sNode (\S+) job proc \(([0-9\.]+)\) completed successfully\.$")
+re_parse_retry = re.compile(r"Retrying node (\S+) \(retry \#(\d+) of (\d+)\)")
+re_parse_dagman_condor_id = re.compile(r"\*\* condor_scheduniv_exec\.([0-9\.]+) \(CONDOR_DAGMAN\) STARTING UP")
+re_parse_dagman_finished = re.compile(r"\(condor_DAGMAN\)[\w\s]+EXITING WITH STATUS (\d+)$")
+re_parse_dagman_pid = re.compile(r"\*\* PID = (\d+)$")
+re_parse_condor_version = re.compile(r"\*\* \$CondorVersion: ((\d+)\.(\d+)\.(\d+))")
+re_parse_condor_logfile = re.compile(r"Condor log will be written to ([^,]+)")
+re_parse_condor_logfile_insane = re.compile(r"\d{2}\s{3,}(\S+)")
+re_parse_multiline_files = re.compile(r"All DAG node user log files:")
+re_parse_recovery_start = re.compile(r"Running in RECOVERY mode\.\.\.")
+re_parse_dagman_aborted  = re.compile(r"Received SIGUSR1")
+re_parse_job_held        = re.compile(r"\s*Hold reason:(.*)")
+
+# Line types, in the order pegasus-monitord has always tried them. Each
+# one has a literal keyword that must be present in the line for its
+# regular expression to match. Keywords are chosen so that no two of
+# them can start at the same position in a line. The insane log file
+# line has no such keyword, and is only tried when following a list of
+# log files.
+LINE_TYPES = [
+    ("event", "ULOG_", re_parse_event),
+    ("job_submit", "Submitting ", re_parse_job_submit),
+    ("job_submit_error", "ERROR: submit", re_parse_job_submit_error),
+    ("script_running", " script of ", re_parse_script_running),
+    ("script_done", " Script of ", re_parse_script_done),
+    ("job_failed", " job proc (", re_parse_job_failed),
+    ("job_successful", " job proc (", re_parse_job_successful),
+    ("dagman_finished", "EXITING WITH STATUS ", re_parse_dagman_finished),
+    ("dagman_condor_id", "STARTING UP", re_parse_dagman_condor_id),
+    ("dagman_pid", "PID = ", re_parse_dagman_pid),
+    ("dag_name", "Parsing ", re_parse_dag_name),
+    ("condor_version", "$CondorVersion: ", re_parse_condor_version),
+    ("condor_logfile", "Condor log will be written to ", re_parse_condor_logfile),
+    ("condor_logfile_insane", None, re_parse_condor_logfile_insane),
+    ("multiline_files", "All DAG node user log files:", re_parse_multiline_files),
+    ("recovery_start", "RECOVERY mode...", re_parse_recovery_start),
+    ("dagman_aborted", "SIGUSR1", re_parse_dagman_aborted),
+    ("job_held", "Hold reason:", re_parse_job_held),
+]
+
+# Keyword --> list of (position in LINE_TYPES, line type, regular expression)
+_keyword_table = {}
+_multiline_candidate = None
+for _index, (_name, _keyword, _regex) in enumerate(LINE_TYPES):
+    if _keyword is None:
+        _multiline_candidate = (_index, _name, _regex)
+    else:
+        _keyword_table.setdefault(_keyword, []).append((_index, _name, _regex))
+
+# Finds all keywords in a line in one pass. The lookahead makes
+# findall report keywords even when they overlap each other.
+_re_keywords = re.compile("(?=(%s))" % ("|".join([re.escape(k) for k in _keyword_table])))
+
+def classify(log_line, multiline_files=False):
+    """
+    This function returns a tuple with the type of a dagman.out log
+    line and the match object of its regular expression, or (None,
+    None) if the line doesn't match any of them. The result is the
+    same as trying every regular expression in LINE_TYPES order, but
+    only those whose keyword appears in the line are tried. The
+    condor_logfile_insane type is only considered when
+    multiline_files is True, that is, after an 'All DAG node user log
+    files:' line.
+    """
+    my_keywords = _re_keywords.findall(log_line)
+
+    if len(my_keywords) == 1 and not multiline_files:
+        my_candidates = _keyword_table[my_keywords[0]]
+    else:
+        my_candidates = []
+        for my_keyword in set(my_keywords):
+            my_candidates.extend(_keyword_table[my_keyword])
+        if multiline_files:
+            my_candidates.append(_multiline_candidate)
+        my_candidates.sort()
+
+    for my_index, my_name, my_regex in my_candidates:
+        my_expr = my_regex.search(log_line)
+        if my_expr is not None:
+            return (my_name, my_expr)
+
+    return (None, None)
@@ -20,13 +20,15 @@ Functions for output pegasus-monitord events to various destinations.
 
 import os
 import sys
+import Queue
 import socket
 import logging
 import urlparse
+import threading
 
 from Pegasus.tools import utils
 from Pegasus.netlogger import nlapi
-from Pegasus.db.workflow_loader import WorkflowLoader
+from Pegasus.db.workflow_loader import WorkflowLoader, event_record
 from Pegasus.db.dashboard_loader import DashboardLoader
 from Pegasus.db import expunge
 
@@ -49,6 +51,14 @@ except:
 STAMPEDE_NS = "stampede."
 DASHBOARD_NS = "dashboard."
 
+# Seconds the database writer thread waits for events before giving
+# the loader a chance to do its time based flush
+WRITER_IDLE_TIMEOUT = 5
+
+# Markers sent to the database writer thread along with the events
+_FLUSH = object()
+_CLOSE = object()
+
 
 def purge_wf_uuid_from_database(rundir, output_db):
     """
@@ -145,35 +155,145 @@ class EventSink(object):
 
 class DBEventSink(EventSink):
     """
-    Write wflow event logs to database via loader
+    Write wflow event logs to database via loader. If queue_size is
+    greater than 0, events are queued and written by a background
+    thread, so database latency does not slow down the caller. Once
+    queue_size events are waiting, send() blocks until the writer
+    catches up. Events the loader fails to process are logged and
+    skipped, as without a queue. If flushing or finishing the loader
+    fails, the writer thread stops, and the error is raised again by
+    the next send(), flush() or close(). With db_stats, the loader
+    stats are logged, and written to stats_file, if given. Events for
+    the stampede loader are sent as EventRecords, so their keys are
+    not turned into BP keys and back.
     """
-    def __init__(self, dest, db_stats=False, namespace=STAMPEDE_NS, props=None, db_type=None, backup=False, **kw):
+    def __init__(self, dest, db_stats=False, namespace=STAMPEDE_NS, props=None, db_type=None, backup=False, queue_size=0,
+                 stats_file=None, **kw):
         self._namespace=namespace
         #pick the right database loader based on prefix
         if namespace == STAMPEDE_NS:
-            self._db = WorkflowLoader(dest, perf=db_stats, batch=True, props=props, db_type=db_type, backup=backup)
+            self._db = WorkflowLoader(dest, perf=db_stats, batch=True, props=props, db_type=db_type, backup=backup,
+                                      stats_file=stats_file)
         elif namespace == DASHBOARD_NS:
-            self._db = DashboardLoader(dest, perf=db_stats, batch=True, props=props, db_type=db_type, backup=backup)
+            self._db = DashboardLoader(dest, perf=db_stats, batch=True, props=props, db_type=db_type, backup=backup,
+                                       stats_file=stats_file)
         else:
             raise ValueError("Unknown namespace specified '%s'" % (namespace))
 
         super(DBEventSink, self).__init__()
 
+        self._queue = None
+        self._writer = None
+        self._queue_waits = 0
+        self._writer_error = None       # exc_info of the loader error that stopped the writer
+        if queue_size > 0:
+            self._queue = Queue.Queue(queue_size)
+            self._writer = threading.Thread(target=self._write_events, name="db-writer-%s" % (namespace.rstrip(".")))
+            self._writer.daemon = True
+            self._writer.start()
+
     def send(self, event, kw):
         self._log.trace("send.start event=%s", event)
-        d = {'event' : self._namespace + event}
-        for k, v in kw.iteritems():
-            d[k.replace('__','.')] = v
-        self._db.process(d)
+        if self._namespace == STAMPEDE_NS:
+            d = event_record(self._namespace + event, kw)
+        else:
+            d = {'event' : self._namespace + event}
+            for k, v in kw.iteritems():
+                d[k.replace('__','.')] = v
+        if self._queue is None:
+            self._db.process(d)
+        else:
+            self._check_writer()
+            self._put(d)
         self._log.trace("send.end event=%s", event)
 
     def close(self):
         self._log.trace("close.start")
-        self._db.finish()
+        if self._queue is None:
+            self._db.finish()
+        else:
+            # The writer thread finishes the loader after writing
+            # all queued events
+            self._check_writer()
+            self._put(_CLOSE)
+            self._writer.join()
+            self._queue = None
+            if self._queue_waits > 0:
+                self._log.info("database writer queue was full %d times" % (self._queue_waits))
+            self._check_writer()
         self._log.trace("close.end")
 
     def flush(self):
-        self._db.flush()
+        if self._queue is None:
+            self._db.flush()
+        else:
+            self._check_writer()
+            self._put(_FLUSH)
+
+    def _check_writer(self):
+        """
+        Raises the loader error that stopped the writer thread, if any.
+        """
+        if self._writer_error is not None:
+            t, v, tb = self._writer_error
+            raise t, v, tb
+
+    def _put(self, item):
+        """
+        Queues item for the writer thread, waiting while the queue is
+        full.
+        """
+        try:
+            self._queue.put_nowait(item)
+            return
+        except Queue.Full:
+            self._queue_waits = self._queue_waits + 1
+            self._log.debug("database writer queue is full, waiting")
+
+        while True:
+            if not self._writer.is_alive():
+                self._check_writer()
+                self._log.error("database writer thread is gone, dropping event")
+                return
+            try:
+                self._queue.put(item, True, WRITER_IDLE_TIMEOUT)
+                return
+            except Queue.Full:
+                pass
+
+    def _write_events(self):
+        """
+        Writer thread, hands the queued events to the loader until
+        close() is called. The loader batches and flushes them as
+        usual. An event that cannot be processed only loses that
+        event, but a flush or finish error is kept for the caller,
+        and no more events are written.
+        """
+        while True:
+            try:
+                item = self._queue.get(True, WRITER_IDLE_TIMEOUT)
+            except Queue.Empty:
+                item = _FLUSH
+
+            if item is not _CLOSE and item is not _FLUSH:
+                try:
+                    self._db.process(item)
+                except Exception:
+                    self._log.exception("error writing event %s to the database, skipping it" % (item["event"]))
+                continue
+
+            try:
+                if item is _CLOSE:
+                    self._db.finish()
+                else:
+                    self._db.flush()
+            except Exception:
+                self._log.exception("error writing events to the database")
+                self._writer_error = sys.exc_info()
+                break
+
+            if item is _CLOSE:
+                break
 
 class FileEventSink(EventSink):
     """
@@ -258,10 +378,11 @@ def bson_encode(event, **kw):
     kw['event'] = STAMPEDE_NS + event
     return bson.dumps(kw)
 
-def create_wf_event_sink(dest, enc=None, prefix=STAMPEDE_NS, props=None, **kw):
+def create_wf_event_sink(dest, enc=None, prefix=STAMPEDE_NS, props=None, queue_size=0, stats_file=None, **kw):
     """
     Create & return subclass of EventSink, chosen by value of 'dest'
-    and parameterized by values (if any) in 'kw'.
+    and parameterized by values (if any) in 'kw'. queue_size and
+    stats_file are only used by database sinks, see DBEventSink.
     """
 
     if dest is None:
@@ -309,7 +430,7 @@ def create_wf_event_sink(dest, enc=None, prefix=STAMPEDE_NS, props=None, **kw):
         _type, _name="AMQP", "%s:%s/%s" % (url.host, url.port, url.path)
     else:
         # load the appropriate DBEvent on basis of prefix passed
-        sink = DBEventSink(dest, namespace=prefix, props=props, **kw)
+        sink = DBEventSink(dest, namespace=prefix, props=props, queue_size=queue_size, stats_file=stats_file, **kw)
         _type, _name = "DB", dest
 
     log.info("output type=%s namespace=%s name=%s" % (_type, prefix, _name))
@@ -0,0 +1,134 @@
+"""
+This file implements the KickstartParserPool class for pegasus-monitord,
+used to parse kickstart output files in worker processes ahead of the
+time pegasus-monitord needs them.
+"""
+
+##
+#  Copyright 2007-2017 University Of Southern California
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#  http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing,
+#  software distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+##
+
+# Import Python modules
+import os
+import signal
+import logging
+import multiprocessing
+
+from Pegasus.tools import kickstart_parser
+
+logger = logging.getLogger(__name__)
+
+def _init_worker():
+    """
+    Workers leave signal handling to pegasus-monitord.
+    """
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+
+def _parse_stampede(filename):
+    """
+    This function runs in a worker process, and returns a tuple with
+    the open error flag and the records parsed from filename.
+    """
+    my_parser = kickstart_parser.Parser(filename)
+    my_output = my_parser.parse_stampede()
+
+    return (my_parser._open_error, my_output)
+
+def _file_signature(filename):
+    """
+    Returns the size and modification time of filename, or None if it
+    cannot be stat'ed.
+    """
+    try:
+        my_stat = os.stat(filename)
+    except OSError:
+        return None
+
+    return (my_stat.st_size, my_stat.st_mtime)
+
+class KickstartParserPool:
+    """
+    Class used to parse kickstart output files in a pool of worker
+    processes. Files are submitted with prefetch() as soon as we know
+    they will be needed, and the results are collected with get(), in
+    the order pegasus-monitord processes jobs, so events are still sent
+    in the same order.
+    """
+    def __init__(self, processes):
+        self._pool = multiprocessing.Pool(processes, _init_worker)
+        self._pending = {}              # filename --> (file signature, AsyncResult)
+        self.hits = 0                   # Number of files parsed by the pool and used
+        self.misses = 0                 # Number of files we had to parse ourselves
+
+    def prefetch(self, filename):
+        """
+        This function starts parsing filename in a worker process, if
+        it is not already being parsed.
+        """
+        if filename in self._pending:
+            return
+
+        my_signature = _file_signature(filename)
+        if my_signature is None:
+            # Nothing to parse, get() will report the error
+            return
+
+        self._pending[filename] = (my_signature,
+                                   self._pool.apply_async(_parse_stampede, (filename,)))
+
+    def get(self, filename):
+        """
+        This function returns a tuple with the open error flag and the
+        records parsed from filename, waiting for the worker if
+        needed. It returns None if filename was not prefetched, or if
+        it changed since then, in which case the caller should parse it
+        itself.
+        """
+        if not filename in self._pending:
+            self.misses = self.misses + 1
+            return None
+
+        my_signature, my_result = self._pending.pop(filename)
+        if my_signature != _file_signature(filename):
+            logger.debug("%s changed after it was prefetched, parsing it again" % (filename))
+            self.misses = self.misses + 1
+            return None
+
+        try:
+            my_output = my_result.get()
+        except Exception, e:
+            logger.warning("error parsing %s in worker process: %s" % (filename, e))
+            self.misses = self.misses + 1
+            return None
+
+        self.hits = self.hits + 1
+        return my_output
+
+    def clear(self):
+        """
+        This function forgets all prefetched files that were not
+        used. Workers still parsing them will finish in the background.
+        """
+        self._pending = {}
+
+    def close(self):
+        """
+        This function stops all worker processes.
+        """
+        self._pending = {}
+        self._pool.terminate()
+        self._pool.join()
+        logger.info("kickstart parser pool used %d prefetched files, parsed %d files in monitord"
+                    % (self.hits, self.misses))
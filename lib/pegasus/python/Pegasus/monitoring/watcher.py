@@ -0,0 +1,192 @@
+"""
+This file implements the FileWatcher class for pegasus-monitord, used
+to wait until a tracked dagman.out file changes instead of polling it.
+"""
+
+##
+#  Copyright 2007-2017 University Of Southern California
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#  http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing,
+#  software distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+##
+
+# Import Python modules
+import os
+import time
+import errno
+import select
+import struct
+import ctypes
+import ctypes.util
+import logging
+
+logger = logging.getLogger(__name__)
+
+# Constants from <sys/inotify.h>
+IN_MODIFY = 0x00000002
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_Q_OVERFLOW = 0x00004000
+IN_NONBLOCK = 0o4000
+IN_CLOEXEC = 0o2000000
+
+# Events that mean a file in a watched directory has new content
+WATCH_MASK = IN_MODIFY | IN_CLOSE_WRITE | IN_MOVED_TO | IN_CREATE
+
+# struct inotify_event { int wd; uint32_t mask, cookie, len; char name[]; }
+EVENT_HEADER = "iIII"
+EVENT_HEADER_SIZE = struct.calcsize(EVENT_HEADER)
+EVENT_READ_SIZE = 65536
+
+class FileWatcher:
+    """
+    Class used to sleep until one of a set of files is created or
+    grows. It watches the directories containing these files with
+    Linux's inotify, so files that do not exist yet can be tracked as
+    well. Creating an instance raises OSError when inotify is not
+    available.
+    """
+    def __init__(self):
+        self._libc = None
+        self._fd = -1
+        self._dirs = {}                 # directory --> watch descriptor
+        self._files = {}                # watch descriptor --> set of basenames
+
+        my_libc_name = ctypes.util.find_library("c")
+        if my_libc_name is None:
+            raise OSError("cannot find the C library")
+        self._libc = ctypes.CDLL(my_libc_name, use_errno=True)
+        if not hasattr(self._libc, "inotify_init1"):
+            raise OSError("inotify is not available on this platform")
+
+        self._fd = self._libc.inotify_init1(IN_NONBLOCK | IN_CLOEXEC)
+        if self._fd < 0:
+            my_errno = ctypes.get_errno()
+            raise OSError(my_errno, "inotify_init1: %s" % (os.strerror(my_errno)))
+
+    def add(self, filename):
+        """
+        This function starts tracking filename. It returns True if
+        changes to the file will be reported, or False if its
+        directory cannot be watched (the caller should poll it then).
+        """
+        my_dir, my_base = os.path.split(os.path.abspath(filename))
+
+        if my_dir not in self._dirs:
+            my_wd = self._libc.inotify_add_watch(self._fd, my_dir, WATCH_MASK)
+            if my_wd < 0:
+                my_errno = ctypes.get_errno()
+                logger.warning("cannot watch directory %s: %s" % (my_dir, os.strerror(my_errno)))
+                return False
+            self._dirs[my_dir] = my_wd
+            self._files[my_wd] = set()
+
+        self._files[self._dirs[my_dir]].add(my_base)
+        return True
+
+    def remove(self, filename):
+        """
+        This function stops tracking filename, and removes the watch
+        on its directory once no other file there is tracked.
+        """
+        my_dir, my_base = os.path.split(os.path.abspath(filename))
+
+        if my_dir not in self._dirs:
+            return
+
+        my_wd = self._dirs[my_dir]
+        self._files[my_wd].discard(my_base)
+        if len(self._files[my_wd]) == 0:
+            self._libc.inotify_rm_watch(self._fd, my_wd)
+            del self._files[my_wd]
+            del self._dirs[my_dir]
+
+    def wait(self, timeout):
+        """
+        This function blocks for at most timeout seconds, returning
+        True as soon as a tracked file changes, or False if timeout
+        expired without changes.
+        """
+        my_deadline = time.time() + timeout
+
+        while True:
+            my_timeout = max(0, my_deadline - time.time())
+            try:
+                my_ready = select.select([self._fd], [], [], my_timeout)[0]
+            except select.error, e:
+                if e.args[0] == errno.EINTR:
+                    # Interrupted by a signal, just try again
+                    continue
+                raise
+
+            if len(my_ready) == 0:
+                # Timeout
+                return False
+
+            if self._read_events():
+                return True
+
+    def _read_events(self):
+        """
+        This function drains all pending inotify events, and returns
+        True if any of them is about a tracked file.
+        """
+        my_changed = False
+
+        while True:
+            try:
+                my_buffer = os.read(self._fd, EVENT_READ_SIZE)
+            except OSError, e:
+                if e.errno in (errno.EAGAIN, errno.EINTR):
+                    break
+                raise
+
+            if len(my_buffer) == 0:
+                break
+
+            my_pos = 0
+            while my_pos + EVENT_HEADER_SIZE <= len(my_buffer):
+                my_wd, my_mask, my_cookie, my_len = struct.unpack_from(EVENT_HEADER, my_buffer, my_pos)
+                my_pos = my_pos + EVENT_HEADER_SIZE
+                my_name = my_buffer[my_pos:my_pos + my_len].rstrip("\0")
+                my_pos = my_pos + my_len
+
+                if my_mask & IN_Q_OVERFLOW:
+                    # We lost events, assume something changed
+                    my_changed = True
+                elif my_wd in self._files and my_name in self._files[my_wd]:
+                    my_changed = True
+
+        return my_changed
+
+    def close(self):
+        """
+        This function releases the inotify file descriptor.
+        """
+        if self._fd >= 0:
+            os.close(self._fd)
+            self._fd = -1
+        self._dirs = {}
+        self._files = {}
+
+def create_watcher():
+    """
+    This function returns a new FileWatcher, or None if inotify is
+    not available, in which case callers should keep polling.
+    """
+    try:
+        return FileWatcher()
+    except (OSError, AttributeError), e:
+        logger.info("cannot use inotify, polling files instead: %s" % (e))
+
+    return None
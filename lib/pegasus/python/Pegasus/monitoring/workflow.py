@@ -24,11 +24,13 @@ import re
 import sys
 import time
 import socket
+import hashlib
 import logging
 import traceback
 
 # Import other Pegasus modules
 from Pegasus.tools import utils
+from Pegasus.monitoring import dagman_out
 from Pegasus.monitoring.job import Job
 from Pegasus.tools import kickstart_parser
 from Pegasus.monitoring.metadata import Metadata
@@ -66,6 +68,7 @@ PRESCRIPT_TASK_ID = -1                     # id for prescript tasks
 POSTSCRIPT_TASK_ID = -2                    # id for postscript tasks
 MAX_OUTPUT_LENGTH = 2**16-1                # in bytes, maximum we can put into the database for job's stdout and stderr
 UNKNOWN_FAILURE_CODE = 2                   # unknown failure code when inserting an END event betweeen consecutive workflow start events
+DAGMAN_OUT_FINGERPRINT_SIZE = 4096         # in bytes, amount of dagman.out preceding a checkpoint used to validate it
 
 # Other variables
 condor_dagman_executable = None	# condor_dagman binary location
@@ -367,6 +370,10 @@ class Workflow:
                 # Split the input line in 2, and make the second part an integer
                 my_job, my_count = line.split(" ", 1)
                 my_job = my_job.strip()
+                if my_job == "monitord_dagman_out_fingerprint":
+                    # Checksum of the dagman.out content preceding the offset
+                    self._last_processed_fingerprint = my_count.strip()
+                    continue
                 my_count = int(my_count.strip())
                 if my_job == "monitord_job_sequence":
                     # This is the last job_submit_seq used
@@ -374,6 +381,12 @@ class Workflow:
                 elif my_job == "monitord_dagman_out_sequence":
                     # This is the line we last read from the dagman.out file
                     self._last_processed_line = my_count
+                elif my_job == "monitord_dagman_out_offset":
+                    # This is the byte offset right after that line
+                    self._last_processed_offset = my_count
+                elif my_job == "monitord_dagman_out_timestamp":
+                    # This is the last timestamp we parsed from the dagman.out file
+                    self._last_processed_timestamp = my_count
                 elif my_job == "monitord_workflow_restart_count":
                     # This is the number of restarts we have seen in the past
                     self._restart_count = my_count
@@ -417,14 +430,27 @@ class Workflow:
             OUT.write("monitord_job_sequence %d\n" % (self._job_submit_seq))
             # Then, write the last line number of the dagman.out file we processed
             if self._line > self._last_processed_line:
-                OUT.write("monitord_dagman_out_sequence %s\n" % (self._line))
+                my_line = self._line
+                my_offset = self._dagman_out_offset
+                my_timestamp = self._current_timestamp
+                my_fingerprint = self.dagman_out_fingerprint(my_offset)
             else:
-                OUT.write("monitord_dagman_out_sequence %s\n" % (self._last_processed_line))
+                my_line = self._last_processed_line
+                my_offset = self._last_processed_offset
+                my_timestamp = self._last_processed_timestamp
+                my_fingerprint = self._last_processed_fingerprint
+            OUT.write("monitord_dagman_out_sequence %s\n" % (my_line))
             # Next, write the restart count
             OUT.write("monitord_workflow_restart_count %d\n" % (self._restart_count))
-            # Finally, write all job_counters
+            # Then, write all job_counters
             for my_job in self._job_counters:
                 OUT.write("%s %d\n" % (my_job, self._job_counters[my_job]))
+            # Finally, write the dagman.out checkpoint, so that we can seek to
+            # it next time instead of skipping my_line lines one by one
+            if my_fingerprint is not None:
+                OUT.write("monitord_dagman_out_offset %d\n" % (my_offset))
+                OUT.write("monitord_dagman_out_timestamp %d\n" % (my_timestamp))
+                OUT.write("monitord_dagman_out_fingerprint %s\n" % (my_fingerprint))
         except:
             logger.error("cannot write state to log file %s" % (my_fn))
 
@@ -437,6 +463,70 @@ class Workflow:
         # All done!
         return
 
+    def dagman_out_fingerprint(self, offset):
+        """
+        This function returns a checksum of the dagman.out content
+        immediately preceding offset, or None if the file cannot be
+        read or is shorter than offset. It is used to make sure the
+        dagman.out file was not truncated or rotated before resuming
+        from a saved offset.
+        """
+        if offset <= 0:
+            return None
+
+        try:
+            DMOF = open(self._out_file, "r")
+        except:
+            return None
+
+        try:
+            my_start = max(0, offset - DAGMAN_OUT_FINGERPRINT_SIZE)
+            DMOF.seek(my_start)
+            my_data = DMOF.read(offset - my_start)
+        except:
+            my_data = ""
+
+        # Close the file
+        try:
+            DMOF.close()
+        except:
+            pass
+
+        if len(my_data) != offset - my_start:
+            # File is shorter than our offset
+            return None
+
+        return hashlib.md5(my_data).hexdigest()
+
+    def dagman_out_resume_offset(self):
+        """
+        This function returns the offset in the dagman.out file where
+        parsing should resume, restoring the parser state saved along
+        with it. It returns 0 if there is no checkpoint, or if it does
+        not match the current dagman.out file, in which case we fall
+        back to skipping the lines we have already processed.
+        """
+        if self._last_processed_line == 0 or self._last_processed_offset == 0:
+            return 0
+
+        if self._last_processed_fingerprint is None:
+            return 0
+
+        if self.dagman_out_fingerprint(self._last_processed_offset) != self._last_processed_fingerprint:
+            logger.warning("dagman.out checkpoint does not match %s, skipping %d lines instead"
+                           % (self._out_file, self._last_processed_line))
+            return 0
+
+        # Checkpoint is valid, restore parser state
+        self._line = self._last_processed_line
+        self._dagman_out_offset = self._last_processed_offset
+        self._current_timestamp = self._last_processed_timestamp
+        logger.info("resuming %s at offset %d (line %d)" % (self._out_file,
+                                                             self._dagman_out_offset,
+                                                             self._line))
+
+        return self._dagman_out_offset
+
     def read_workflow_progress(self):
         """
         This function reads the workflow progress from a previous
@@ -763,7 +853,7 @@ class Workflow:
                  parent_id=None, parent_jobid=None, parent_jobseq=None,
                  enable_notifications=True, replay_mode=False,
                  store_stdout_stderr=True, output_dir=None,
-                 notifications_manager=None ):
+                 notifications_manager=None, kickstart_parser_pool=None ):
         """
         This function initializes the workflow object. It looks for
         the workflow configuration file (or for workflow_config_file,
@@ -785,6 +875,7 @@ class Workflow:
         self._notifications_manager = notifications_manager
         self._output_dir = output_dir
         self._store_stdout_stderr = store_stdout_stderr
+        self._kickstart_parser_pool = kickstart_parser_pool
         #self._last_known_state = last_known_state  #last known state of the workflow. updated whenever change_wf_state is called
 
         # Initialize other class variables
@@ -819,11 +910,16 @@ class Workflow:
         self._line = 0                          # line number from dagman.out file
         self._last_processed_line = 0           # line last processed by the monitoring daemon
         self._previous_processed_line = 0       # line last processed by a previous instance of monitord
+        self._dagman_out_offset = 0             # byte offset in dagman.out after the current line
+        self._last_processed_offset = 0         # byte offset after the line last processed by the monitoring daemon
+        self._last_processed_timestamp = 0      # timestamp of the line last processed by the monitoring daemon
+        self._last_processed_fingerprint = None # checksum of dagman.out content preceding _last_processed_offset
         self._restart_count = 0                 # Keep track of how many times the workflow was restarted
         self._skipping_recovery_lines = False   # Flag for skipping the repeat duplicate messages generated by DAGMan
         self._dagman_condor_id = None           # Condor id of the current DAGMan
         self._dagman_pid = 0                    # Condor DAGMan's PID
         self._current_timestamp = 0             # Last timestamp from DAGMan
+        self._last_timestamp = (None, None)     # Last timestamp text from DAGMan, and its conversion to Epoch
         self._dagman_exit_code = None           # Keep track of when to finish this workflow
         self._monitord_exit_code = 0            # Keep track of errors inside monitord
         self._finished = False                  # keep track so we don't finish multiple times
@@ -1767,6 +1863,93 @@ class Workflow:
 
 
 
+    def job_output_filename(self, jobid, job_submit_dir, job_output_counter):
+        """
+        This function returns the name of the kickstart output file
+        we parse for jobid, once its instance with the given output
+        counter is done.
+        """
+        # Compose kickstart output file name (base is the filename before rotation)
+        my_job_output_fn = os.path.join(job_submit_dir, jobid) + ".out"
+
+        # PM-793 rotated by the postscript, or always in the PMC only mode
+        if self.job_has_postscript(jobid) or self._is_pmc_dag:
+            my_job_output_fn = my_job_output_fn + ".%03d" % (job_output_counter)
+
+        return my_job_output_fn
+
+    def prefetch_job_output(self, jobid, job_state, submits=0):
+        """
+        This function asks the kickstart parser pool to start parsing
+        the output of jobid, if parse_job_output will need it when the
+        job reaches job_state. submits is the number of SUBMIT events
+        for jobid earlier in the chunk of lines being prefetched, which
+        are not processed yet. The result is picked up by
+        parse_job_output, so events are still sent in order.
+        """
+        if self._kickstart_parser_pool is None:
+            return
+
+        if submits > 0:
+            # The instance was submitted in this chunk, look ahead at
+            # the counter increment_job_counter will give it
+            if not jobid in self._job_info:
+                return
+            my_job_submit_dir = self.determine_job_submit_directory(jobid, self._job_info[jobid][0])
+            if my_job_submit_dir is None:
+                return
+            my_job_output_counter = self._job_counters.get(jobid, -1) + submits
+        else:
+            if not jobid in self._jobs_map or not (jobid, self._jobs_map[jobid]) in self._jobs:
+                return
+            my_job = self._jobs[jobid, self._jobs_map[jobid]]
+            my_job_submit_dir = my_job._job_submit_dir
+            my_job_output_counter = my_job._job_output_counter
+
+        # Same conditions update_job_state uses to call parse_job_output
+        if job_state == "JOB_SUCCESS" or job_state == "JOB_FAILURE":
+            if self.job_has_postscript(jobid) and not self._is_pmc_dag:
+                return
+        elif job_state != "POST_SCRIPT_SUCCESS" and job_state != "POST_SCRIPT_FAILURE":
+            return
+
+        # Subdag jobs have no kickstart output
+        if jobid in self._job_info and self._job_info[jobid][5] == True:
+            return
+
+        self._kickstart_parser_pool.prefetch(self.job_output_filename(jobid, my_job_submit_dir,
+                                                                      my_job_output_counter))
+
+    def prefetch_job_outputs(self, log_lines):
+        """
+        This function goes through a chunk of dagman.out lines before
+        they are processed, and starts parsing the kickstart output of
+        jobs finishing in it in the kickstart parser pool.
+        """
+        if self._kickstart_parser_pool is None:
+            return
+
+        # Number of SUBMIT events per job in the chunk so far, they
+        # will change the job output counters when processed
+        my_submits = {}
+
+        for log_line in log_lines:
+            # Cheap test before classifying the line
+            if (log_line.find(" job proc (") < 0 and log_line.find(" Script of ") < 0
+                and log_line.find("ULOG_SUBMIT ") < 0):
+                continue
+            my_type, my_expr = dagman_out.classify(log_line)
+            if my_type == "event":
+                if my_expr.group(1) == "SUBMIT":
+                    my_submits[my_expr.group(2)] = my_submits.get(my_expr.group(2), 0) + 1
+            elif my_type == "job_successful":
+                self.prefetch_job_output(my_expr.group(1), "JOB_SUCCESS", my_submits.get(my_expr.group(1), 0))
+            elif my_type == "job_failed":
+                self.prefetch_job_output(my_expr.group(1), "JOB_FAILURE", my_submits.get(my_expr.group(1), 0))
+            elif my_type == "script_done" and my_expr.group(1).upper() == "POST":
+                # Success or failure, the output is parsed the same way
+                self.prefetch_job_output(my_expr.group(2), "POST_SCRIPT_SUCCESS", my_submits.get(my_expr.group(2), 0))
+
     def parse_job_output(self, my_job, job_state):
         """
         This function tries to parse the kickstart output file of a
@@ -1791,23 +1974,30 @@ class Workflow:
 
         # If job is a subdag job, skip looking for its kickstart output
         if parse_kickstart:
-            # Compose kickstart output file name (base is the filename before rotation)
-            my_job_output_fn_base = os.path.join(my_job._job_submit_dir, my_job._exec_job_id) + ".out"
+            my_job_output_fn = self.job_output_filename(my_job._exec_job_id, my_job._job_submit_dir,
+                                                        my_job._job_output_counter)
 
             # PM-793 if there is a postscript associated then a job has rotated stdout|stderr
             # OR we are in the PMC only mode where there are no postscripts associated, but
             # still we have rotated logs
-            my_job_output_fn = my_job_output_fn_base
             if self.job_has_postscript( my_job._exec_job_id) or self._is_pmc_dag:
-                my_job_output_fn = my_job_output_fn_base + ".%03d" % (my_job._job_output_counter)
                 my_job._has_rotated_stdout_err_files = True
 
-            # First assume we will find rotated file
-            my_parser = kickstart_parser.Parser(my_job_output_fn)
-            my_output = my_parser.parse_stampede()
+            # Use the records parsed by the worker pool, if any
+            my_parsed = None
+            if self._kickstart_parser_pool is not None:
+                my_parsed = self._kickstart_parser_pool.get(my_job_output_fn)
+
+            if my_parsed is None:
+                # First assume we will find rotated file
+                my_parser = kickstart_parser.Parser(my_job_output_fn)
+                my_output = my_parser.parse_stampede()
+                my_parsed = (my_parser._open_error, my_output)
+
+            my_open_error, my_output = my_parsed
 
             # Check if successful
-            if my_parser._open_error == True and not my_job.is_noop_job():
+            if my_open_error == True and not my_job.is_noop_job():
                 logger.error("unable to read output file %s for job %s" % (my_job_output_fn, my_job._exec_job_id))
 
         # Initialize task id counter
@@ -114,6 +114,42 @@ class TestDBAdmin(unittest.TestCase):
     #     self.assertTrue(db_verify(db))
     #     _remove(filename)
         
+    def test_indexes(self):
+        filename = str(uuid.uuid4())
+        _silentremove(filename)
+        dburi = "sqlite:///%s" % filename
+        db = connection.connect(dburi, create=True, verbose=False)
+        self._assert_query_plans(db)
+
+        db_downgrade(db, pegasus_version="4.8.0", verbose=False)
+        self.assertEquals(db_current_version(db), 8)
+        self.assertRaises(AssertionError, self._assert_query_plans, db)
+        db.close()
+
+        db = connection.connect(dburi, create=True, verbose=False)
+        self.assertEquals(db_current_version(db), CURRENT_DB_VERSION)
+        self._assert_query_plans(db)
+        db.close()
+        _remove(filename)
+
+    def _assert_query_plans(self, db):
+        # Lookups of the statistics and dashboard queries, and the index
+        # SQLite should use for each of them
+        plans = [
+            ("SELECT wf_id FROM workflow WHERE root_wf_id = 1", "wf_root_wf_id_COL"),
+            ("SELECT wf_id FROM workflow WHERE parent_wf_id = 1", "wf_parent_wf_id_COL"),
+            ("SELECT job_instance_id FROM job_instance WHERE job_id = 1 AND job_submit_seq = 1", "UNIQUE_JOB_INSTANCE"),
+            ("SELECT job_instance_id FROM job_instance WHERE host_id = 1", "job_instance_host_id_COL"),
+            ("SELECT job_instance_id FROM job_instance WHERE subwf_id = 1", "job_instance_subwf_id_COL"),
+            ("SELECT timestamp FROM jobstate WHERE job_instance_id = 1 AND state = 'EXECUTE'", "UNIQUE_JOBSTATE"),
+            ("SELECT max(jobstate_submit_seq) FROM jobstate WHERE job_instance_id = 1", "jobstate_submit_seq_COL"),
+            ("SELECT task_id FROM task WHERE job_id = 1", "task_job_id_COL"),
+            ("SELECT remote_duration FROM invocation WHERE job_instance_id = 1 AND task_submit_seq >= 0", "UNIQUE_INVOCATION")
+        ]
+        for query, index in plans:
+            plan = " ".join([str(tuple(row)[-1]) for row in db.execute("EXPLAIN QUERY PLAN " + query)])
+            self.assertTrue(re.search(r"USING (COVERING )?INDEX %s\b" % index, plan), "%s: %s" % (query, plan))
+
     def test_partial_database(self):
         filename = str(uuid.uuid4())
         _silentremove(filename)
@@ -0,0 +1,254 @@
+import decimal
+import os
+import unittest
+import uuid
+
+from Pegasus.db import summary
+from Pegasus.db.workflow_loader import WorkflowLoader
+from Pegasus.db.workflow.stampede_statistics import StampedeStatistics
+from Pegasus.db.workflow.stampede_scan_statistics import StampedeScanStatistics
+from Pegasus.netlogger.parsers.base import NLSimpleParser
+
+dirname = os.path.abspath(os.path.dirname(__file__))
+blackdiamond = os.path.join(dirname, "input", "blackdiamond.bp")
+
+def read_events(filename):
+    parser = NLSimpleParser()
+    return [parser.parseLine(line) for line in open(filename) if line.strip()]
+
+JOB_STATISTICS_COLUMNS = ["job_id", "job_instance_id", "job_submit_seq", "job_name", "site", "condor_q_time",
+                          "resource_delay", "runtime", "kickstart", "post_time", "seqexec", "exit_code",
+                          "host_name", "multiplier_factor", "kickstart_multi", "remote_cpu_time"]
+
+# get_job_statistics() of blackdiamond.bp
+JOB_STATISTICS = [
+    (14, 1, 1, "create_dir_blackdiamond_0_local", "local", 10.0, None, 0.0, 0.0, None, None, 0, None, 1, 0.0, None),
+    (10, 2, 2, "stage_worker_local_blackdiamond_0_local", "local", 10.0, None, 0.0, 0.0, None, None, 0, None, 1, 0.0, None),
+    (7, 3, 3, "stage_in_local_local_0", "local", 0.0, None, 0.0, 0.092, 5.0, None, 0, "pegasussubmit.novalocal", 1, 0.092, 0.112),
+    (4, 4, 4, "stage_in_local_local_1", "local", 5.0, None, 0.0, 0.106, 5.0, None, 0, "pegasussubmit.novalocal", 1, 0.106, 0.112),
+    (5, 5, 5, "stage_in_local_local_2", "local", 5.0, None, 0.0, 0.092, 5.0, None, 0, "pegasussubmit.novalocal", 1, 0.092, 0.112),
+    (6, 6, 6, "stage_in_local_local_3", "local", 5.0, None, 5.0, 0.108, 6.0, None, 0, "pegasussubmit.novalocal", 1, 0.108, 0.112),
+    (12, 7, 7, "preprocess_j1", "condorpool", 441.0, None, 65.0, 60.002, 5.0, None, 0, "worker2.novalocal", 1, 60.002, 59.935),
+    (11, 8, 8, "findrange_j2", "condorpool", 105.0, None, 62.0, 60.002, 5.0, None, 0, "worker2.novalocal", 1, 60.002, 59.951),
+    (13, 9, 9, "findrange_j3", "condorpool", 45.0, None, 60.0, 60.001, 5.0, None, 0, "worker2.novalocal", 1, 60.001, 59.944),
+    (9, 10, 10, "stage_out_remote_local_0_0", "local", 10.0, None, 0.0, 0.1, 5.0, None, 0, "pegasussubmit.novalocal", 1, 0.1, 0.124),
+    (2, 11, 11, "stage_out_remote_local_1_1", "local", 5.0, None, 0.0, 0.096, 5.0, None, 0, "pegasussubmit.novalocal", 1, 0.096, 0.116),
+    (3, 12, 12, "stage_out_remote_local_1_0", "local", 5.0, None, 0.0, 0.306, 5.0, None, 0, "pegasussubmit.novalocal", 1, 0.306, 0.124),
+    (8, 13, 13, "analyze_j4", "condorpool", 51.0, None, 65.0, 60.002, 5.0, None, 0, "worker2.novalocal", 1, 60.002, 59.951),
+    (1, 14, 14, "stage_out_remote_local_2_0", "local", 5.0, None, 0.0, 0.091, 5.0, None, 0, "pegasussubmit.novalocal", 1, 0.091, 0.112),
+]
+
+class TestStampedeStatistics(unittest.TestCase):
+
+    def setUp(self):
+        self.filename = "/tmp/" + str(uuid.uuid4())
+        loader = WorkflowLoader("sqlite:///%s" % self.filename, batch=True)
+        events = read_events(blackdiamond)
+        for event in events:
+            loader.process(event)
+        loader.finish()
+        self.wf_uuid = events[0]["xwf.id"]
+        self.stats = StampedeStatistics("sqlite:///%s" % self.filename, expand_workflow=False)
+        self.stats.initialize(self.wf_uuid)
+
+    def tearDown(self):
+        self.stats.close()
+        _silentremove(self.filename)
+
+    def test_job_statistics(self):
+        rows = self.stats.get_job_statistics()
+        self.assertEquals(rows[0].keys(), JOB_STATISTICS_COLUMNS)
+        self.assertEquals([row.job_submit_seq for row in rows], range(1, 15))
+        self.assertEquals(_rows(rows), _rows(JOB_STATISTICS))
+
+    def test_summary(self):
+        # The loader summarized the workflow when it ended
+        self.assertTrue(self.stats._is_summarized())
+
+        totals = {}
+        for job_filter in ["all", "nonsub", "subwf", "compute", "stage-in-tx"]:
+            self.stats.set_job_filter(job_filter)
+            for method in ["get_total_jobs_status", "get_total_succeeded_jobs_status",
+                           "get_total_failed_jobs_status", "get_total_running_jobs_status",
+                           "get_total_jobs_retries", "get_total_tasks_status",
+                           "get_total_succeeded_tasks_status", "get_total_failed_tasks_status",
+                           "get_total_tasks_retries"]:
+                totals[job_filter, method] = getattr(self.stats, method)()
+        self.assertEquals(totals["all", "get_total_jobs_status"], 14)
+        self.assertEquals(totals["compute", "get_total_succeeded_tasks_status"], 4)
+        self.stats.set_job_filter("all")
+        wall_time = self.stats.get_workflow_cum_job_wall_time()
+        submit_wall_time = self.stats.get_submit_side_job_wall_time()
+        transformations = self.stats.get_transformation_statistics()
+        hosts = self.stats.get_host_statistics()
+        self.assertEquals(len(hosts), 2)
+
+        # Same totals from the job and invocation tables
+        self.stats._summarized = False
+        for (job_filter, method), total in totals.items():
+            self.stats.set_job_filter(job_filter)
+            self.assertEquals(getattr(self.stats, method)(), total)
+        self.stats.set_job_filter("all")
+        self.assertAlmostEquals(self.stats.get_workflow_cum_job_wall_time()[0], wall_time[0])
+        self.assertAlmostEquals(self.stats.get_submit_side_job_wall_time()[0], submit_wall_time[0])
+        for row, live in zip(transformations, self.stats.get_transformation_statistics()):
+            self.assertEquals((row.transformation, row.count, row.success, row.failure),
+                              (live.transformation, live.count, live.success, live.failure))
+            self.assertAlmostEquals(row.avg, live.avg)
+        for row, live in zip(hosts, self.stats.get_host_statistics()):
+            self.assertEquals(tuple(row)[:4], tuple(live)[:4])
+            self.assertAlmostEquals(row.remote_duration, live.remote_duration)
+
+    def test_summary_restart(self):
+        wf_id = self.stats._root_wf_id
+        summary.delete_workflow_summary(self.stats.session, wf_id)
+        self.stats._summarized = None
+        self.assertFalse(self.stats._is_summarized())
+        self.assertEquals(self.stats.get_total_jobs_status(), 14)
+
+        self.assertEquals(summary.rebuild_summaries(self.stats.session), 1)
+        self.stats._summarized = None
+        self.assertTrue(self.stats._is_summarized())
+        self.assertEquals(self.stats.get_total_jobs_status(), 14)
+
+    def test_summary_empty_workflow(self):
+        # A sub-workflow that ended without running any job
+        sub_wf_uuid = str(uuid.uuid4())
+        loader = WorkflowLoader("sqlite:///%s" % self.filename, batch=True)
+        for event in read_events(blackdiamond):
+            if event["event"] in ("stampede.wf.plan", "stampede.xwf.start", "stampede.xwf.end"):
+                event["xwf.id"] = sub_wf_uuid
+                if event["event"] == "stampede.wf.plan":
+                    event["root.xwf.id"] = event["parent.xwf.id"] = self.wf_uuid
+                loader.process(event)
+        loader.finish()
+
+        stats = StampedeStatistics("sqlite:///%s" % self.filename)
+        stats.initialize(self.wf_uuid)
+        self.assertEquals(len(stats._wfs), 2)
+        self.assertTrue(stats._is_summarized())
+        totals = {}
+        for job_filter in ["all", "nonsub", "subwf", "compute"]:
+            stats.set_job_filter(job_filter)
+            totals[job_filter] = (stats.get_total_jobs_status(), stats.get_total_tasks_status(),
+                                  stats.get_workflow_cum_job_wall_time(), stats.get_submit_side_job_wall_time())
+        self.assertEquals(totals["all"][0], 14)
+
+        # Same totals from the job and invocation tables
+        stats._summarized = False
+        for job_filter, total in totals.items():
+            stats.set_job_filter(job_filter)
+            self.assertEquals(_rows((stats.get_total_jobs_status(), stats.get_total_tasks_status()) +
+                                    tuple(stats.get_workflow_cum_job_wall_time()) +
+                                    tuple(stats.get_submit_side_job_wall_time())),
+                              _rows(total[:2] + tuple(total[2]) + tuple(total[3])))
+        stats.close()
+
+class TestStampedeScanStatistics(unittest.TestCase):
+
+    def setUp(self):
+        self.filename = "/tmp/" + str(uuid.uuid4())
+        loader = WorkflowLoader("sqlite:///%s" % self.filename, batch=True)
+        events = read_events(blackdiamond)
+        for event in events:
+            loader.process(event)
+        loader.finish()
+        self.wf_uuid = events[0]["xwf.id"]
+
+    def tearDown(self):
+        _silentremove(self.filename)
+
+    def assertSameStatistics(self, stats, scan):
+        for job_filter in ["all", "nonsub", "subwf", "compute", "stage-in-tx"]:
+            stats.set_job_filter(job_filter)
+            scan.set_job_filter(job_filter)
+            for method in ["get_total_jobs_status", "get_total_succeeded_failed_jobs_status",
+                           "get_total_succeeded_jobs_status", "get_total_failed_jobs_status",
+                           "get_total_running_jobs_status", "get_total_jobs_retries",
+                           "get_total_tasks_status", "get_total_succeeded_tasks_status",
+                           "get_total_failed_tasks_status", "get_total_tasks_retries",
+                           "get_workflow_states", "get_workflow_details", "get_workflow_retries",
+                           "get_descendant_workflow_ids"]:
+                self.assertEquals(_rows(getattr(scan, method)()), _rows(getattr(stats, method)()), method)
+
+        for method in ["get_workflow_cum_job_wall_time", "get_submit_side_job_wall_time",
+                       "get_job_statistics", "get_transformation_statistics", "get_host_statistics"]:
+            self.assertEquals(_rows(getattr(scan, method)()), _rows(getattr(stats, method)()), method)
+
+        for time_filter in ["hour", "day"]:
+            for obj in stats, scan:
+                obj.set_job_filter("nonsub")
+                obj.set_time_filter(time_filter)
+                obj.set_transformation_filter(exclude=["condor::dagman"])
+            for method in ["get_jobs_run_by_time", "get_invocation_by_time",
+                           "get_jobs_run_by_time_per_host", "get_invocation_by_time_per_host"]:
+                self.assertEquals(_rows(getattr(scan, method)()), _rows(getattr(stats, method)()), method)
+
+    def test_expanded(self):
+        stats = StampedeStatistics("sqlite:///%s" % self.filename)
+        stats.initialize(self.wf_uuid)
+        scan = StampedeScanStatistics("sqlite:///%s" % self.filename)
+        scan.initialize(self.wf_uuid)
+        self.assertEquals(scan.get_total_jobs_status(), 14)
+        self.assertSameStatistics(stats, scan)
+        stats.close()
+        scan.close()
+
+    def test_workflow(self):
+        stats = StampedeStatistics("sqlite:///%s" % self.filename, expand_workflow=False)
+        stats.initialize(self.wf_uuid)
+        scan = StampedeScanStatistics("sqlite:///%s" % self.filename)
+        scan.initialize(self.wf_uuid)
+        self.assertEquals(len(scan.workflow(self.wf_uuid).get_job_statistics()), 14)
+        self.assertSameStatistics(stats, scan.workflow(self.wf_uuid))
+        self.assertRaises(ValueError, scan.workflow, str(uuid.uuid4()))
+        stats.close()
+        scan.close()
+
+    def test_processes(self):
+        # Two copies of the workflow as sub-workflows of the first one
+        loader = WorkflowLoader("sqlite:///%s" % self.filename, batch=True)
+        for i in range(2):
+            sub_wf_uuid = str(uuid.uuid4())
+            for event in read_events(blackdiamond):
+                event = dict([(k, v == self.wf_uuid and sub_wf_uuid or v) for k, v in event.items()])
+                if event["event"] == "stampede.wf.plan":
+                    event["root.xwf.id"] = event["parent.xwf.id"] = self.wf_uuid
+                loader.process(event)
+        loader.finish()
+
+        stats = StampedeStatistics("sqlite:///%s" % self.filename)
+        stats.initialize(self.wf_uuid)
+        scan = StampedeScanStatistics("sqlite:///%s" % self.filename, processes=2)
+        scan.initialize(self.wf_uuid)
+        self.assertEquals(len(scan._wf_ranges(scan._data, scan._root_wf_id, 3)), 3)
+        self.assertEquals(scan.get_total_jobs_status(), 42)
+        self.assertSameStatistics(stats, scan)
+        for wf_id, wf_uuid in stats.get_descendant_workflow_ids():
+            sub_stats = StampedeStatistics("sqlite:///%s" % self.filename, expand_workflow=False)
+            sub_stats.initialize(wf_uuid)
+            self.assertSameStatistics(sub_stats, scan.workflow(wf_uuid))
+            sub_stats.close()
+        stats.close()
+        scan.close()
+
+def _rows(value):
+    "Rows as sorted tuples, with floats rounded to the precision of the NUMERIC columns"
+    def column(v):
+        if isinstance(v, (float, decimal.Decimal)):
+            return round(float(v), 3)
+        return v
+    if isinstance(value, list):
+        return sorted([_rows(row) for row in value])
+    if isinstance(value, tuple) or hasattr(value, "keys"):
+        return tuple([column(v) for v in value])
+    return column(value)
+
+def _silentremove(filename):
+    try:
+        os.remove(filename)
+    except OSError:
+        pass
+
+if __name__ == '__main__':
+    unittest.main()
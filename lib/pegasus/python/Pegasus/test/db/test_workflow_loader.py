@@ -0,0 +1,346 @@
+import os
+import json
+import unittest
+import uuid
+
+from Pegasus.db.workflow_loader import WorkflowLoader
+from Pegasus.db.schema import Invocation, Host
+from Pegasus.netlogger.parsers.base import NLSimpleParser
+
+dirname = os.path.abspath(os.path.dirname(__file__))
+blackdiamond = os.path.join(dirname, "input", "blackdiamond.bp")
+
+TABLES = ["workflow", "workflowstate", "job", "job_edge", "job_instance", "jobstate",
+          "task", "task_edge", "invocation", "host"]
+
+def read_events(filename):
+    parser = NLSimpleParser()
+    return [parser.parseLine(line) for line in open(filename) if line.strip()]
+
+def add_file_events(events):
+    """Adds replica catalog and file map events before the end of the workflow"""
+    wf_uuid = events[0]["xwf.id"]
+    lfns = ["f.a", "f.b1", "f.b2", "f.c1", "f.c2", "f.d"]
+    file_events = [{"event": "stampede.rc.meta", "xwf.id": wf_uuid, "lfn.id": "f.d",
+                    "key": "final_output", "value": "true"}]
+    for lfn in lfns:
+        file_events.append({"event": "stampede.rc.pfn", "xwf.id": wf_uuid, "lfn.id": lfn,
+                            "pfn": "file:///data/" + lfn, "site": "local"})
+    for task, lfn in [("j1", "f.a"), ("j1", "f.b1"), ("j1", "f.b2"), ("j2", "f.b1"),
+                      ("j2", "f.c1"), ("j3", "f.b2"), ("j3", "f.c2"), ("j4", "f.d")]:
+        file_events.append({"event": "stampede.wf.map.file", "xwf.id": wf_uuid,
+                            "lfn.id": lfn, "task.id": task})
+    end = [event["event"] for event in events].index("stampede.xwf.end")
+    return events[:end] + file_events + events[end:]
+
+class TestWorkflowLoader(unittest.TestCase):
+
+    def setUp(self):
+        self.filenames = []
+
+    def tearDown(self):
+        for filename in self.filenames:
+            _silentremove(filename)
+
+    def load(self, events, **kw):
+        filename = "/tmp/" + str(uuid.uuid4())
+        self.filenames.append(filename)
+        loader = WorkflowLoader("sqlite:///%s" % filename, **kw)
+        for event in events:
+            loader.process(dict(event))
+        return loader
+
+    def dump(self, loader):
+        rows = {}
+        for table in TABLES:
+            rows[table] = sorted([tuple(row) for row in loader.session.execute("SELECT * FROM %s" % table)])
+        return rows
+
+    def test_bulk_flush(self):
+        events = read_events(blackdiamond)
+        bulk = self.load(events, batch=True)
+        bulk.hard_flush()
+        orm = self.load(events, batch=True, bulk=False)
+        orm.hard_flush()
+
+        bulk_rows = self.dump(bulk)
+        self.assertEquals(len(bulk_rows["invocation"]), 26)
+        self.assertEquals(len(bulk_rows["jobstate"]), 96)
+        self.assertEquals(bulk_rows, self.dump(orm))
+        bulk.finish()
+        orm.finish()
+
+    def test_integrity_error_fallback(self):
+        events = read_events(blackdiamond)
+        loader = self.load(events, batch=True)
+        loader.hard_flush()
+        jobstates = len(self.dump(loader)["jobstate"])
+
+        # Replaying job state events makes the batch fail, but the
+        # other events in it should still be written
+        replay = [dict(e) for e in events if e["event"] == "stampede.job_inst.main.term"]
+        for event in replay:
+            event["ts"] = event["ts"] + 1000
+        replay.insert(3, [e for e in events if e["event"] == "stampede.job_inst.main.start"][0])
+        replay.insert(10, [e for e in events if e["event"] == "stampede.job_inst.main.start"][1])
+        for event in replay:
+            loader.process(dict(event))
+        loader.hard_flush()
+
+        self.assertEquals(len(self.dump(loader)["jobstate"]), jobstates + len(replay) - 2)
+        self.assertEquals(loader._integrity_error_batches, 1)
+        self.assertEquals(loader._rejected_events, 2)
+        self.assertTrue(loader._bisect_commits < len(replay))
+        loader.finish()
+
+    def test_integrity_error_summaries(self):
+        events = read_events(blackdiamond)
+        end = [event["event"] for event in events].index("stampede.xwf.end")
+        loader = self.load(events[:end], batch=True)
+        loader.hard_flush()
+        flushes = loader.stats.counters["flushes"]
+
+        # A batch that ends the workflow, and fails once
+        loader.process(dict([e for e in events if e["event"] == "stampede.job_inst.main.start"][0]))
+        for event in events[end:]:
+            loader.process(dict(event))
+        loader.hard_flush()
+
+        self.assertEquals(loader._integrity_error_batches, 1)
+        self.assertEquals(loader.stats.counters["summaries"], 1)
+        self.assertEquals(loader.stats.counters["flushes"], flushes + 1)
+        loader.finish()
+
+    def test_warm_caches(self):
+        events = read_events(blackdiamond)
+        loader = self.load(events, batch=True)
+        loader.finish()
+
+        # A new loader on the same database, as after a restart
+        loader = WorkflowLoader(loader.dburi, batch=True)
+        warmed = count_warm_caches(loader)
+        wf_id = loader.wf_uuid_to_id(events[0]["xwf.id"])
+        cache = loader.wf_cache(wf_id)
+        self.assertEquals(warmed, [wf_id])
+        self.assertEquals(len(cache.job_id), 14)
+        self.assertEquals(len(cache.job_instance_id), 14)
+        self.assertEquals(len(cache.task_id), 4)
+
+        rows = loader.session.execute("SELECT job_id, exec_job_id FROM job").fetchall()
+        for job_id, exec_job_id in rows:
+            self.assertEquals(cache.job_id[exec_job_id], job_id)
+        rows = loader.session.execute("SELECT job_instance_id, job_id, job_submit_seq FROM job_instance").fetchall()
+        for job_instance_id, job_id, job_submit_seq in rows:
+            self.assertEquals(cache.job_instance_id[(job_id, job_submit_seq)], job_instance_id)
+        loader.finish()
+
+    def test_new_workflow_not_warmed(self):
+        events = read_events(blackdiamond)
+        loader = self.load([], batch=True)
+        warmed = count_warm_caches(loader)
+        for event in events:
+            loader.process(dict(event))
+        loader.hard_flush()
+
+        # The workflow was inserted by this loader, there was nothing
+        # to read back from the database
+        self.assertEquals(warmed, [])
+        self.assertEquals(len(self.dump(loader)["jobstate"]), 96)
+        loader.finish()
+
+    def test_evicted_workflow_not_warmed_again(self):
+        events = read_events(blackdiamond)
+        first_job = [event["event"] for event in events].index("stampede.job.info")
+        workflows = [rename_workflow(events, str(uuid.uuid4())) for i in range(3)]
+        loader = self.load([], batch=True)
+        for wf_events in workflows:
+            for event in wf_events[:first_job]:
+                loader.process(dict(event))
+        loader.finish()
+
+        # A new loader loads the rest of the workflows, interleaved,
+        # with room for the caches of only two of them
+        loader = WorkflowLoader(loader.dburi, batch=True)
+        loader.MAX_CACHED_WORKFLOWS = 2
+        warmed = count_warm_caches(loader)
+        for i in range(first_job, len(events)):
+            for wf_events in workflows:
+                loader.process(dict(wf_events[i]))
+        loader.hard_flush()
+
+        wf_ids = [loader.wf_uuid_to_id(wf_events[0]["xwf.id"]) for wf_events in workflows]
+        self.assertEquals(sorted(warmed), sorted(wf_ids))
+        self.assertEquals(len(self.dump(loader)["jobstate"]), 3 * 96)
+        self.assertEquals(len(self.dump(loader)["job_instance"]), 3 * 14)
+        loader.finish()
+
+    def test_workflow_caches(self):
+        events = read_events(blackdiamond)
+        loader = self.load(events, batch=True)
+        loader.hard_flush()
+
+        # The workflow ended, so its caches are gone
+        self.assertEquals(len(loader.wf_caches), 0)
+
+        loader.MAX_CACHED_WORKFLOWS = 2
+        wf_id = loader.wf_uuid_to_id(events[0]["xwf.id"])
+        loader.wf_cache(wf_id).job_id["test"] = 1
+        loader.wf_cache(-1)
+        loader.wf_cache(wf_id)
+        loader.wf_cache(-2)
+        self.assertEquals(loader.wf_caches.keys(), [wf_id, -2])
+        self.assertEquals(loader.wf_cache(wf_id).job_id["test"], 1)
+        loader.wf_cache(-1)
+        self.assertEquals(loader.wf_caches.keys(), [wf_id, -1])
+        loader.finish()
+
+    def test_host_mapping(self):
+        events = read_events(blackdiamond)
+        query = "SELECT job_id, job_submit_seq, host_id FROM job_instance ORDER BY job_id, job_submit_seq"
+        batch = self.load(events, batch=True)
+        batch.hard_flush()
+        rows = batch.session.execute(query).fetchall()
+        self.assertEquals(len([row for row in rows if row.host_id is not None]), 12)
+
+        # Host events mapped one at a time give the same host_ids
+        single = self.load(events, batch=False)
+        self.assertEquals([tuple(row) for row in rows],
+                          [tuple(row) for row in single.session.execute(query)])
+        batch.finish()
+        single.finish()
+
+    def test_host_mapping_retry(self):
+        events = read_events(blackdiamond)
+        loader = self.load([e for e in events if e["event"] != "stampede.job_inst.host.info"], batch=True)
+        # Two job instances that ran on the same host
+        first, second = [e for e in events if e["event"] == "stampede.job_inst.host.info"][:2]
+        self.assertEquals(first["hostname"], second["hostname"])
+        loader.process(dict(first))
+        loader.hard_flush()
+        query = "SELECT host_id FROM job_instance WHERE job_submit_seq = %s"
+        host_id = loader.session.execute(query % first["job_inst.id"]).scalar()
+        self.assertTrue(host_id is not None)
+
+        # A host that is not in the host table cannot be mapped
+        def host(hostname):
+            h = loader.linedataToObject(dict(second), Host())
+            h.wf_id = loader.wf_uuid_to_root_id(h.wf_uuid)
+            h.hostname = hostname
+            return h
+        loader.map_hosts_to_job_instances([host("unknown.novalocal")])
+        self.assertEquals(loader.session.execute(query % second["job_inst.id"]).scalar(), None)
+
+        # but a later host event for the same job instance still is
+        loader.map_hosts_to_job_instances([host(second["hostname"])])
+        self.assertEquals(loader.session.execute(query % second["job_inst.id"]).scalar(), host_id)
+        loader.finish()
+
+    def test_lfn_resolution(self):
+        events = add_file_events(read_events(blackdiamond))
+        tables = ["rc_lfn", "rc_pfn", "rc_meta", "workflow_files"]
+        batch = self.load(events, batch=True)
+        batch.hard_flush()
+        single = self.load(events, batch=False)
+
+        for table in tables:
+            query = "SELECT * FROM %s" % table
+            rows = sorted([tuple(row) for row in batch.session.execute(query)])
+            self.assertEquals(rows, sorted([tuple(row) for row in single.session.execute(query)]))
+        self.assertEquals(batch.session.execute("SELECT COUNT(*) FROM rc_lfn").scalar(), 6)
+        self.assertEquals(batch.session.execute("SELECT COUNT(*) FROM rc_pfn").scalar(), 6)
+        self.assertEquals(batch.session.execute("SELECT COUNT(*) FROM workflow_files").scalar(), 8)
+        batch.finish()
+        single.finish()
+
+    def test_adaptive_flush(self):
+        loader = self.load([], batch=True)
+        self.assertEquals(loader._flush_every, 1000)
+
+        # A fast database gets larger and more frequent flushes
+        loader.tune_flush(1000, 0.5)
+        self.assertEquals(loader._flush_every, 2000)
+        self.assertEquals(loader._flush_interval, 5)
+        loader.tune_flush(2000, 0.01)
+        self.assertEquals(loader._flush_every, 4000)
+        self.assertEquals(loader._flush_interval, loader.MIN_FLUSH_INTERVAL)
+
+        # A slow one gets smaller ones, within bounds
+        for i in range(10):
+            loader.tune_flush(loader._flush_every, 60)
+        self.assertEquals(loader._flush_every, loader.MIN_FLUSH_EVERY)
+        self.assertEquals(loader._flush_interval, loader.MAX_FLUSH_INTERVAL)
+
+        # Large events are flushed before the count is reached
+        loader.MAX_FLUSH_BYTES = 1000
+        for event in read_events(blackdiamond)[:50]:
+            loader.process(dict(event))
+        self.assertTrue(loader._flush_bytes < 1000)
+        self.assertTrue(loader._flush_count < 50)
+        loader.finish()
+
+    def test_stats(self):
+        events = read_events(blackdiamond)
+        stats_file = "/tmp/" + str(uuid.uuid4())
+        self.filenames.append(stats_file)
+        loader = self.load(events, batch=True, perf=True, stats_file=stats_file)
+        loader.finish()
+
+        stats = json.load(open(stats_file))
+        self.assertEquals(stats["counters"]["events"], len(events))
+        self.assertEquals(stats["counters"]["rows.jobstate"], 96)
+        self.assertTrue(stats["counters"]["updates.job_instance"] >= 12)
+        self.assertEquals(stats["histograms"]["process"]["count"], len(events))
+        self.assertEquals(stats["histograms"]["process.stampede.inv.end"]["count"], 26)
+        self.assertEquals(sum([count for bound, count in stats["histograms"]["process"]["buckets"]]), len(events))
+        self.assertTrue(stats["histograms"]["commit"]["count"] >= 1)
+        self.assertTrue(stats["caches"]["job_id"]["hits"] > 0)
+        self.assertTrue(0 < stats["caches"]["job_id"]["hit_rate"] <= 1)
+
+    def test_linedata_to_object(self):
+        loader = self.load([], batch=True)
+        linedata = {"event": "stampede.inv.end", "level": "Info", "ts": "1331915390.000000",
+                    "xwf.id": "ea17e8ac-02ac-4909-b5e3-16e367392556", "job.id": "create_dir_diamond_0_local",
+                    "job_inst.id": "1", "inv.id": "-1", "start_time": "1331915376", "dur": "0.003",
+                    "exitcode": "0", "argv": "-c 'echo \\hello'"}
+        for i in range(2):
+            o = loader.linedataToObject(dict(linedata), Invocation())
+            self.assertEquals(o.ts, 1331915390.0)
+            self.assertEquals(o.start_time, 1331915376.0)
+            self.assertEquals(o.wf_uuid, "ea17e8ac-02ac-4909-b5e3-16e367392556")
+            self.assertEquals(o.exec_job_id, "create_dir_diamond_0_local")
+            self.assertEquals(o.job_submit_seq, "1")
+            self.assertEquals(o.task_submit_seq, "-1")
+            self.assertEquals(o.remote_duration, "0.003")
+            self.assertEquals(o.argv, "-c \\'echo \\\\hello\\'")
+            self.assertFalse(hasattr(o, "level"))
+        loader.finish()
+
+def rename_workflow(events, wf_uuid):
+    """Returns a copy of the events of a root workflow with another wf_uuid"""
+    renamed = []
+    for event in events:
+        event = dict(event)
+        for key in ("xwf.id", "root.xwf.id"):
+            if event.has_key(key):
+                event[key] = wf_uuid
+        renamed.append(event)
+    return renamed
+
+def count_warm_caches(loader):
+    """Returns the list of wf_ids whose caches the loader warms up from now on"""
+    warmed = []
+    warm_caches = loader.warm_caches
+    def counting_warm_caches(wf_id, cache):
+        warmed.append(wf_id)
+        warm_caches(wf_id, cache)
+    loader.warm_caches = counting_warm_caches
+    return warmed
+
+def _silentremove(filename):
+    try:
+        os.remove(filename)
+    except OSError:
+        pass
+
+if __name__ == '__main__':
+    unittest.main()
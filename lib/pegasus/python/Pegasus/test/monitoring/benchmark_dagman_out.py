@@ -0,0 +1,82 @@
+"""
+Micro-benchmark for the classification of dagman.out log lines in
+pegasus-monitord. It compares Pegasus.monitoring.dagman_out.classify()
+with trying every regular expression in turn, as pegasus-monitord used
+to do.
+
+Usage: python -m Pegasus.test.monitoring.benchmark_dagman_out [-r repeat] [dagman.out ...]
+"""
+
+import os
+import sys
+import time
+import optparse
+
+from Pegasus.monitoring import dagman_out
+
+dirname = os.path.abspath(os.path.dirname(__file__))
+DEFAULT_CORPUS = os.path.join(dirname, "dagman_out", "blackdiamond-0.dag.dagman.out")
+
+def classify_sequential(log_line, multiline_files=False):
+    """
+    Reference implementation of dagman_out.classify(), trying every
+    regular expression in order until one matches.
+    """
+    for my_name, my_keyword, my_regex in dagman_out.LINE_TYPES:
+        if my_name == "condor_logfile_insane" and not multiline_files:
+            continue
+        my_expr = my_regex.search(log_line)
+        if my_expr is not None:
+            return (my_name, my_expr)
+
+    return (None, None)
+
+def read_corpus(filenames):
+    lines = []
+    for filename in filenames:
+        f = open(filename, "r")
+        try:
+            lines.extend([line.rstrip() for line in f])
+        finally:
+            f.close()
+    return lines
+
+def lines_per_second(function, lines, repeat):
+    """
+    Returns the best rate at which function classifies lines, out of
+    repeat runs.
+    """
+    best = None
+    for i in range(repeat):
+        start = time.time()
+        for line in lines:
+            function(line)
+        elapsed = time.time() - start
+        if best is None or elapsed < best:
+            best = elapsed
+    return len(lines) / max(best, 1e-9)
+
+def main(args=None):
+    parser = optparse.OptionParser(usage="%prog [-r repeat] [dagman.out ...]")
+    parser.add_option("-r", "--repeat", action="store", type="int", dest="repeat", default=5,
+                      help="number of runs, the best one is reported (default %default)")
+    options, args = parser.parse_args(args)
+
+    filenames = args or [DEFAULT_CORPUS]
+    lines = read_corpus(filenames)
+    if len(lines) == 0:
+        parser.error("no lines to classify")
+
+    # Make sure there is enough work to measure
+    corpus = lines * max(1, 100000 // len(lines))
+
+    before = lines_per_second(classify_sequential, corpus, options.repeat)
+    after = lines_per_second(dagman_out.classify, corpus, options.repeat)
+
+    print "corpus:     %d lines from %s" % (len(lines), ", ".join(filenames))
+    print "sequential: %12.0f lines/s" % before
+    print "dispatcher: %12.0f lines/s" % after
+    print "speedup:    %12.2fx" % (after / before)
+
+if __name__ == "__main__":
+    main()
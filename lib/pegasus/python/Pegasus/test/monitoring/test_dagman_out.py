@@ -0,0 +1,43 @@
+import unittest
+
+from Pegasus.monitoring import dagman_out
+from Pegasus.test.monitoring.benchmark_dagman_out import DEFAULT_CORPUS, classify_sequential, read_corpus
+
+class TestClassify(unittest.TestCase):
+    def classify(self, line, multiline_files=False):
+        return dagman_out.classify(line, multiline_files)[0]
+
+    def testSameAsSequential(self):
+        for line in read_corpus([DEFAULT_CORPUS]):
+            for multiline_files in (False, True):
+                my_type, my_expr = dagman_out.classify(line, multiline_files)
+                ref_type, ref_expr = classify_sequential(line, multiline_files)
+                self.assertEquals(my_type, ref_type, line)
+                if my_expr is not None:
+                    self.assertEquals(my_expr.groups(), ref_expr.groups(), line)
+
+    def testTypes(self):
+        self.assertEquals(self.classify("10/18/17 10:00:09 Event: ULOG_SUBMIT for HTCondor Node a (1.0.0) {10/18/17 10:00:04}"), "event")
+        self.assertEquals(self.classify("10/18/17 10:00:04 Submitting HTCondor Node a job(s)..."), "job_submit")
+        self.assertEquals(self.classify("10/18/17 10:00:34 Node a job proc (1.0.0) completed successfully."), "job_successful")
+        self.assertEquals(self.classify("10/18/17 10:00:34 Node a job proc (1.0.0) failed with status 1."), "job_failed")
+        self.assertEquals(self.classify("10/18/17 10:00:34 Running POST script of Node a..."), "script_running")
+        self.assertEquals(self.classify("10/18/17 10:00:39 POST Script of node a completed successfully."), "script_done")
+        self.assertEquals(self.classify("10/18/17 10:00:00 ** PID = 24301"), "dagman_pid")
+        self.assertEquals(self.classify("10/18/17 10:05:03 Running in RECOVERY mode... >>>>>>>>>>"), "recovery_start")
+        self.assertEquals(self.classify("10/18/17 10:00:03 Bootstrapping..."), None)
+        self.assertEquals(self.classify(""), None)
+
+    def testOverlappingKeywords(self):
+        # Both the held reason and the abort keywords are in the line,
+        # the abort is tried first
+        self.assertEquals(self.classify("10/18/17 10:01:04   Hold reason: Received SIGUSR1"), "dagman_aborted")
+
+    def testMultilineFiles(self):
+        line = "10/18/17 10:05:00   /home/user/run0001/blackdiamond-0.dag.nodes.log (Condor)"
+        self.assertEquals(self.classify(line), None)
+        self.assertEquals(self.classify(line, True), "condor_logfile_insane")
+        self.assertEquals(dagman_out.classify(line, True)[1].group(1), "/home/user/run0001/blackdiamond-0.dag.nodes.log")
+
+if __name__ == '__main__':
+    unittest.main()
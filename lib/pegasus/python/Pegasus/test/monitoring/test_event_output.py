@@ -0,0 +1,164 @@
+import os
+import unittest
+import uuid
+
+from Pegasus.monitoring import event_output
+from Pegasus.netlogger.parsers.base import NLSimpleParser
+from Pegasus.db import connection
+from Pegasus.db.workflow_loader import WorkflowLoader, EventRecord, event_record
+
+dirname = os.path.abspath(os.path.dirname(__file__))
+blackdiamond = os.path.join(dirname, "..", "db", "input", "blackdiamond.bp")
+
+TABLES = ["workflow", "workflowstate", "job", "job_instance", "jobstate", "task", "invocation", "host"]
+
+def read_events(filename):
+    parser = NLSimpleParser()
+    return [parser.parseLine(line) for line in open(filename) if line.strip()]
+
+class TestDBEventSink(unittest.TestCase):
+
+    def setUp(self):
+        self.filenames = []
+
+    def tearDown(self):
+        for filename in self.filenames:
+            _silentremove(filename)
+
+    def load(self, queue_size):
+        filename = "/tmp/" + str(uuid.uuid4())
+        self.filenames.append(filename)
+        sink = event_output.DBEventSink("sqlite:///%s" % filename, queue_size=queue_size,
+                                        db_type=connection.DBType.WORKFLOW)
+        for i, event in enumerate(read_events(blackdiamond)):
+            name = event.pop("event")[len(event_output.STAMPEDE_NS):]
+            sink.send(name, dict([(k.replace(".", "__"), v) for k, v in event.items()]))
+            if i % 50 == 0:
+                sink.flush()
+        sink.close()
+        return filename
+
+    def dump(self, filename):
+        db = connection.connect("sqlite:///%s" % filename, db_type=connection.DBType.WORKFLOW)
+        rows = {}
+        for table in TABLES:
+            rows[table] = sorted([tuple(row) for row in db.execute("SELECT * FROM %s" % table)])
+        db.close()
+        return rows
+
+    def test_queued_writes(self):
+        rows = self.dump(self.load(0))
+        self.assertEquals(len(rows["jobstate"]), 96)
+        self.assertEquals(self.dump(self.load(1)), rows)
+        self.assertEquals(self.dump(self.load(1000)), rows)
+
+    def test_event_records(self):
+        record = event_record("stampede.inv.end", {"xwf__id": "x", "job__id": "j", "inv__id": 1, "level": "Info",
+                                                   "stdin.file": "in"})
+        self.assertTrue(isinstance(record, EventRecord))
+        self.assertEquals(record.attrs, {"wf_uuid": "x", "exec_job_id": "j", "task_submit_seq": 1, "stdin_file": "in"})
+        self.assertEquals(record["xwf.id"], "x")
+        self.assertEquals(record["event"], "stampede.inv.end")
+
+        # Records give the same rows as BP dicts
+        filename = "/tmp/" + str(uuid.uuid4())
+        self.filenames.append(filename)
+        loader = WorkflowLoader("sqlite:///%s" % filename, batch=True)
+        for event in read_events(blackdiamond):
+            loader.process(event)
+        loader.finish()
+        self.assertEquals(self.dump(self.load(0)), self.dump(filename))
+
+class FailingLoader(object):
+    """
+    Loader that rejects the events of workflow "bad", and, with
+    fail_flush, fails like hard_flush() does after too many retries
+    """
+    def __init__(self, fail_flush=False):
+        self.fail_flush = fail_flush
+        self.events = []
+        self.finished = False
+
+    def process(self, event):
+        if event["xwf.id"] == "bad":
+            raise ValueError("bad event")
+        self.events.append(event)
+
+    def flush(self):
+        if self.fail_flush:
+            raise RuntimeError("Maximum number of retries reached for stampede_loader.hard_flush() method 3")
+
+    def finish(self):
+        self.flush()
+        self.finished = True
+
+class TestDBEventSinkErrors(unittest.TestCase):
+
+    def setUp(self):
+        self.filename = "/tmp/" + str(uuid.uuid4())
+
+    def tearDown(self):
+        _silentremove(self.filename)
+
+    def sink(self, queue_size, fail_flush=False):
+        sink = event_output.DBEventSink("sqlite:///%s" % self.filename, queue_size=queue_size,
+                                        db_type=connection.DBType.WORKFLOW)
+        sink._db.finish()
+        sink._db = FailingLoader(fail_flush)
+        return sink
+
+    def test_unqueued(self):
+        sink = self.sink(0)
+        self.assertRaises(ValueError, sink.send, "xwf.start", {"xwf__id": "bad"})
+        sink.send("xwf.start", {"xwf__id": "good"})
+        sink.close()
+        self.assertEquals(len(sink._db.events), 1)
+
+    def test_event_error(self):
+        sink = self.sink(10)
+        # Only the events that fail are lost, other workflows go on
+        sink.send("xwf.start", {"xwf__id": "good"})
+        sink.send("xwf.start", {"xwf__id": "bad"})
+        sink.send("xwf.end", {"xwf__id": "good"})
+        sink.flush()
+        sink.close()
+        self.assertEquals([event["event"] for event in sink._db.events], ["stampede.xwf.start", "stampede.xwf.end"])
+        self.assertTrue(sink._db.finished)
+
+    def test_flush_error(self):
+        sink = self.sink(10, fail_flush=True)
+        # The error happens in the writer thread
+        sink.send("xwf.start", {"xwf__id": "good"})
+        sink.flush()
+        sink._writer.join(10)
+        self.assertFalse(sink._writer.is_alive())
+
+        # and is raised to the caller from then on
+        self.assertRaises(RuntimeError, sink.send, "xwf.end", {"xwf__id": "good"})
+        self.assertRaises(RuntimeError, sink.flush)
+        self.assertRaises(RuntimeError, sink.close)
+        self.assertEquals(len(sink._db.events), 1)
+        self.assertFalse(sink._db.finished)
+
+    def test_queue_full(self):
+        sink = self.sink(1, fail_flush=True)
+        sink.flush()
+        # Events stop being consumed after the error, so sending
+        # blocks until the writer is found to be gone
+        self.assertRaises(RuntimeError, lambda: [sink.send("xwf.start", {"xwf__id": "good"}) for i in range(10)])
+
+    def test_close(self):
+        sink = self.sink(10, fail_flush=True)
+        sink.send("xwf.start", {"xwf__id": "good"})
+        # The error is raised even if it happens while closing
+        self.assertRaises(RuntimeError, sink.close)
+        self.assertEquals(len(sink._db.events), 1)
+
+def _silentremove(filename):
+    try:
+        os.remove(filename)
+    except OSError:
+        pass
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,141 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+from Pegasus.tools import kickstart_parser
+from Pegasus.monitoring import workflow
+from Pegasus.monitoring.job import Job
+from Pegasus.monitoring.kickstart_pool import KickstartParserPool
+
+dirname = os.path.abspath(os.path.dirname(__file__))
+exitcode_dir = os.path.join(dirname, "..", "exitcode")
+
+def parse_stampede(filename):
+    my_parser = kickstart_parser.Parser(filename)
+    my_output = my_parser.parse_stampede()
+    return (my_parser._open_error, my_output)
+
+class TestKickstartParserPool(unittest.TestCase):
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.filename = os.path.join(self.dir, "preprocess_ID000001.out.000")
+        shutil.copy(os.path.join(exitcode_dir, "ok.out"), self.filename)
+        self.pool = KickstartParserPool(1)
+
+    def tearDown(self):
+        self.pool.close()
+        shutil.rmtree(self.dir)
+
+    def test_hit(self):
+        self.pool.prefetch(self.filename)
+        # Prefetching the same file again does not submit it twice
+        self.pool.prefetch(self.filename)
+        self.assertEquals(self.pool.get(self.filename), parse_stampede(self.filename))
+        self.assertEquals(self.pool.hits, 1)
+        self.assertEquals(self.pool.misses, 0)
+
+        # Results are only used once
+        self.assertEquals(self.pool.get(self.filename), None)
+        self.assertEquals(self.pool.misses, 1)
+
+    def test_miss(self):
+        self.assertEquals(self.pool.get(self.filename), None)
+        self.assertEquals(self.pool.hits, 0)
+        self.assertEquals(self.pool.misses, 1)
+
+    def test_missing_file(self):
+        missing = os.path.join(self.dir, "missing.out.000")
+        self.pool.prefetch(missing)
+        self.assertEquals(self.pool.get(missing), None)
+        self.assertEquals(self.pool.misses, 1)
+
+    def test_modified(self):
+        self.pool.prefetch(self.filename)
+        # The job was retried and kickstart appended a new record
+        f = open(self.filename, "a")
+        f.write(open(os.path.join(exitcode_dir, "failed.out")).read())
+        f.close()
+        self.assertEquals(self.pool.get(self.filename), None)
+        self.assertEquals(self.pool.hits, 0)
+        self.assertEquals(self.pool.misses, 1)
+
+    def test_touched(self):
+        # Same size, different modification time
+        self.pool.prefetch(self.filename)
+        my_stat = os.stat(self.filename)
+        os.utime(self.filename, (my_stat.st_atime, my_stat.st_mtime + 10))
+        self.assertEquals(self.pool.get(self.filename), None)
+        self.assertEquals(self.pool.misses, 1)
+
+    def test_clear(self):
+        self.pool.prefetch(self.filename)
+        self.pool.clear()
+        self.assertEquals(self.pool.get(self.filename), None)
+        self.assertEquals(self.pool.hits, 0)
+        self.assertEquals(self.pool.misses, 1)
+
+        # Files can be prefetched again after clear()
+        self.pool.prefetch(self.filename)
+        self.assertEquals(self.pool.get(self.filename), parse_stampede(self.filename))
+        self.assertEquals(self.pool.hits, 1)
+
+class PrefetchWorkflow(workflow.Workflow):
+    def __init__(self, run_dir, pool):
+        # Only what prefetching job outputs needs
+        self._run_dir = run_dir
+        self._kickstart_parser_pool = pool
+        self._is_pmc_dag = False
+        self._jobs = {}
+        self._jobs_map = {}
+        self._job_counters = {}
+        self._job_info = {}
+        for jobid in ("preprocess_j1", "findrange_j2"):
+            # Jobs with a postscript, so their outputs are rotated
+            self._job_info[jobid] = [os.path.join(run_dir, jobid + ".sub"), None, None,
+                                     "/usr/bin/pegasus-exitcode", "", False, None, None, None]
+
+class TestPrefetchJobOutputs(unittest.TestCase):
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.pool = KickstartParserPool(1)
+        self.wf = PrefetchWorkflow(self.dir, self.pool)
+        for basename in ("preprocess_j1.out.000", "preprocess_j1.out.001", "findrange_j2.out.000"):
+            shutil.copy(os.path.join(exitcode_dir, "ok.out"), os.path.join(self.dir, basename))
+
+        # The first attempt of preprocess_j1 was submitted in an
+        # earlier chunk
+        job = Job("wf-uuid", "preprocess_j1", self.dir, 1)
+        job._job_output_counter = self.wf.increment_job_counter("preprocess_j1")
+        self.wf._jobs["preprocess_j1", 1] = job
+        self.wf._jobs_map["preprocess_j1"] = 1
+
+    def tearDown(self):
+        self.pool.close()
+        shutil.rmtree(self.dir)
+
+    def test_retry_with_postscript(self):
+        self.wf.prefetch_job_outputs([
+            "10/18/17 10:00:34 Node preprocess_j1 job proc (1.0.0) failed with status 1.",
+            "10/18/17 10:00:39 POST Script of node preprocess_j1 failed with status 1",
+            "10/18/17 10:00:44 Event: ULOG_SUBMIT for HTCondor Node preprocess_j1 (2.0.0) {10/18/17 10:00:44}",
+            "10/18/17 10:01:44 Node preprocess_j1 job proc (2.0.0) completed successfully.",
+            "10/18/17 10:01:49 POST Script of node preprocess_j1 completed successfully."])
+        self.assertEquals(sorted(self.pool._pending.keys()),
+                          [os.path.join(self.dir, "preprocess_j1.out.000"),
+                           os.path.join(self.dir, "preprocess_j1.out.001")])
+
+    def test_first_attempt(self):
+        # Submitted and done in the same chunk, before the job exists
+        self.wf.prefetch_job_outputs([
+            "10/18/17 10:00:04 Event: ULOG_SUBMIT for HTCondor Node findrange_j2 (3.0.0) {10/18/17 10:00:04}",
+            "10/18/17 10:01:04 Node findrange_j2 job proc (3.0.0) completed successfully.",
+            "10/18/17 10:01:09 POST Script of node findrange_j2 completed successfully."])
+        filename = os.path.join(self.dir, "findrange_j2.out.000")
+        self.assertEquals(self.pool._pending.keys(), [filename])
+        self.assertEquals(self.pool.get(filename), parse_stampede(filename))
+
+if __name__ == '__main__':
+    unittest.main()
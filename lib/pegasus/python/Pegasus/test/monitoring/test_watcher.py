@@ -0,0 +1,56 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+from Pegasus.monitoring import watcher
+
+class TestFileWatcher(unittest.TestCase):
+
+    def setUp(self):
+        self.watcher = watcher.create_watcher()
+        if self.watcher is None:
+            self.skipTest("inotify is not available")
+        self.dir = tempfile.mkdtemp()
+        self.filename = os.path.join(self.dir, "blackdiamond-0.dag.dagman.out")
+
+    def tearDown(self):
+        self.watcher.close()
+        shutil.rmtree(self.dir)
+
+    def append(self, filename, line):
+        f = open(filename, "a")
+        f.write(line)
+        f.close()
+
+    def test_create(self):
+        # The file does not exist yet when we start tracking it
+        self.assertTrue(self.watcher.add(self.filename))
+        self.assertFalse(self.watcher.wait(0))
+        self.append(self.filename, "10/18/17 10:00:00 ** PID = 24301\n")
+        self.assertTrue(self.watcher.wait(1))
+        # All pending events were consumed
+        self.assertFalse(self.watcher.wait(0))
+
+    def test_other_file(self):
+        self.watcher.add(self.filename)
+        self.append(os.path.join(self.dir, "braindump.txt"), "wf_uuid 1\n")
+        self.assertFalse(self.watcher.wait(0.1))
+
+    def test_remove(self):
+        self.watcher.add(self.filename)
+        self.watcher.remove(self.filename)
+        self.append(self.filename, "10/18/17 10:00:00 ** PID = 24301\n")
+        self.assertFalse(self.watcher.wait(0.1))
+        # Removing a file that is not tracked is a no-op
+        self.watcher.remove(self.filename)
+
+    def test_close(self):
+        self.watcher.add(self.filename)
+        self.watcher.close()
+        self.assertEquals(self.watcher._fd, -1)
+        # Closing twice is harmless
+        self.watcher.close()
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,116 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+from Pegasus.monitoring import workflow
+
+DAGMAN_OUT = "".join(["10/18/17 10:00:%02d Event: ULOG_SUBMIT for HTCondor Node job_%d (%d.0.0)\n" % (i, i, i)
+                      for i in range(40)])
+
+class CheckpointWorkflow(workflow.Workflow):
+    def __init__(self):
+        # Skip the braindump and jobstate.log setup
+        pass
+
+def new_workflow(run_dir):
+    """
+    Returns a Workflow with only the attributes used to save and
+    restore the dagman.out checkpoint.
+    """
+    wf = CheckpointWorkflow()
+    wf._run_dir = run_dir
+    wf._output_dir = None
+    wf._wf_uuid = "wf-uuid"
+    wf._out_file = os.path.join(run_dir, "blackdiamond-0.dag.dagman.out")
+    wf._job_submit_seq = 1
+    wf._job_counters = {}
+    wf._restart_count = 0
+    wf._line = 0
+    wf._dagman_out_offset = 0
+    wf._current_timestamp = 0
+    wf._last_processed_line = 0
+    wf._last_processed_offset = 0
+    wf._last_processed_timestamp = 0
+    wf._last_processed_fingerprint = None
+    return wf
+
+class TestDagmanOutCheckpoint(unittest.TestCase):
+
+    def setUp(self):
+        self.run_dir = tempfile.mkdtemp()
+        self.write_dagman_out(DAGMAN_OUT)
+
+        # Save a checkpoint after the first 30 lines
+        wf = new_workflow(self.run_dir)
+        wf._line = 30
+        wf._dagman_out_offset = len("".join(DAGMAN_OUT.splitlines(True)[:30]))
+        wf._current_timestamp = 1508320829
+        wf._job_submit_seq = 31
+        wf.write_workflow_state()
+        self.offset = wf._dagman_out_offset
+
+    def tearDown(self):
+        shutil.rmtree(self.run_dir)
+
+    def write_dagman_out(self, content):
+        f = open(os.path.join(self.run_dir, "blackdiamond-0.dag.dagman.out"), "w")
+        f.write(content)
+        f.close()
+
+    def restore(self):
+        wf = new_workflow(self.run_dir)
+        wf.read_workflow_state()
+        return wf, wf.dagman_out_resume_offset()
+
+    def test_match(self):
+        wf, offset = self.restore()
+        self.assertEquals(offset, self.offset)
+        self.assertEquals(wf._line, 30)
+        self.assertEquals(wf._dagman_out_offset, self.offset)
+        self.assertEquals(wf._current_timestamp, 1508320829)
+        self.assertEquals(wf._job_submit_seq, 31)
+
+        # Resuming at the offset reads the 31st line
+        f = open(wf._out_file)
+        f.seek(offset)
+        self.assertEquals(f.readline(), DAGMAN_OUT.splitlines(True)[30])
+        f.close()
+
+    def test_appended(self):
+        # DAGMan kept writing after the checkpoint
+        self.write_dagman_out(DAGMAN_OUT + DAGMAN_OUT)
+        wf, offset = self.restore()
+        self.assertEquals(offset, self.offset)
+
+    def test_truncated(self):
+        # The offset is past the end of the file
+        self.write_dagman_out(DAGMAN_OUT[:self.offset - 1])
+        wf, offset = self.restore()
+        self.assertEquals(offset, 0)
+        self.assertEquals(wf._line, 0)
+        self.assertEquals(wf._current_timestamp, 0)
+        # We fall back to skipping the lines already processed
+        self.assertEquals(wf._last_processed_line, 30)
+
+    def test_rewritten(self):
+        # A new dagman.out, at least as long as the offset, but with a
+        # different content
+        self.write_dagman_out(DAGMAN_OUT.replace("ULOG_SUBMIT", "ULOG_EXECUTE"))
+        wf, offset = self.restore()
+        self.assertEquals(offset, 0)
+        self.assertEquals(wf._line, 0)
+        self.assertEquals(wf._last_processed_line, 30)
+
+    def test_no_checkpoint(self):
+        # State files written before the checkpoint was added only have
+        # the line number
+        f = open(os.path.join(self.run_dir, workflow.MONITORD_STATE_FILE), "w")
+        f.write("monitord_job_sequence 31\nmonitord_dagman_out_sequence 30\n")
+        f.close()
+        wf, offset = self.restore()
+        self.assertEquals(offset, 0)
+        self.assertEquals(wf._last_processed_line, 30)
+
+if __name__ == '__main__':
+    unittest.main()
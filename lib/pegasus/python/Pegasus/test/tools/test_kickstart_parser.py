@@ -0,0 +1,100 @@
+import os
+import tempfile
+import unittest
+
+from Pegasus.tools import kickstart_parser
+
+dirname = os.path.abspath(os.path.dirname(__file__))
+exitcode_dir = os.path.join(dirname, "..", "exitcode")
+
+def buffered_parse(filename, keys_dict):
+    """
+    Parses filename reading each record in memory before parsing it.
+    """
+    my_reply = []
+    my_parser = kickstart_parser.Parser(filename)
+    my_parser._ks_elements = keys_dict
+    my_parser.open()
+    my_buffer = my_parser.read_record()
+    while my_buffer is not None:
+        if my_parser.is_invocation_record(my_buffer):
+            my_reply.append(my_parser.parse_invocation_record(my_buffer))
+        elif my_parser.is_clustered_record(my_buffer):
+            my_reply.append(my_parser.parse_clustered_record(my_buffer))
+        elif my_parser.is_task_record(my_buffer):
+            my_reply.append(my_parser.parse_task_record(my_buffer))
+        my_buffer = my_parser.read_record()
+    my_parser.close()
+    return my_reply
+
+class KickstartParserTestCase(unittest.TestCase):
+    keys = {"invocation": ["hostname", "transformation"],
+            "regular": ["exitcode"],
+            "argument-vector": [],
+            "cwd": [],
+            "stdout": [],
+            "stderr": []}
+
+    def test_invocation(self):
+        records = kickstart_parser.Parser(os.path.join(exitcode_dir, "ok.out")).parse(self.keys)
+        self.assertEquals(len(records), 1)
+        self.assertTrue(records[0]["invocation"])
+        self.assertEquals(records[0]["exitcode"], "0")
+
+    def test_streaming_matches_buffered(self):
+        for name in ["ok.out", "failed.out", "cluster-ok.out", "cluster-error.out", "seqexec-ok.out", "walltime.out"]:
+            filename = os.path.join(exitcode_dir, name)
+            streamed = kickstart_parser.Parser(filename).parse(self.keys)
+            self.assertEquals(streamed, buffered_parse(filename, self.keys), name)
+
+    def test_mapped_matches_readline(self):
+        for name in ["ok.out", "failed.out", "cluster-ok.out", "cluster-error.out", "seqexec-ok.out", "walltime.out"]:
+            filename = os.path.join(exitcode_dir, name)
+            mapped = kickstart_parser.Parser(filename)
+            unmapped = kickstart_parser.Parser(filename)
+            unmapped._use_mmap = False
+            self.assertEquals(mapped.parse(self.keys), unmapped.parse(self.keys), name)
+
+    def test_output_limit(self):
+        filename = os.path.join(exitcode_dir, "largecode.out")
+        full = kickstart_parser.Parser(filename).parse(self.keys)
+        limited = kickstart_parser.Parser(filename).parse(self.keys, output_limit=1000)
+        self.assertTrue(len(full[0]["stdout"]) > 1000)
+        self.assertEquals(limited[0]["stdout"], full[0]["stdout"][:1000])
+        self.assertEquals(limited[0]["exitcode"], full[0]["exitcode"])
+
+    def test_skipped_elements(self):
+        filename = os.path.join(exitcode_dir, "ok.out")
+        keys = dict(self.keys)
+        keys["soft"] = ["id"]
+        self.assertTrue("id" in kickstart_parser.Parser(filename).parse(keys)[0])
+        parser = kickstart_parser.Parser(filename)
+        records = parser.parse(self.keys)
+        self.assertTrue("resource" in parser._skipped_elements)
+        self.assertFalse("id" in records[0])
+        self.assertEquals(records[0]["exitcode"], "0")
+
+    def test_signalled(self):
+        filename = os.path.join(exitcode_dir, "signalled.out")
+        # signalled is not requested in self.keys
+        records = kickstart_parser.Parser(filename).parse(self.keys)
+        self.assertEquals(len([r for r in records if "invocation" in r]), 40)
+        records = kickstart_parser.Parser(filename).parse_stampede()
+        self.assertTrue("signal" in records[0]["signalled"])
+        self.assertEquals(records[0]["signalled"]["action"], "Segmentation fault")
+
+    def test_truncated_invocation(self):
+        contents = open(os.path.join(exitcode_dir, "ok.out")).read()
+        fd, filename = tempfile.mkstemp(suffix=".out")
+        try:
+            os.write(fd, contents[:contents.find("</invocation>")])
+            os.close(fd)
+            self.assertEquals(kickstart_parser.Parser(filename).parse(self.keys), [])
+            unmapped = kickstart_parser.Parser(filename)
+            unmapped._use_mmap = False
+            self.assertEquals(unmapped.parse(self.keys), [])
+        finally:
+            os.remove(filename)
+
+if __name__ == '__main__':
+    unittest.main()
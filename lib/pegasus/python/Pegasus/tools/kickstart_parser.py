@@ -27,8 +27,10 @@ Pegasus utility functions for pasing a kickstart output file and return wanted i
 
 from xml.parsers import expat
 from Pegasus.monitoring.metadata import FileMetadata
+from Pegasus.monitoring.job import MAX_OUTPUT_LENGTH
 import re
 import sys
+import mmap
 import logging
 import traceback
 import os
@@ -36,6 +38,29 @@ import os
 # Regular expressions used in the kickstart parser
 re_parse_props = re.compile(r'(\S+)\s*=\s*([^",]+)')
 re_parse_quoted_props = re.compile(r'(\S+)\s*=\s*"([^"]+)"')
+re_record_start = re.compile(r"<invocation|\[(?:cluster|seqexec)-(?:task|summary)")
+
+# Tokens starting a record, in the order they are looked for in a line
+RECORD_TOKENS = ["<invocation", "[cluster-task", "[cluster-summary", "[seqexec-task", "[seqexec-summary"]
+
+# Elements start_element always looks at, whatever keys are requested
+JOB_ELEMENTS = frozenset(["setup", "prejob", "mainjob", "postjob", "cleanup"])
+TRACKED_ELEMENTS = JOB_ELEMENTS | frozenset(["machine", "data", "statcall"])
+
+# Elements end_element looks at
+END_ELEMENTS = JOB_ELEMENTS | frozenset(["argument-vector", "cwd", "machine", "signalled", "statcall", "data"])
+
+# Elements whose character data may be needed
+CHAR_DATA_ELEMENTS = frozenset(["argument-vector", "cwd", "signalled", "statcall", "data"])
+
+# Elements with large subtrees, and the elements in them. Their
+# subtrees are skipped unless one of these elements is requested.
+SKIPPABLE_ELEMENTS = {"environment": ["env"],
+                      "resource": ["soft", "hard"]}
+
+# pegasus-monitord never stores more than this much of the stdout and
+# stderr of a task
+STAMPEDE_OUTPUT_LIMIT = MAX_OUTPUT_LENGTH
 
 logger = logging.getLogger(__name__)
 
@@ -62,13 +87,24 @@ class Parser:
         self._parsing_final_statcall = False
         self._record_number = 0
         self._arguments = []
-        self._stdout = ""
-        self._stderr = ""
-        self._cwd = ""
+        self._stdout = []
+        self._stderr = []
+        self._stdout_size = 0
+        self._stderr_size = 0
+        self._output_limit = None
+        self._cwd = []
+        self._signalled_action = []
         self._lfn = "" # filename parsed from statcall record
         self._keys = {}
         self._ks_elements = {}
+        self._compiled_elements = None
+        self._interesting_elements = None
+        self._skipped_elements = None
+        self._skip_depth = 0
         self._fh = None
+        self._mmap = None
+        self._mmap_pos = 0
+        self._use_mmap = True
         self._open_error = False
 
     def open(self):
@@ -85,6 +121,18 @@ class Parser:
 
         # Open succeeded
         self._open_error = False
+
+        # Map the file in memory, so records can be found without
+        # reading it line by line. Empty files and files that cannot
+        # be mapped are read with readline() instead.
+        self._mmap = None
+        self._mmap_pos = 0
+        if self._use_mmap:
+            try:
+                self._mmap = mmap.mmap(self._fh.fileno(), 0, access=mmap.ACCESS_READ)
+            except (ValueError, EnvironmentError, mmap.error):
+                self._mmap = None
+
         return True
 
     def close(self):
@@ -92,24 +140,22 @@ class Parser:
         This function closes the kickstart output file.
         """
         try:
+            if self._mmap is not None:
+                self._mmap.close()
+                self._mmap = None
             self._fh.close()
         except:
             return False
 
         return True
 
-    def read_record(self):
+    def find_record(self):
         """
-        This function reads an invocation record from the kickstart
-        output file. We also look for the struct at the end of a file
-        containing multiple records. It returns a string containing
-        the record, or None if it is not found.
+        This function reads the kickstart output file until it finds
+        the beginning of a record. It returns a tuple with the token
+        found and the line containing it, or (None, None) when the end
+        of the file is reached.
         """
-        buffer = ""
-
-        #valid token that is parsed
-        token = ""
-
         self._record_number += 1
         logger.trace("Started reading record number %d from kickstart file %s" %( self._record_number, self._kickstart_output_file))
 
@@ -118,67 +164,122 @@ class Parser:
             line = self._fh.readline()
             if line == '':
                 # End of file, record not found
-                return None
+                return None, None
             if line.find("<invocation") != -1:
-                token = "<invocation"
-                break
+                return "<invocation", line
             if ( line.find("[cluster-task") != -1 ):
-                token = "[cluster-task"
-                break
+                return "[cluster-task", line
             if ( line.find("[cluster-summary") != -1 ):
-                token = "[cluster-summary"
-                break
+                return "[cluster-summary", line
             if ( line.find("[seqexec-task") != -1 ):
                 #deprecated token
-                token = "[seqexec-task"
-                break
+                return "[seqexec-task", line
             if ( line.find("[seqexec-summary") != -1 ):
                 #deprecated token
-                token = "[seqexec-summary"
+                return "[seqexec-summary", line
+
+    def find_mapped_record(self):
+        """
+        This function finds the next record in the memory-mapped
+        kickstart output file, with a single regular expression search
+        from the current position. It returns a tuple with the token
+        found and the start and end offsets of the record, or (None,
+        None, None) when there are no more records. The end offset is
+        None for an invocation record that is not complete, and equal
+        to the start offset for a malformed single line record.
+        """
+        my_map = self._mmap
+        my_size = len(my_map)
+
+        my_match = re_record_start.search(my_map, self._mmap_pos)
+        if my_match is None:
+            # End of file, record not found
+            self._mmap_pos = my_size
+            return None, None, None
+
+        self._record_number += 1
+        logger.trace("Started reading record number %d from kickstart file %s", self._record_number, self._kickstart_output_file)
+
+        my_token = my_match.group()
+        my_start = my_match.start()
+        my_line_end = my_map.find("\n", my_start)
+        if my_line_end == -1:
+            my_line_end = my_size
+
+        # find_record looks for tokens in RECORD_TOKENS order, so if
+        # the rest of the line has a token that comes first, use it
+        for my_other_token in RECORD_TOKENS[:RECORD_TOKENS.index(my_token)]:
+            my_other_start = my_map.find(my_other_token, my_start, my_line_end)
+            if my_other_start != -1:
+                my_token = my_other_token
+                my_start = my_other_start
                 break
 
-        # Found something!        
-        #if line.find("<invocation") >= 0:
-        if token == "<invocation" :
-            # Found invocation record
-            start = line.find("<invocation")
-            buffer = line[start:]
-            end = buffer.find("</invocation>")
+        if my_token == "<invocation":
+            my_end = my_map.find("</invocation>", my_start)
+            if my_end == -1:
+                # End of file, record not found
+                self._mmap_pos = my_size
+                return my_token, my_start, None
+            my_end = my_end + len("</invocation>")
+            # Continue with the line after the end of the record
+            my_line_end = my_map.find("\n", my_end)
+            if my_line_end == -1:
+                my_line_end = my_size
+        else:
+            my_end = my_map.find("]", my_start, my_line_end)
+            if my_end == -1:
+                # clustered and task records should be in a single line!
+                logger.warning("%s: %s line is malformed... ignoring it..." % (self._kickstart_output_file, my_token))
+                my_end = my_start
+            else:
+                my_end = my_end + len("]")
 
-            # Check if we have everything in a single line
-            if end >= 0:
-                end = end + len("</invocation>")
-                return buffer[:end]
-        #elif line.find("[seqexec-summary") >= 0:
-        elif ( token == "[cluster-summary" or token == "[seqexec-summary" ):
-            # Found line with cluster jobs summary
-            start = line.find(token)
-            buffer = line[start:]
-            end = buffer.find("]")
+        self._mmap_pos = my_line_end + 1
+        return my_token, my_start, my_end
 
-            if end >= 0:
-                end = end + len("]")
-                return buffer[:end]
-
-            # clustered record should be in a single line!
-            logger.warning("%s: %s line is malformed... ignoring it..." % (self._kickstart_output_file, token ))
-            return ""
-        #elif line.find("[seqexec-task") >= 0:
-        elif ( token == "[cluster-task" or token == "[seqexec-task" ):
-            # Found line with task information
-            start = line.find( token )
-            buffer = line[start:]
-            end = buffer.find("]")
+    def read_single_line_record(self, token, line):
+        """
+        This function returns the cluster summary or task record that
+        starts with token in line, or an empty string if the record is
+        malformed.
+        """
+        start = line.find(token)
+        buffer = line[start:]
+        end = buffer.find("]")
 
-            if end >= 0:
-                end = end + len("]")
-                return buffer[:end]
+        if end >= 0:
+            end = end + len("]")
+            return buffer[:end]
 
-            # task record should be in a single line!
-            logger.warning("%s: %s line is malformed... ignoring it..." % (self._kickstart_output_file, token))
-            return ""
-        else:
-            return ""
+        # clustered and task records should be in a single line!
+        logger.warning("%s: %s line is malformed... ignoring it..." % (self._kickstart_output_file, token ))
+        return ""
+
+    def read_record(self):
+        """
+        This function reads an invocation record from the kickstart
+        output file. We also look for the struct at the end of a file
+        containing multiple records. It returns a string containing
+        the record, or None if it is not found.
+        """
+        token, line = self.find_record()
+
+        if token is None:
+            return None
+
+        if token != "<invocation":
+            return self.read_single_line_record(token, line)
+
+        # Found invocation record
+        start = line.find("<invocation")
+        buffer = line[start:]
+        end = buffer.find("</invocation>")
+
+        # Check if we have everything in a single line
+        if end >= 0:
+            end = end + len("</invocation>")
+            return buffer[:end]
 
         # Ok, now continue reading the file until we get a full record
         buffer = [buffer]
@@ -188,23 +289,13 @@ class Parser:
             if line == '':
                 # End of file, record not found
                 return None
-            #buffer = buffer + line
             buffer.append( line )
             if line.find("</invocation>") >= 0:
                 break
 
-        # Now, we got it, let's make sure
-        end = line.find("</invocation>")
-        if end == -1:
-            return ""
-
-
-        #end = end + len("</invocation>")
         invocation = "".join(buffer)
         logger.trace("Finished reading record number %d from kickstart file %s" %( self._record_number, self._kickstart_output_file))
         return invocation
-        #return buffer[:end]
-
 
     def is_invocation_record(self, buffer=''):
         """
@@ -230,18 +321,92 @@ class Parser:
             return True
         return False
 
+    def compile_elements(self):
+        """
+        This function builds the tables start_element uses to ignore
+        elements we don't want, and to skip the subtrees of elements
+        that only contain elements we don't want.
+        """
+        self._interesting_elements = TRACKED_ELEMENTS | frozenset(self._ks_elements)
+        self._skipped_elements = frozenset([my_element for my_element, my_children in SKIPPABLE_ELEMENTS.items()
+                                            if not my_element in self._ks_elements
+                                            and not [my_child for my_child in my_children if my_child in self._ks_elements]])
+        self._compiled_elements = self._ks_elements
+
+    def update_char_data_handler(self):
+        """
+        This function installs char_data as the parser character data
+        handler only while we are inside an element whose character
+        data we want, so expat doesn't call us for anything else.
+        """
+        if (self._parsing_cwd or self._parsing_arguments or self._parsing_signalled or
+            (self._parsing_data and
+             ((self._parsing_stdout and not self.output_full(self._stdout_size)) or
+              (self._parsing_stderr and not self.output_full(self._stderr_size))))):
+            self._my_parser.CharacterDataHandler = self.char_data
+        else:
+            self._my_parser.CharacterDataHandler = None
+
+    def output_full(self, size):
+        """
+        Returns True if we already have as much stdout or stderr as we
+        want to keep.
+        """
+        return self._output_limit is not None and size >= self._output_limit
+
+    def add_output(self, output, size, data):
+        """
+        This function adds data to the output list, keeping at most
+        the output limit, and returns the new output size.
+        """
+        if self._output_limit is not None:
+            if size >= self._output_limit:
+                return size
+            data = data[:self._output_limit - size]
+        output.append(data)
+        size = size + len(data)
+        if self.output_full(size):
+            # Got all we want, ignore the rest
+            self.update_char_data_handler()
+        return size
+
+    def skip_start_element(self, name, attrs):
+        """
+        Function called by the parser for elements inside a skipped subtree
+        """
+        self._skip_depth += 1
+
+    def skip_end_element(self, name):
+        """
+        Function called by the parser at the end of elements inside a
+        skipped subtree, restoring the regular handlers when we leave it
+        """
+        self._skip_depth -= 1
+        if self._skip_depth == 0:
+            self._my_parser.StartElementHandler = self.start_element
+            self._my_parser.EndElementHandler = self.end_element
+            self.update_char_data_handler()
+
     def start_element(self, name, attrs):
         """
         Function called by the parser every time a new element starts
         """
+        if not name in self._interesting_elements:
+            if name in self._skipped_elements:
+                # Ignore everything until this element ends
+                self._skip_depth = 1
+                self._my_parser.StartElementHandler = self.skip_start_element
+                self._my_parser.EndElementHandler = self.skip_end_element
+                self._my_parser.CharacterDataHandler = None
+            return
+
         # Keep track if we are parsing the main job element
         if name == "mainjob":
             self._parsing_main_job = True
         if name == "machine":
             self._parsing_machine = True
         # Keep track if we are inside one of the job elements
-        if (name == "setup" or name == "prejob" or
-            name == "mainjob" or name == "postjob" or name == "cleanup"):
+        if name in JOB_ELEMENTS:
                 self._parsing_job_element = True
         if name == "argument-vector" and name in self._ks_elements:
             # Start parsing arguments
@@ -280,7 +445,7 @@ class Parser:
             # PM-1109 grab the attributes we are interested in
             self._keys[ name ] = {} #a dictionary indexed by attributes
             self._parsing_signalled = True
-            self._keys[ name ]["action"] = "" #grabbed later in char data
+            self._signalled_action = [] #grabbed later in char data
             for attr in attrs:
                 if attr in self._ks_elements[name]:
                     self._keys[name][attr] = attrs[attr]
@@ -328,10 +493,16 @@ class Parser:
                     if my_element in attrs:
                         self._keys[my_element] = attrs[my_element]
 
+        if name in CHAR_DATA_ELEMENTS:
+            self.update_char_data_handler()
+
     def end_element(self, name):
         """
         Function called by the parser whenever we reach the end of an element
         """
+        if not name in END_ELEMENTS:
+            return
+
         # Stop parsing argement-vector and cwd if we reached the end of those elements
         if name == "argument-vector":
             self._parsing_arguments = False
@@ -342,6 +513,8 @@ class Parser:
         elif name == "machine":
             self._parsing_machine = False
         elif name == "signalled":
+            if self._parsing_signalled == True:
+                self._keys["signalled"]["action"] = "".join(self._signalled_action)
             self._parsing_signalled = False
         elif name == "statcall":
             if self._parsing_stdout == True:
@@ -362,32 +535,35 @@ class Parser:
         elif name == "data":
             self._parsing_data = False
         # Now, see if we left one of the job elements
-        if (name == "setup" or name == "prejob" or
-            name == "mainjob" or name == "postjob" or name == "cleanup"):
+        if name in JOB_ELEMENTS:
                 self._parsing_job_element = False
 
+        if name in CHAR_DATA_ELEMENTS:
+            self.update_char_data_handler()
+
     def char_data(self, data=''):
         """
         Function called by the parser whenever there's character data in an element
         """
         if self._parsing_cwd == True:
-            self._cwd += data
+            self._cwd.append(data)
 
         elif self._parsing_arguments == True:
             self._arguments.append(data.strip())
 
         elif self._parsing_stdout == True and self._parsing_data == True:
-            self._stdout += data
+            self._stdout_size = self.add_output(self._stdout, self._stdout_size, data)
 
         elif self._parsing_stderr == True and self._parsing_data == True:
-            self._stderr += data
+            self._stderr_size = self.add_output(self._stderr, self._stderr_size, data)
 
         elif self._parsing_signalled == True:
-            self._keys["signalled"]["action"] += data
+            self._signalled_action.append(data)
 
-    def parse_invocation_record(self, buffer=''):
+    def start_invocation_record(self):
         """
-        Parses the xml record in buffer, returning the desired keys.
+        This function resets the parser state and creates a new expat
+        parser for an invocation record.
         """
         # Initialize variables
         self._parsing_arguments = False
@@ -399,45 +575,111 @@ class Parser:
         self._parsing_cwd = False
         self._parsing_signalled = False
         self._arguments = []
-        self._stdout = ""
-        self._stderr = ""
-        self._cwd = ""
+        self._stdout = []
+        self._stderr = []
+        self._stdout_size = 0
+        self._stderr_size = 0
+        self._cwd = []
+        self._signalled_action = []
         self._keys = {}
+        self._skip_depth = 0
 
-        # Check if we have an invocation record
-        if self.is_invocation_record(buffer) == False:
-            return self._keys
+        if self._compiled_elements is not self._ks_elements:
+            self.compile_elements()
 
         # Add invocation key to our response
         self._keys["invocation"] = True
 
-        # Prepend XML header
-        buffer = '<?xml version="1.0" encoding="ISO-8859-1"?>\n' + buffer
-
         # Create parser
         self._my_parser = expat.ParserCreate()
         self._my_parser.StartElementHandler = self.start_element
         self._my_parser.EndElementHandler = self.end_element
-        self._my_parser.CharacterDataHandler = self.char_data
+        self._my_parser.CharacterDataHandler = None
 
-        # Parse everything!
-        output = self._my_parser.Parse(buffer)
+        # Feed XML header
+        self._my_parser.Parse('<?xml version="1.0" encoding="ISO-8859-1"?>\n')
+
+    def finish_invocation_record(self):
+        """
+        This function adds cwd, arguments, stdout, and stderr to the
+        keys of the invocation record just parsed, and returns them.
+        """
+        self._my_parser = None
 
-        # Add cwd, arguments, stdout, and stderr to keys
         if "cwd" in self._ks_elements:
-            self._keys["cwd"] = self._cwd
+            self._keys["cwd"] = "".join(self._cwd)
 
         if "argument-vector" in self._ks_elements:
             self._keys["argument-vector"] = " ".join(self._arguments)
 
         if "stdout" in self._ks_elements:
-            self._keys["stdout"] = self._stdout
+            self._keys["stdout"] = "".join(self._stdout)
 
         if "stderr" in self._ks_elements:
-            self._keys["stderr"] = self._stderr
+            self._keys["stderr"] = "".join(self._stderr)
 
         return self._keys
 
+    def parse_invocation_record(self, buffer=''):
+        """
+        Parses the xml record in buffer, returning the desired keys.
+        """
+        # Check if we have an invocation record
+        if self.is_invocation_record(buffer) == False:
+            self._keys = {}
+            return self._keys
+
+        self.start_invocation_record()
+
+        # Parse everything!
+        self._my_parser.Parse(buffer)
+
+        return self.finish_invocation_record()
+
+    def parse_invocation_stream(self, line):
+        """
+        This function parses the invocation record starting in line,
+        feeding it to expat as it is read from the kickstart output
+        file, so the record is never held in memory as a whole. It
+        returns the desired keys, or None if the file ends before the
+        record does.
+        """
+        self.start_invocation_record()
+
+        line = line[line.find("<invocation"):]
+
+        while True:
+            end = line.find("</invocation>")
+            if end >= 0:
+                # Leave out anything after the end of the record
+                self._my_parser.Parse(line[:end + len("</invocation>")])
+                break
+            self._my_parser.Parse(line)
+            line = self._fh.readline()
+            if line == '':
+                # End of file, record not found
+                self._my_parser = None
+                return None
+
+        logger.trace("Finished reading record number %d from kickstart file %s" %( self._record_number, self._kickstart_output_file))
+        return self.finish_invocation_record()
+
+    def parse_mapped_invocation(self, start, end):
+        """
+        This function parses the invocation record between the start
+        and end offsets of the memory-mapped kickstart output file,
+        handing expat a slice of the mapping without copying it. It
+        returns the desired keys, or None if the record is incomplete.
+        """
+        if end is None:
+            return None
+
+        self.start_invocation_record()
+        self._my_parser.Parse(buffer(self._mmap, start, end - start))
+
+        logger.trace("Finished reading record number %d from kickstart file %s", self._record_number, self._kickstart_output_file)
+        return self.finish_invocation_record()
+
     def parse_clustered_record(self, buffer=''):
         """
         Parses the clustered record in buffer, returning all found keys
@@ -484,7 +726,7 @@ class Parser:
 
         return self._keys
 
-    def parse(self, keys_dict, tasks=True, clustered=True):
+    def parse(self, keys_dict, tasks=True, clustered=True, output_limit=None):
         """
         This function parses the kickstart output file, looking for
         the keys specified in the keys_dict variable. It returns a
@@ -492,11 +734,14 @@ class Parser:
         parse_stampede function for details about how to pass keys
         using the keys_dict structure. The function will return an
         empty list if no records are found or if an error happens.
+        If output_limit is set, only the first output_limit characters
+        of the stdout and stderr of each record are kept.
         """
         my_reply = []
 
         # Place keys_dict in the _ks_elements
         self._ks_elements = keys_dict
+        self._output_limit = output_limit
 
         # Try to open the file
         if self.open() == False:
@@ -505,15 +750,23 @@ class Parser:
         logger.debug( "Started reading records from kickstart file %s" %(self._kickstart_output_file))
 
         self._record_number = 0
-        # Read first record
-        my_buffer = self.read_record()
 
         # Loop while we still have record to read
-        while my_buffer is not None:
-            if self.is_invocation_record(my_buffer) == True:
-                # We have an invocation record, parse it!
+        while True:
+            if self._mmap is not None:
+                my_token, my_start, my_end = self.find_mapped_record()
+            else:
+                my_token, my_line = self.find_record()
+            if my_token is None:
+                break
+
+            if my_token == "<invocation":
+                # We have an invocation record, parse it as we read it!
                 try:
-                    my_record = self.parse_invocation_record(my_buffer)
+                    if self._mmap is not None:
+                        my_record = self.parse_mapped_invocation(my_start, my_end)
+                    else:
+                        my_record = self.parse_invocation_stream(my_line)
                 except:
                     logger.warning("KICKSTART-PARSE-ERROR --> error parsing invocation record in file %s"
                                    % (self._kickstart_output_file))
@@ -522,8 +775,17 @@ class Parser:
                     my_reply = []
                     # Finish the loop
                     break
+                if my_record is None:
+                    # Incomplete record at the end of the file
+                    break
                 my_reply.append(my_record)
-            elif self.is_clustered_record(my_buffer) == True:
+                continue
+
+            if self._mmap is not None:
+                my_buffer = self._mmap[my_start:my_end]
+            else:
+                my_buffer = self.read_single_line_record(my_token, my_line)
+            if self.is_clustered_record(my_buffer) == True:
                 # Check if we want clustered records too
                 if clustered:
                     # Clustered records are seqexec summary records for clustered jobs
@@ -539,9 +801,6 @@ class Parser:
                 # Just skip it
                 pass
 
-            # Read next record
-            my_buffer = self.read_record()
-
         # Lastly, close the file
         self.close()
 
@@ -572,7 +831,7 @@ class Parser:
                              "checksum": ["type", "value"],
                              "type": ["type", "value"]}
 
-        return self.parse(stampede_elements, tasks=True, clustered=True)
+        return self.parse(stampede_elements, tasks=True, clustered=True, output_limit=STAMPEDE_OUTPUT_LIMIT)
 
     def parse_stdout_stderr(self):
         """